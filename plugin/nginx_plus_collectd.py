@@ -1,11 +1,42 @@
 #!/usr/bin/env python
 import os
+import re
 import sys
+import json
 import time
+import stat
+import mmap
+import fcntl
+import struct
+import signal
+import socket
+import argparse
+import threading
+import calendar
 import logging
+import heapq
+import bisect
+import hashlib
+import urllib
+import fnmatch
+import functools
+import SocketServer
+import BaseHTTPServer
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 import requests
 from requests.exceptions import RequestException
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
 class MetricDefinition(object):
     '''
     Struct for information needed to build a metric.
@@ -20,6 +51,66 @@ class MetricDefinition(object):
         self.name = name
         self.type = metric_type
         self.scoped_object_key = scoped_object_key
+        # Split once so the path is not re-parsed for every extracted value
+        self.scoped_object_path = scoped_object_key.split('.')
+
+    def extract(self, scoped_obj):
+        '''
+        Extract the value of the metric from the given object, None if absent.
+        '''
+        return _reduce_to_path(scoped_obj, self.scoped_object_path)
+
+class DerivedMetricDefinition(object):
+    '''
+    Struct for information needed to build a gauge computed from other values
+    of the same object, in the same snapshot. The expression is compiled once.
+
+    Constructor Arguements:
+        name: The name of the metric
+        expression: An arithmetic expression (+, -, *, / and parentheses) over numbers
+                    and "." delineated paths to values within the object, e.g.
+                    "responses.5xx / responses.total"
+    '''
+    def __init__(self, name, expression):
+        self.name = name
+        self.type = 'gauge'
+        self.expression = expression
+        self.input_paths = []
+
+        def replace_token(match):
+            token = match.group(0)
+            if NUMBER_PATTERN.match(token):
+                return token
+            path = token.split('.')
+            if path not in self.input_paths:
+                self.input_paths.append(path)
+            return '_values[{}]'.format(self.input_paths.index(path))
+
+        source = EXPRESSION_TOKEN_PATTERN.sub(replace_token, expression)
+        if not EXPRESSION_OPERATORS_PATTERN.match(EXPRESSION_TOKEN_PATTERN.sub('', expression)):
+            raise ValueError('Invalid derived metric expression: {}'.format(expression))
+        self._code = compile(source, '<{}>'.format(name), 'eval')
+
+        # The counters the expression reads, e.g. summed when objects are folded
+        self.input_metrics = [MetricDefinition(name, 'counter', '.'.join(path)) for path in self.input_paths]
+
+    def extract(self, scoped_obj):
+        '''
+        Evaluate the expression over the given object, None if a value is absent
+        or the expression divides by zero.
+        '''
+        values = [_reduce_to_path(scoped_obj, path) for path in self.input_paths]
+        if None in values:
+            return None
+        try:
+            return eval(self._code, {'__builtins__' : {}}, {'_values' : [float(value) for value in values]})
+        except ZeroDivisionError:
+            return None
+
+# Tokens of derived metric expressions: numbers and paths, only operators may remain between them
+NUMBER_PATTERN = re.compile(r'^\d+(\.\d+)?$')
+EXPRESSION_TOKEN_PATTERN = re.compile(r'[\w.]+')
+EXPRESSION_OPERATORS_PATTERN = re.compile(r'^[-+*/()\s]*$')
 
 class MetricEmitter(object):
     '''
@@ -33,10 +124,21 @@ class MetricEmitter(object):
                         * An instance of MetricSink
 
         metrics: A list of MetricDefinition, the metrics to be built and emitted by emit_func
+
+        group: Optional MetricGroup the emitter was generated from
+        read_multiple: Emit on every Nth read only, defaults to every read
     '''
-    def __init__(self, emit_func, metrics):
+    def __init__(self, emit_func, metrics, group=None, read_multiple=1):
         self.emit_func = emit_func
         self.metrics = metrics
+        self.group = group
+        self.read_multiple = read_multiple
+
+    def is_due(self, read_count):
+        '''
+        Check if the emitter is scheduled for the given read.
+        '''
+        return read_count % self.read_multiple == 0
 
     def emit(self, sink):
         '''
@@ -44,6 +146,460 @@ class MetricEmitter(object):
         '''
         self.emit_func(self.metrics, sink)
 
+    def can_merge(self, other):
+        '''
+        Two emitters can be merged when they read the same endpoint with the same
+        traversal, i.e. they were generated from metric groups with the same name or
+        wrap the same emit function.
+        '''
+        if self.group and other.group:
+            return self.group.name == other.group.name and self.read_multiple == other.read_multiple
+        return self.emit_func == other.emit_func
+
+    def merge(self, other):
+        '''
+        Fold the metric definitions of another emitter into this one, skipping
+        definitions that are already present.
+        '''
+        known_names = set(metric.name for metric in self.metrics)
+        self.metrics = self.metrics + [metric for metric in other.metrics if metric.name not in known_names]
+
+class MetricGroup(object):
+    '''
+    Declares how a group of metrics is read from the NGINX+ status API.
+
+    Constructor Arguements:
+        name: The name of the group. Groups sharing a name share the same endpoint and
+                traversal, their emitters are merged into a single pass.
+        config_key: The configuration flag opting-in to the group, None for default groups
+        fetch_name: The name of the NginxStatusAgent method fetching the endpoint
+        traversal: How the values are located within the endpoint's JSON, one of
+                    FLAT_TRAVERSAL, CONTAINER_TRAVERSAL or PEER_TRAVERSAL
+        dimension_names: The dimension names given to the container (and peer) names
+        metrics: A list of MetricDefinition
+        rank_key: Optional "." delineated path to the traffic value containers (peers) are
+                    ranked by when a series budget is exceeded, ranked by name otherwise
+    '''
+    def __init__(self, name, config_key, fetch_name, traversal, dimension_names, metrics, rank_key=None):
+        self.name = name
+        self.config_key = config_key
+        self.fetch_name = fetch_name
+        self.traversal = traversal
+        self.dimension_names = dimension_names
+        self.metrics = metrics
+        self.rank_path = rank_key.split('.') if rank_key else None
+
+class PeerRollup(object):
+    '''
+    Declares the per-container aggregates computed over the peers of a peer group.
+
+    Constructor Arguements:
+        prefix: The prefix of the peer state count metric names, e.g. "upstreams"
+                produces "upstreams.peers.up"
+        metrics: A list of MetricDefinition, each value is summed over the peers of a container
+    '''
+    def __init__(self, prefix, metrics):
+        self.prefix = prefix
+        self.metrics = metrics
+        self.state_metrics = [MetricDefinition('{}.peers.{}'.format(prefix, state), 'gauge', state)\
+                              for state in PEER_STATES]
+        self.total_metric = MetricDefinition('{}.peers.total'.format(prefix), 'gauge', 'total')
+
+    def aggregate(self, peers):
+        '''
+        Sum the metric values over the given peers and count the peers in each state.
+        Returns a list of (MetricDefinition, value) pairs, None values are not emitted.
+        '''
+        sums = [None] * len(self.metrics)
+        state_counts = dict.fromkeys(PEER_STATES, 0)
+
+        for peer in peers:
+            for index, metric in enumerate(self.metrics):
+                value = _reduce_to_path(peer, metric.scoped_object_path)
+                if value is not None:
+                    sums[index] = value if sums[index] is None else sums[index] + value
+
+            state = peer.get('state')
+            if state in state_counts:
+                state_counts[state] += 1
+
+        metric_values = zip(self.metrics, sums)
+        metric_values.extend((metric, state_counts[metric.scoped_object_key]) for metric in self.state_metrics)
+        metric_values.append((self.total_metric, len(peers)))
+        return metric_values
+
+    def aggregate_columns(self, columns):
+        '''
+        Compute the aggregates of every container of a PeerColumns snapshot at once.
+        Returns a dict of the lists of (MetricDefinition, value) pairs, keyed by container name.
+        '''
+        sums = [columns.sums(metric.scoped_object_key) for metric in self.metrics]
+        state_counts = [columns.counts(state) for state in PEER_STATES]
+        totals = columns.counts()
+
+        container_metric_values = {}
+        for index, container_name in enumerate(columns.container_names):
+            metric_values = [(metric, metric_sums[index]) for metric, metric_sums in zip(self.metrics, sums)]
+            metric_values.extend((metric, counts[index]) for metric, counts in zip(self.state_metrics, state_counts))
+            metric_values.append((self.total_metric, totals[index]))
+            container_metric_values[container_name] = metric_values
+        return container_metric_values
+
+class PeerDistribution(object):
+    '''
+    Declares per-container distribution summaries of peer values, e.g. the latency of
+    the peers of an upstream. Each peer is weighted by a counter such as its request count.
+
+    Constructor Arguements:
+        weight_key: A "." delineated path to the peer value weighting each peer
+        metrics: A list of MetricDefinition, the distribution of each value across the peers
+                    is emitted as "<name>.min", "<name>.max", "<name>.mean", "<name>.p50", ...
+    '''
+    def __init__(self, weight_key, metrics):
+        self.weight_path = weight_key.split('.')
+        self.metrics = metrics
+        self.summary_metrics = [dict((stat, MetricDefinition('{}.{}'.format(metric.name, stat), 'gauge', stat))\
+                                     for stat in DISTRIBUTION_STATS) for metric in metrics]
+
+    def aggregate(self, peers):
+        '''
+        Compute the distribution summaries over the given peers in a single pass.
+        Returns a list of (MetricDefinition, value) pairs.
+        '''
+        samples = [[] for _ in self.metrics]
+        for peer in peers:
+            weight = _reduce_to_path(peer, self.weight_path) or 0
+            for index, metric in enumerate(self.metrics):
+                value = _reduce_to_path(peer, metric.scoped_object_path)
+                if value is not None:
+                    samples[index].append((value, weight))
+
+        metric_values = []
+        for summary_metrics, metric_samples in zip(self.summary_metrics, samples):
+            if metric_samples:
+                summary = _weighted_summary(metric_samples)
+                metric_values.extend((summary_metrics[stat], summary[stat]) for stat in DISTRIBUTION_STATS)
+        return metric_values
+
+class PeerColumns(object):
+    '''
+    Columnar snapshot of the peers of a peer group, with one column of values per field.
+    Columns are NumPy arrays when NumPy is installed, of 64 bit integers so large counters
+    keep their precision (of Python objects if any value is not such an integer), with a
+    mask of the values present. Otherwise columns are lists, missing values being None.
+    Aggregates and changes against a previous snapshot are computed a column at a time.
+
+    Constructor Arguements:
+        containers_obj: The containers of the peer group, keyed by container name
+        column_keys: The "." delineated paths to the peer values taken as columns
+        use_numpy: Optional, build NumPy columns, defaults to whether NumPy is installed
+    '''
+    def __init__(self, containers_obj, column_keys, use_numpy=None):
+        self.use_numpy = numpy is not None if use_numpy is None else use_numpy
+        self.container_names = []
+        self.keys = []
+        peers = []
+        container_indexes = []
+        for container_name, container in (containers_obj or {}).iteritems():
+            container_indexes.extend([len(self.container_names)] * len(container['peers']))
+            self.container_names.append(container_name)
+            self.keys.extend((container_name, peer.get('name')) for peer in container['peers'])
+            peers.extend(container['peers'])
+
+        # Position of each (container name, peer name) key within the columns
+        self.positions = dict((key, position) for position, key in enumerate(self.keys))
+        self.columns = {}
+        # Column key -> mask of the values present, NumPy columns only
+        self.present = {}
+        for column_key in column_keys:
+            if column_key not in self.columns:
+                # Each path segment is resolved for the whole column at once
+                values = peers
+                for key in column_key.split('.'):
+                    values = [value.get(key) if isinstance(value, dict) else None for value in values]
+                if self.use_numpy:
+                    self.columns[column_key], self.present[column_key] = _to_int64_column(values)
+                else:
+                    self.columns[column_key] = values
+
+        states = [peer.get('state') for peer in peers]
+        if self.use_numpy:
+            self.container_indexes = numpy.array(container_indexes, dtype=int)
+            self.states = numpy.array(states, dtype=object)
+        else:
+            self.container_indexes = container_indexes
+            self.states = states
+
+    def sums(self, column_key):
+        '''
+        Sum a column over the peers of each container, in container_names order.
+        The sum of a container without any value is None.
+        '''
+        column = self.columns[column_key]
+        if self.use_numpy:
+            present = self.present[column_key]
+            container_indexes = self.container_indexes[present]
+            # Summed in the column's own type, bincount weights would round counters to floats
+            sums = numpy.zeros(len(self.container_names), dtype=column.dtype)
+            numpy.add.at(sums, container_indexes, column[present])
+            counts = numpy.bincount(container_indexes, minlength=len(self.container_names))
+            return [_to_number(total) if count else None for total, count in zip(sums, counts)]
+
+        sums = [None] * len(self.container_names)
+        for container_index, value in zip(self.container_indexes, column):
+            if value is not None:
+                total = sums[container_index]
+                sums[container_index] = value if total is None else total + value
+        return sums
+
+    def counts(self, state=None):
+        '''
+        Count the peers of each container, in container_names order, only those
+        in the given state if any.
+        '''
+        if self.use_numpy:
+            weights = (self.states == state).astype(float) if state else None
+            counts = numpy.bincount(self.container_indexes, weights=weights, minlength=len(self.container_names))
+            return [int(count) for count in counts]
+
+        counts = [0] * len(self.container_names)
+        for container_index, peer_state in zip(self.container_indexes, self.states):
+            if state is None or peer_state == state:
+                counts[container_index] += 1
+        return counts
+
+    def changed_keys(self, previous, column_keys):
+        '''
+        Get the keys of the peers that are not in the previous snapshot, or with a
+        value in any of the given columns that differs from the previous snapshot.
+        '''
+        if previous is None or not previous.keys or previous.use_numpy != self.use_numpy:
+            return set(self.keys)
+
+        previous_positions = [previous.positions.get(key, -1) for key in self.keys]
+        if self.use_numpy:
+            previous_positions = numpy.array(previous_positions, dtype=int)
+            changed = previous_positions < 0
+            for column_key in column_keys:
+                previous_column = previous.columns[column_key][previous_positions]
+                previous_present = previous.present[column_key][previous_positions]
+                changed |= numpy.asarray(self.columns[column_key] != previous_column, dtype=bool)
+                changed |= self.present[column_key] != previous_present
+            return set(self.keys[position] for position in numpy.flatnonzero(changed))
+
+        rows = zip(*[self.columns[column_key] for column_key in column_keys]) or [()] * len(self.keys)
+        previous_rows = zip(*[previous.columns[column_key] for column_key in column_keys]) or [()] * len(previous.keys)
+        return set(key for key, row, previous_position in zip(self.keys, rows, previous_positions)\
+                   if previous_position < 0 or row != previous_rows[previous_position])
+
+class PeerEvent(object):
+    '''
+    Struct for a change of the peers of a peer group between two reads.
+
+    Constructor Arguements:
+        kind: One of PEER_ADDED, PEER_REMOVED or PEER_STATE_CHANGED
+        container_name: The name of the container (upstream) of the peer
+        peer_name: The name of the peer
+        old_state: The state of the peer on the previous read, None if added
+        new_state: The state of the peer on this read, None if removed
+    '''
+    def __init__(self, kind, container_name, peer_name, old_state, new_state):
+        self.kind = kind
+        self.container_name = container_name
+        self.peer_name = peer_name
+        self.old_state = old_state
+        self.new_state = new_state
+
+class PeerIndexEntry(object):
+    '''
+    Struct for the indexed name, state and dimensions of a peer.
+    '''
+    def __init__(self, name, state, dimensions):
+        self.name = name
+        self.state = state
+        self.dimensions = dimensions
+
+class PeerIndex(object):
+    '''
+    Incremental index of the peers of a peer group, keyed by container name and peer id.
+    Consecutive reads are diffed into PeerEvents, and the dimensions of each peer are
+    built once and reused for as long as the peer is unchanged.
+
+    Constructor Arguements:
+        container_dim_name: The dimension name given to the container names
+        peer_dim_name: The dimension name given to the peer names
+    '''
+    def __init__(self, container_dim_name, peer_dim_name):
+        self.container_dim_name = container_dim_name
+        self.peer_dim_name = peer_dim_name
+        self.entries = {}
+        self._global_dimensions = None
+        self._initialized = False
+
+    def update(self, containers_obj, global_dimensions):
+        '''
+        Index the peers of this read and diff them with the previous read. Returns the list
+        of PeerEvents, empty on the first read. A peer whose id is given to a peer with
+        another name is removed and added.
+        '''
+        if global_dimensions != self._global_dimensions:
+            # Dimensions built with the former global dimensions are rebuilt
+            self._global_dimensions = global_dimensions.copy()
+            for (container_name, _), entry in self.entries.iteritems():
+                entry.dimensions = self._build_dimensions(container_name, entry.name)
+
+        events = []
+        entries = {}
+        for container_name, container in (containers_obj or {}).iteritems():
+            for peer in container.get('peers', []):
+                key = (container_name, _peer_id(peer))
+                name = peer.get('name')
+                state = peer.get('state')
+                entry = self.entries.get(key)
+                if entry is None or entry.name != name:
+                    if entry is not None:
+                        events.append(PeerEvent(PEER_REMOVED, container_name, entry.name, entry.state, None))
+                    events.append(PeerEvent(PEER_ADDED, container_name, name, None, state))
+                    entry = PeerIndexEntry(name, state, self._build_dimensions(container_name, name))
+                elif entry.state != state:
+                    events.append(PeerEvent(PEER_STATE_CHANGED, container_name, name, entry.state, state))
+                    entry.state = state
+                entries[key] = entry
+
+        events.extend(PeerEvent(PEER_REMOVED, key[0], entry.name, entry.state, None)\
+                      for key, entry in self.entries.iteritems() if key not in entries)
+        self.entries = entries
+
+        if not self._initialized:
+            self._initialized = True
+            return []
+        return events
+
+    def dimensions(self, container_name, peer):
+        '''
+        Get the indexed dimensions of a peer, None if the peer is not indexed.
+        '''
+        entry = self.entries.get((container_name, _peer_id(peer)))
+        if entry is None or entry.name != peer.get('name'):
+            return None
+        return entry.dimensions
+
+    def _build_dimensions(self, container_name, peer_name):
+        dimensions = {self.container_dim_name : container_name, self.peer_dim_name : peer_name}
+        dimensions.update(self._global_dimensions)
+        return dimensions
+
+class AdaptiveInterval(object):
+    '''
+    Adapts the interval between the reads of an instance to how much its key metrics
+    change: the request rate, the 5xx responses and the active connections. The interval
+    doubles, up to the maximum, while the metrics are stable and drops back to the minimum
+    on a spike, on new 5xx responses or when the counters are reset.
+
+    Constructor Arguements:
+        min_interval: The shortest interval between reads, in seconds
+        max_interval: The longest interval between reads, in seconds
+    '''
+    def __init__(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self._last_sample = None
+        self._last_request_rate = None
+
+    def is_due(self, now):
+        '''
+        Check whether an instance last read at the previous sample is due to be read.
+        Reads are started by a scheduler ticking at about the minimum interval, so
+        half of it is allowed for the scheduling jitter.
+        '''
+        return self._last_sample is None or now - self._last_sample[0] >= self.interval - self.min_interval / 2.0
+
+    def update(self, now, requests_total, errors_total, active_connections):
+        '''
+        Record the key metrics of a read and adapt the interval. Metrics not read are None.
+        Returns the new interval.
+        '''
+        last_sample = self._last_sample
+        self._last_sample = (now, requests_total, errors_total, active_connections)
+        if not last_sample:
+            return self.interval
+
+        last_time, last_requests_total, last_errors_total, last_active_connections = last_sample
+        spike = False
+        changes = []
+
+        request_rate = None
+        if requests_total is not None and last_requests_total is not None:
+            spike = requests_total < last_requests_total
+            request_rate = (requests_total - last_requests_total) / max(now - last_time, 1e-3)
+            if self._last_request_rate is not None:
+                changes.append(_relative_change(self._last_request_rate, request_rate))
+        self._last_request_rate = request_rate
+
+        if errors_total is not None and last_errors_total is not None:
+            spike = spike or errors_total != last_errors_total
+        if active_connections is not None and last_active_connections is not None:
+            changes.append(_relative_change(last_active_connections, active_connections))
+
+        if spike or (changes and max(changes) >= ADAPTIVE_SPIKE_CHANGE):
+            self.interval = self.min_interval
+        elif changes and max(changes) <= ADAPTIVE_STABLE_CHANGE:
+            self.interval = min(self.interval * 2, self.max_interval)
+        return self.interval
+
+class NameFilter(object):
+    '''
+    Include and exclude lists of patterns matched against container or peer names.
+    Patterns are regular expressions (searched within the name) or, when prefixed
+    with "glob:", shell-style globs matching the whole name. A name passes the filter
+    if it matches any include pattern, or no include patterns are given, and does not
+    match any exclude pattern. Patterns are compiled once and match results are cached
+    as names repeat from one read to the next.
+    '''
+    MAX_CACHED_NAMES = 10000
+
+    def __init__(self):
+        self.includes = []
+        self.excludes = []
+        self._literal_includes = []
+        self._matches = {}
+
+    def add_include(self, pattern):
+        self.includes.append(self._compile(pattern))
+        if self._literal_includes is not None:
+            literal_name = _literal_pattern_value(pattern)
+            self._literal_includes = self._literal_includes + [literal_name] if literal_name is not None else None
+        self._matches.clear()
+
+    def add_exclude(self, pattern):
+        self.excludes.append(self._compile(pattern))
+        self._matches.clear()
+
+    @property
+    def literal_names(self):
+        '''
+        The exact names selected by the include patterns, or None if the include patterns
+        are not all literal names (or there are none).
+        '''
+        return self._literal_includes if self.includes else None
+
+    def matches(self, name):
+        '''
+        Check if the name passes the filter.
+        '''
+        if name not in self._matches:
+            if len(self._matches) >= NameFilter.MAX_CACHED_NAMES:
+                self._matches.clear()
+            self._matches[name] = (not self.includes or any(pattern.search(name) for pattern in self.includes))\
+                and not any(pattern.search(name) for pattern in self.excludes)
+        return self._matches[name]
+
+    def _compile(self, pattern):
+        if pattern.startswith(GLOB_PATTERN_PREFIX):
+            return re.compile(fnmatch.translate(pattern[len(GLOB_PATTERN_PREFIX):]))
+        return re.compile(pattern)
+
 class MetricRecord(object):
     '''
     Struct for all information needed to emit a single collectd metric.
@@ -80,7 +636,7 @@ class MetricSink(object):
         emit_value.type = metric_record.type
         emit_value.type_instance = metric_record.name
         emit_value.plugin_instance = metric_record.instance_id
-        emit_value.plugin_instance += '[{}]'.format(self._format_dimensions(metric_record.dimensions))
+        emit_value.plugin_instance += '[{}]'.format(_format_dimensions(metric_record.dimensions))
 
         # With some versions of CollectD, a dummy metadata map must to be added
         # to each value for it to be correctly serialized to JSON by the
@@ -90,12 +646,201 @@ class MetricSink(object):
 
         emit_value.dispatch()
 
-    def _format_dimensions(self, dimensions):
+class NotificationRecord(object):
+    '''
+    Struct for all information needed to dispatch a single collectd notification.
+    NotificationSink is the expected consumer of instances of this class.
+    '''
+    TO_STRING_FORMAT = '[name={},severity={},message={},instance_id={},dimensions={},timestamp={}]'
+
+    def __init__(self, name, severity, message, instance_id, dimensions=None, timestamp=None):
+        self.name = name
+        self.severity = severity
+        self.message = message
+        self.instance_id = instance_id
+        self.dimensions = dimensions or {}
+        self.timestamp = timestamp or time.time()
+
+    def to_string(self):
+        return NotificationRecord.TO_STRING_FORMAT.format(self.name, self.severity, self.message,\
+            self.instance_id, self.dimensions, self.timestamp)
+
+class NotificationSink(object):
+    '''
+    Responsible for transforming and dispatching a NotificationRecord via collectd.
+    '''
+    def notify(self, notification_record):
+        '''
+        Construct a single collectd Notification instance from the given
+        NotificationRecord and dispatch.
+        '''
+        notification = collectd.Notification()
+
+        notification.time = notification_record.timestamp
+        notification.severity = getattr(collectd, 'NOTIF_' + notification_record.severity.upper())
+        notification.message = notification_record.message
+        notification.plugin = 'nginx-plus'
+        notification.type = 'gauge'
+        notification.type_instance = notification_record.name
+        notification.plugin_instance = notification_record.instance_id
+        notification.plugin_instance += '[{}]'.format(_format_dimensions(notification_record.dimensions))
+
+        notification.dispatch()
+
+class ChangeOnlyMetricSink(object):
+    '''
+    Wraps a sink, dispatching a record only when its value changed since the last
+    dispatch of the same series. Unchanged values are re-sent once the heartbeat
+    interval has elapsed so the series does not look stale downstream.
+
+    Constructor Arguements:
+        sink: The sink records are forwarded to
+        heartbeat: Seconds after which an unchanged value is dispatched again
+    '''
+    def __init__(self, sink, heartbeat):
+        self.sink = sink
+        self.heartbeat = heartbeat
+        # Series key -> (last dispatched value, dispatch time, last seen time)
+        self._last_dispatched = {}
+        self._last_pruned = time.time()
+
+    def emit(self, metric_record):
+        '''
+        Forward the record to the wrapped sink unless it repeats the last
+        dispatched value of its series within the heartbeat interval.
+        '''
+        now = metric_record.timestamp
+        key = _series_key(metric_record)
+        last = self._last_dispatched.get(key)
+
+        if last and last[0] == metric_record.value and now - last[1] < self.heartbeat:
+            self._last_dispatched[key] = (last[0], last[1], now)
+        else:
+            self._last_dispatched[key] = (metric_record.value, now, now)
+            self.sink.emit(metric_record)
+
+        self._prune(now)
+
+    def _prune(self, now):
+        '''
+        Forget series that have not been seen for a full heartbeat, e.g. removed peers.
+        '''
+        if now - self._last_pruned < self.heartbeat:
+            return
+
+        self._last_pruned = now
+        for key, last in self._last_dispatched.items():
+            if now - last[2] >= self.heartbeat:
+                del self._last_dispatched[key]
+
+class RateMetricSink(object):
+    '''
+    Wraps a sink, converting counters to per-second rates before forwarding them.
+    Non-counter records are forwarded unchanged.
+
+    The previous sample of every counter series is kept as a (value, sample time) tuple.
+    The sample time is the NGINX+ timestamp given to start_sample, so the rate is not
+    skewed by request latency. No rate is emitted for the first sample of a series, after
+    a counter reset or after an NGINX+ reload (a change of the load timestamp). A missing
+    load timestamp, e.g. a failed fetch, keeps the samples.
+
+    Constructor Arguements:
+        sink: The sink records are forwarded to
+        max_sample_age: Seconds after which a previous sample is too old to compute a rate from
+    '''
+    def __init__(self, sink, max_sample_age):
+        self.sink = sink
+        self.max_sample_age = max_sample_age
+        self._samples = {}
+        self._sample_time = None
+        self._load_timestamp = None
+
+    def start_sample(self, sample_time, load_timestamp):
+        '''
+        Set the NGINX+ time the following records were sampled at, and its last (re)load time.
+        '''
+        if load_timestamp is not None and load_timestamp != self._load_timestamp:
+            if self._load_timestamp is not None:
+                LOGGER.info('NGINX+ reload detected, discarding %s counter samples', len(self._samples))
+                self._samples.clear()
+            self._load_timestamp = load_timestamp
+
+        self._sample_time = sample_time
+
+        if sample_time is not None:
+            for key, sample in self._samples.items():
+                if sample_time - sample[1] > self.max_sample_age:
+                    del self._samples[key]
+
+    def emit(self, metric_record):
+        '''
+        Forward the record, as a rate if it is a counter with a usable previous sample.
+        '''
+        if metric_record.type != 'counter':
+            self.sink.emit(metric_record)
+            return
+
+        sample_time = self._sample_time if self._sample_time is not None else metric_record.timestamp
+        key = _series_key(metric_record)
+        previous = self._samples.get(key)
+        self._samples[key] = (metric_record.value, sample_time)
+
+        if previous is None:
+            return
+
+        elapsed = sample_time - previous[1]
+        if elapsed <= 0 or elapsed > self.max_sample_age or metric_record.value < previous[0]:
+            return
+
+        rate = (metric_record.value - previous[0]) / float(elapsed)
+        self.sink.emit(MetricRecord(metric_record.name, 'gauge', rate, metric_record.instance_id,\
+                                    metric_record.dimensions, metric_record.timestamp))
+
+class RecordingMetricSink(object):
+    '''
+    Wraps a sink, keeping every record forwarded to it so that the records can be
+    emitted again without being rebuilt.
+
+    Constructor Arguements:
+        sink: The sink records are forwarded to
+    '''
+    def __init__(self, sink):
+        self.sink = sink
+        self.records = []
+
+    def emit(self, metric_record):
+        '''
+        Keep and forward the record.
+        '''
+        self.records.append(metric_record)
+        self.sink.emit(metric_record)
+
+class SeriesBudgetMetricSink(object):
+    '''
+    Wraps a sink, forwarding at most budget records. Each record of a read is a
+    series of its own, so the records forwarded are the series emitted.
+
+    Constructor Arguements:
+        sink: The sink records are forwarded to
+        budget: The number of records forwarded, those emitted beyond it are dropped
+    '''
+    def __init__(self, sink, budget):
+        self.sink = sink
+        self.remaining = budget
+        self.emitted_count = 0
+        self.refused_count = 0
+
+    def emit(self, metric_record):
         '''
-        Formats a dictionary of key/value pairs as a comma-delimited list of key=value tokens.
-        This was copied from docker-collectd-plugin.
+        Forward the record while the budget is not spent.
         '''
-        return ','.join(['='.join((key.replace('.', '_'), value)) for key, value in dimensions.iteritems()])
+        if self.remaining <= 0:
+            self.refused_count += 1
+            return
+
+        self.remaining -= 1
+        self.emitted_count += 1
+        self.sink.emit(metric_record)
 
 # Server configuration flags
 STATUS_HOST = 'StatusHost'
@@ -107,6 +852,42 @@ DIMENSION = 'Dimension'
 DIMENSIONS = 'Dimensions' # Not publicly facing, used to support neo-agent auto-generated configs
 API_VERSION = 'APIVersion'
 API_BASE_PATH = 'APIBasePath'
+READ_CONCURRENCY = 'ReadConcurrency'
+METRIC_GROUP_INTERVAL = 'MetricGroupInterval'
+CHANGE_ONLY = 'ChangeOnly'
+CHANGE_ONLY_HEARTBEAT = 'ChangeOnlyHeartbeat'
+RATE_CONVERSION = 'RateConversion'
+PEER_ROLLUP = 'PeerRollup'
+PEER_EMISSION = 'PeerEmission'
+PEER_DISTRIBUTION = 'PeerDistribution'
+SERIES_BUDGET = 'SeriesBudget'
+OBJECT_FETCH_CONCURRENCY = 'ObjectFetchConcurrency'
+PEER_SAMPLE_SIZE = 'PeerSampleSize'
+IDLE_THRESHOLD = 'IdleThreshold'
+IDLE_INTERVAL = 'IdleInterval'
+DERIVED_METRICS = 'DerivedMetrics'
+DERIVED_METRICS_ONLY = 'DerivedMetricsOnly'
+COLUMNAR_PEERS = 'ColumnarPeers'
+PEER_EVENTS = 'PeerEvents'
+PEER_NOTIFICATIONS = 'PeerNotifications'
+SKIP_UNCHANGED_RESPONSES = 'SkipUnchangedResponses'
+SHARED_POLL_CACHE = 'SharedPollCache'
+SHARED_POLL_CACHE_MAX_AGE = 'SharedPollCacheMaxAge'
+SNAPSHOT_LISTEN = 'SnapshotListen'
+READ_STAGGER = 'ReadStagger'
+ADAPTIVE_INTERVAL = 'AdaptiveInterval'
+READ_INTERVAL = 'Interval'
+TARGET = 'Target'
+FLEET_THREADS = 'FleetThreads'
+TARGETS_PATH = 'TargetsPath'
+TARGETS_CHECK_INTERVAL = 'TargetsCheckInterval'
+SHARD_INDEX = 'ShardIndex'
+SHARD_COUNT = 'ShardCount'
+SHARD_PEERS = 'ShardPeers'
+SHARD_NAME = 'ShardName'
+PEER = 'Peer'
+INCLUDE_SUFFIX = 'Include'
+EXCLUDE_SUFFIX = 'Exclude'
 
 # Metric group configuration flags
 SERVER_ZONE = 'ServerZone'
@@ -119,6 +900,102 @@ PROCESSES = 'Processes'
 
 # Constants
 DEFAULT_API_VERSION = 1
+DEFAULT_CHANGE_ONLY_HEARTBEAT = 300
+DEFAULT_RATE_MAX_SAMPLE_AGE = 900
+DEFAULT_OBJECT_FETCH_CONCURRENCY = 4
+DEFAULT_IDLE_INTERVAL = 10
+DEFAULT_FLEET_THREADS = 16
+DEFAULT_SHARED_POLL_CACHE_MAX_AGE = 5
+
+# Estimated cost in bytes of an extra request to the status API, and of a name in a collection listing
+REQUEST_OVERHEAD_BYTES = 400
+LISTED_NAME_BYTES = 40
+# Most objects named by the include filters fetched one by one, more are fetched with their collection
+MAX_NAMED_OBJECT_FETCHES = 16
+
+# Peer states reported by NGINX+, and the states of peers considered failing
+PEER_STATES = ('up', 'draining', 'down', 'unavail', 'checking', 'unhealthy')
+FAILING_PEER_STATES = ('unavail', 'unhealthy')
+
+# Kinds of PeerEvents
+PEER_ADDED = 'added'
+PEER_REMOVED = 'removed'
+PEER_STATE_CHANGED = 'state.changes'
+PEER_EVENT_KINDS = (PEER_ADDED, PEER_REMOVED, PEER_STATE_CHANGED)
+
+# Severities of the notifications of peers changing to each state, others are warnings
+OKAY_SEVERITY = 'okay'
+WARNING_SEVERITY = 'warning'
+FAILURE_SEVERITY = 'failure'
+PEER_STATE_SEVERITIES = dict([('up', OKAY_SEVERITY)] + [(state, FAILURE_SEVERITY) for state in FAILING_PEER_STATES])
+
+# Standalone runner configuration keys and output types
+RUNNER_INTERVAL = 'Interval'
+RUNNER_READ_THREADS = 'ReadThreads'
+RUNNER_OUTPUT = 'Output'
+RUNNER_OUTPUT_TYPE = 'Type'
+RUNNER_OUTPUT_PATH = 'Path'
+RUNNER_OUTPUT_URL = 'Url'
+RUNNER_TARGETS = 'Targets'
+DEFAULT_RUNNER_INTERVAL = 10
+DEFAULT_RUNNER_READ_THREADS = 4
+# Longest sleep of the runner loop, bounding the delay of a reload or stop request
+RUNNER_WAKEUP_INTERVAL = 0.5
+PUTVAL_OUTPUT = 'putval'
+JSON_OUTPUT = 'json'
+HTTP_OUTPUT = 'http'
+RUNNER_OUTPUT_TYPES = (PUTVAL_OUTPUT, JSON_OUTPUT, HTTP_OUTPUT)
+
+# Names of the collectd notification severities
+NOTIFICATION_SEVERITY_NAMES = {1 : FAILURE_SEVERITY, 2 : WARNING_SEVERITY, 4 : OKAY_SEVERITY}
+
+# Peer emission modes
+ALL_PEER_EMISSION = 'all'
+FAILING_PEER_EMISSION = 'failing'
+NO_PEER_EMISSION = 'none'
+PEER_EMISSION_MODES = (ALL_PEER_EMISSION, FAILING_PEER_EMISSION, NO_PEER_EMISSION)
+
+# Prefix of the name filter patterns given as globs instead of regular expressions
+GLOB_PATTERN_PREFIX = 'glob:'
+
+# Name of the container (peer) the objects dropped by a series budget are folded into
+OTHER_BUCKET_NAME = '__other__'
+SERIES_BUDGET_DROPPED_METRIC = MetricDefinition('series.budget.dropped', 'gauge', 'dropped')
+
+# Numbers of idle (demoted) and active objects of a metric group
+IDLE_OBJECTS_METRIC = MetricDefinition('objects.idle', 'gauge', 'idle')
+ACTIVE_OBJECTS_METRIC = MetricDefinition('objects.active', 'gauge', 'active')
+
+# Header of the shared poll cache files: the time the body was fetched and its length,
+# followed by the body
+SHARED_POLL_CACHE_HEADER = struct.Struct('<dI')
+SHARED_POLL_CACHE_EXTENSION = '.response'
+
+# Address the snapshot server listens on when given a port, and prefix of the fetch names
+SNAPSHOT_SERVER_HOST = '127.0.0.1'
+FETCH_NAME_PREFIX = 'get_'
+
+# Extensions of the target files read from a TargetsPath directory
+JSON_TARGETS_FILE_EXTENSIONS = ('.json',)
+YAML_TARGETS_FILE_EXTENSIONS = ('.yaml', '.yml')
+
+# Sharding configuration flags, and the number of points of each collector on the hash ring
+SHARD_CONFIG_KEYS = (SHARD_INDEX, SHARD_COUNT, SHARD_PEERS, SHARD_NAME)
+SHARD_RING_REPLICAS = 100
+
+# Relative changes of the key metrics between reads above which the adaptive interval
+# drops to its minimum, and below which it is lengthened
+ADAPTIVE_SPIKE_CHANGE = 0.5
+ADAPTIVE_STABLE_CHANGE = 0.1
+POLL_INTERVAL_METRIC = MetricDefinition('poll.interval', 'gauge', 'interval')
+
+# Statistics of the peer distribution summaries, percentiles are named "p<percent>"
+DISTRIBUTION_STATS = ('min', 'max', 'mean', 'p50', 'p90', 'p99')
+
+# Metric group traversal kinds
+FLAT_TRAVERSAL = 'flat'
+CONTAINER_TRAVERSAL = 'container'
+PEER_TRAVERSAL = 'peer'
 
 # Metric groups
 DEFAULT_CONNECTION_METRICS = [
@@ -256,17 +1133,180 @@ PROCESSES_METRICS = [
     MetricDefinition('processes.respawned', 'counter', 'respawned'),
 ]
 
+# Sums over the peers of each upstream
+UPSTREAM_ROLLUP_METRICS = [
+    MetricDefinition('upstreams.rollup.requests', 'counter', 'requests'),
+    MetricDefinition('upstreams.rollup.responses.1xx', 'counter', 'responses.1xx'),
+    MetricDefinition('upstreams.rollup.responses.2xx', 'counter', 'responses.2xx'),
+    MetricDefinition('upstreams.rollup.responses.3xx', 'counter', 'responses.3xx'),
+    MetricDefinition('upstreams.rollup.responses.4xx', 'counter', 'responses.4xx'),
+    MetricDefinition('upstreams.rollup.responses.5xx', 'counter', 'responses.5xx'),
+    MetricDefinition('upstreams.rollup.responses.total', 'counter', 'responses.total'),
+    MetricDefinition('upstreams.rollup.bytes.received', 'counter', 'received'),
+    MetricDefinition('upstreams.rollup.bytes.sent', 'counter', 'sent'),
+    MetricDefinition('upstreams.rollup.fails', 'counter', 'fails'),
+    MetricDefinition('upstreams.rollup.unavailable', 'counter', 'unavail')
+]
+
+# Sums over the peers of each stream-upstream
+STREAM_UPSTREAM_ROLLUP_METRICS = [
+    MetricDefinition('stream.upstreams.rollup.connections', 'counter', 'connections'),
+    MetricDefinition('stream.upstreams.rollup.bytes.received', 'counter', 'received'),
+    MetricDefinition('stream.upstreams.rollup.bytes.sent', 'counter', 'sent'),
+    MetricDefinition('stream.upstreams.rollup.fails', 'counter', 'fails'),
+    MetricDefinition('stream.upstreams.rollup.unavailable', 'counter', 'unavail')
+]
+
+# Rollups computed for the peer groups, keyed by metric group name
+PEER_ROLLUPS = {
+    'upstream.peers' : PeerRollup('upstreams', UPSTREAM_ROLLUP_METRICS),
+    'stream.upstream.peers' : PeerRollup('stream.upstreams', STREAM_UPSTREAM_ROLLUP_METRICS)
+}
+
+# Names of the peer state change notifications, keyed by metric group name
+PEER_NOTIFICATION_NAMES = {
+    'upstream.peers' : 'upstreams.peer.state',
+    'stream.upstream.peers' : 'stream.upstreams.peer.state'
+}
+
+# Numbers of PeerEvents of each container on a read, keyed by metric group name and event kind
+PEER_EVENT_METRICS = dict((group_name, dict((kind, MetricDefinition('{}.peers.{}'.format(prefix, kind), 'gauge', kind))\
+                                            for kind in PEER_EVENT_KINDS))\
+                          for group_name, prefix in (('upstream.peers', 'upstreams'),\
+                                                     ('stream.upstream.peers', 'stream.upstreams')))
+
+# Distributions of the peer latencies of each upstream, weighted by the peer request (connection) counts
+PEER_DISTRIBUTIONS = {
+    'upstream.peers' : PeerDistribution('requests', [
+        MetricDefinition('upstreams.response.time', 'gauge', 'response_time'),
+        MetricDefinition('upstreams.header.time', 'gauge', 'header_time')
+    ]),
+    'stream.upstream.peers' : PeerDistribution('connections', [
+        MetricDefinition('stream.upstreams.response.time', 'gauge', 'response_time'),
+        MetricDefinition('stream.upstreams.connect.time', 'gauge', 'connect_time'),
+        MetricDefinition('stream.upstreams.first.byte.time', 'gauge', 'first_byte_time')
+    ])
+}
+
+# Derived metrics computed for each object of a metric group, keyed by metric group name
+GROUP_DERIVED_METRICS = {
+    'ssl' : [
+        DerivedMetricDefinition('ssl.handshakes.failed.ratio', 'handshakes_failed / (handshakes + handshakes_failed)')
+    ],
+    'server.zones' : [
+        DerivedMetricDefinition('server.zone.responses.5xx.ratio', 'responses.5xx / responses.total'),
+        DerivedMetricDefinition('server.zone.bytes.per.request', 'sent / requests')
+    ],
+    'upstream.peers' : [
+        DerivedMetricDefinition('upstreams.responses.5xx.ratio', 'responses.5xx / responses.total'),
+        DerivedMetricDefinition('upstreams.bytes.per.request', 'received / requests')
+    ],
+    'caches' : [
+        DerivedMetricDefinition('caches.hit.ratio', 'hit.responses / (hit.responses + stale.responses + '
+                                'updating.responses + revalidated.responses + miss.responses + expired.responses + '
+                                'bypass.responses)')
+    ]
+}
+
+# Registry of every metric group, default groups have no configuration flag
+METRIC_GROUPS = [
+    MetricGroup('connections', None, 'get_connections', FLAT_TRAVERSAL, (), DEFAULT_CONNECTION_METRICS),
+    MetricGroup('ssl', None, 'get_ssl', FLAT_TRAVERSAL, (), DEFAULT_SSL_METRICS),
+    MetricGroup('requests', None, 'get_requests', FLAT_TRAVERSAL, (), DEFAULT_REQUESTS_METRICS),
+    MetricGroup('server.zones', None, 'get_server_zones', CONTAINER_TRAVERSAL, ('server.zone.name',),
+                DEFAULT_SERVER_ZONE_METRICS, 'requests'),
+    MetricGroup('upstream.peers', None, 'get_upstreams', PEER_TRAVERSAL, ('upstream.name', 'upstream.peer.name'),
+                DEFAULT_UPSTREAM_METRICS, 'requests'),
+    MetricGroup('caches', None, 'get_caches', CONTAINER_TRAVERSAL, ('cache.name',), DEFAULT_CACHE_METRICS,
+                'hit.bytes'),
+    MetricGroup('server.zones', SERVER_ZONE, 'get_server_zones', CONTAINER_TRAVERSAL, ('server.zone.name',),
+                SERVER_ZONE_METRICS, 'requests'),
+    MetricGroup('memory.zones', MEMORY_ZONE, 'get_slabs', CONTAINER_TRAVERSAL, ('memory.zone.name',),
+                MEMORY_ZONE_METRICS, 'pages.used'),
+    MetricGroup('upstreams', UPSTREAM, 'get_upstreams', CONTAINER_TRAVERSAL, ('upstream.name',), UPSTREAM_METRICS),
+    MetricGroup('upstream.peers', UPSTREAM, 'get_upstreams', PEER_TRAVERSAL, ('upstream.name', 'upstream.peer.name'),
+                UPSTREAM_PEER_METRICS, 'requests'),
+    MetricGroup('caches', CACHE, 'get_caches', CONTAINER_TRAVERSAL, ('cache.name',), CACHE_METRICS, 'hit.bytes'),
+    MetricGroup('stream.server.zones', STREAM_SERVER_ZONE, 'get_stream_server_zones', CONTAINER_TRAVERSAL,
+                ('stream.server.zone.name',), STREAM_SERVER_ZONE_METRICS, 'connections'),
+    MetricGroup('stream.upstreams', STREAM_UPSTREAM, 'get_stream_upstreams', CONTAINER_TRAVERSAL,
+                ('stream.upstream.name',), STREAM_UPSTREAM_METRICS),
+    MetricGroup('stream.upstream.peers', STREAM_UPSTREAM, 'get_stream_upstreams', PEER_TRAVERSAL,
+                ('stream.upstream.name', 'stream.upstream.peer.name'), STREAM_UPSTREAM_PEER_METRICS, 'connections'),
+    MetricGroup('processes', PROCESSES, 'get_processes', FLAT_TRAVERSAL, (), PROCESSES_METRICS)
+]
+
+METRIC_GROUP_CONFIG_KEYS = set(group.config_key for group in METRIC_GROUPS if group.config_key)
+
+# Endpoints whose containers are filtered by name, keyed by the prefix of the
+# <prefix>Include and <prefix>Exclude configuration flags
+CONTAINER_FILTER_FETCH_NAMES = {
+    SERVER_ZONE : 'get_server_zones',
+    MEMORY_ZONE : 'get_slabs',
+    UPSTREAM : 'get_upstreams',
+    CACHE : 'get_caches',
+    STREAM_SERVER_ZONE : 'get_stream_server_zones',
+    STREAM_UPSTREAM : 'get_stream_upstreams'
+}
+
+# Endpoints whose containers hold peers, filtered by the PeerInclude and PeerExclude flags
+PEER_FETCH_NAMES = set(group.fetch_name for group in METRIC_GROUPS if group.traversal == PEER_TRAVERSAL)
+
+NAME_FILTER_CONFIG_KEYS = set(prefix + suffix for prefix in CONTAINER_FILTER_FETCH_NAMES.keys() + [PEER]\
+                              for suffix in (INCLUDE_SUFFIX, EXCLUDE_SUFFIX))
+
 class NginxPlusPlugin(object):
     '''
     Collectd plugin for reporting metrics from a single NGINX+ instance.
+
+    Constructor Arguements:
+        fleet_resources: Optional FleetResources shared with the other targets of a fleet
     '''
-    def __init__(self):
+    def __init__(self, fleet_resources=None):
+        self.fleet_resources = fleet_resources
         self.nginx_agent = None
         self.sink = None
         self.emitters = []
         self.global_dimensions = {}
+        self.read_concurrency = 1
+        self.peer_rollup = False
+        self.peer_distribution = False
+        self.peer_emission = ALL_PEER_EMISSION
+        self.peer_sample_size = None
+        self.idle_threshold = None
+        self.idle_interval = DEFAULT_IDLE_INTERVAL
+        self.derived_metrics = False
+        self.derived_metrics_only = False
+        self.columnar_peers = False
+        self.peer_events = False
+        self.peer_notifications = False
+        self.notification_sink = None
+        self.skip_unchanged_responses = False
+        self.read_stagger = None
+        self.adaptive_interval = None
+        self.read_interval = None
+        self.snapshot_listen = None
+        self.snapshot_store = None
+        self.series_budget = None
+        self.group_series_budgets = {}
+        self.container_filters = {}
+        self.peer_filter = None
 
         self._instance_id = None
+        self._rate_sink = None
+        self._read_count = 0
+        self._fetch_cache = None
+        self._fetch_pool = None
+        self._series_remaining = None
+        self._peer_sample_offsets = {}
+        self._idle_states = {}
+        self._peer_snapshots = {}
+        self._peer_indexes = {}
+        # Fetch name -> (last response, last filtered response), and group name -> last records
+        self._last_responses = {}
+        self._group_records = {}
+        self._unchanged_fetch_names = set()
+        self._read_lock = threading.Lock()
 
     @property
     def instance_id(self):
@@ -288,6 +1328,14 @@ class NginxPlusPlugin(object):
         password = None
         api_version = None
         api_base_path = None
+        object_fetch_concurrency = DEFAULT_OBJECT_FETCH_CONCURRENCY
+        enabled_group_keys = set()
+        group_read_multiples = {}
+        change_only = False
+        change_only_heartbeat = DEFAULT_CHANGE_ONLY_HEARTBEAT
+        rate_conversion = False
+        shared_poll_cache_directory = None
+        shared_poll_cache_max_age = DEFAULT_SHARED_POLL_CACHE_MAX_AGE
 
         # Iterate the configuration values, pickup the status endpoint info
         # and create any specified opt-in metric emitters
@@ -323,41 +1371,89 @@ class NginxPlusPlugin(object):
                 self.global_dimensions[node.values[0]] = node.values[1]
             elif self._check_bool_config_enabled(node, DEBUG_LOG_LEVEL):
                 log_handler.debug = self._str_to_bool(node.values[0])
-            elif self._check_bool_config_enabled(node, CACHE):
-                self._log_emitter_group_enabled(CACHE)
-                self.emitters.append(MetricEmitter(self._emit_cache_metrics, CACHE_METRICS))
-            elif self._check_bool_config_enabled(node, PROCESSES):
-                self._log_emitter_group_enabled(PROCESSES)
-                self.emitters.append(MetricEmitter(self._emit_processes_metrics, PROCESSES_METRICS))
-            elif self._check_bool_config_enabled(node, UPSTREAM):
-                self._log_emitter_group_enabled(UPSTREAM)
-                self.emitters.append(MetricEmitter(self._emit_upstreams_metrics, UPSTREAM_METRICS))
-                self.emitters.append(MetricEmitter(self._emit_upstreams_peer_metrics, UPSTREAM_PEER_METRICS))
-            elif self._check_bool_config_enabled(node, MEMORY_ZONE):
-                self._log_emitter_group_enabled(MEMORY_ZONE)
-                self.emitters.append(MetricEmitter(self._emit_memory_zone_metrics, MEMORY_ZONE_METRICS))
-            elif self._check_bool_config_enabled(node, SERVER_ZONE):
-                self._log_emitter_group_enabled(SERVER_ZONE)
-                self.emitters.append(MetricEmitter(self._emit_server_zone_metrics, SERVER_ZONE_METRICS))
-            elif self._check_bool_config_enabled(node, STREAM_UPSTREAM):
-                self._log_emitter_group_enabled(STREAM_UPSTREAM)
-                self.emitters.append(MetricEmitter(self._emit_stream_upstreams_metrics, STREAM_UPSTREAM_METRICS))
-                self.emitters.append(MetricEmitter(self._emit_stream_upstreams_peer_metrics,\
-                                                   STREAM_UPSTREAM_PEER_METRICS))
-            elif self._check_bool_config_enabled(node, STREAM_SERVER_ZONE):
-                self._log_emitter_group_enabled(STREAM_SERVER_ZONE)
-                self.emitters.append(MetricEmitter(self._emit_stream_server_zone_metrics, STREAM_SERVER_ZONE_METRICS))
-
-        # Default metric emitters
-        self.emitters.append(MetricEmitter(self._emit_connection_metrics, DEFAULT_CONNECTION_METRICS))
-        self.emitters.append(MetricEmitter(self._emit_ssl_metrics, DEFAULT_SSL_METRICS))
-        self.emitters.append(MetricEmitter(self._emit_requests_metrics, DEFAULT_REQUESTS_METRICS))
-        self.emitters.append(MetricEmitter(self._emit_server_zone_metrics, DEFAULT_SERVER_ZONE_METRICS))
-        self.emitters.append(MetricEmitter(self._emit_upstreams_peer_metrics, DEFAULT_UPSTREAM_METRICS))
-        self.emitters.append(MetricEmitter(self._emit_cache_metrics, DEFAULT_CACHE_METRICS))
+            elif node.key == READ_CONCURRENCY:
+                self.read_concurrency = self._str_to_positive_int(node.values[0], READ_CONCURRENCY)
+            elif node.key == METRIC_GROUP_INTERVAL and len(node.values) == 2:
+                group_read_multiples[node.values[0]] = self._str_to_positive_int(node.values[1],\
+                                                                                 METRIC_GROUP_INTERVAL)
+            elif node.key == CHANGE_ONLY:
+                change_only = self._str_to_bool(node.values[0])
+            elif node.key == CHANGE_ONLY_HEARTBEAT:
+                change_only_heartbeat = self._str_to_positive_int(node.values[0], CHANGE_ONLY_HEARTBEAT)
+            elif node.key == RATE_CONVERSION:
+                rate_conversion = self._str_to_bool(node.values[0])
+            elif node.key == PEER_ROLLUP:
+                self.peer_rollup = self._str_to_bool(node.values[0])
+            elif node.key == PEER_DISTRIBUTION:
+                self.peer_distribution = self._str_to_bool(node.values[0])
+            elif node.key == SERIES_BUDGET and len(node.values) == 1:
+                self.series_budget = self._str_to_positive_int(node.values[0], SERIES_BUDGET)
+            elif node.key == SERIES_BUDGET and len(node.values) == 2:
+                self.group_series_budgets[node.values[0]] = self._str_to_positive_int(node.values[1], SERIES_BUDGET)
+            elif node.key == OBJECT_FETCH_CONCURRENCY:
+                object_fetch_concurrency = self._str_to_positive_int(node.values[0], OBJECT_FETCH_CONCURRENCY)
+            elif node.key in NAME_FILTER_CONFIG_KEYS:
+                self._add_name_filter_patterns(node.key, node.values)
+            elif node.key == PEER_SAMPLE_SIZE:
+                self.peer_sample_size = self._str_to_positive_int(node.values[0], PEER_SAMPLE_SIZE)
+            elif node.key == IDLE_THRESHOLD:
+                self.idle_threshold = self._str_to_positive_int(node.values[0], IDLE_THRESHOLD)
+            elif node.key == IDLE_INTERVAL:
+                self.idle_interval = self._str_to_positive_int(node.values[0], IDLE_INTERVAL)
+            elif node.key == DERIVED_METRICS:
+                self.derived_metrics = self._str_to_bool(node.values[0])
+            elif node.key == DERIVED_METRICS_ONLY:
+                self.derived_metrics_only = self._str_to_bool(node.values[0])
+            elif node.key == COLUMNAR_PEERS:
+                self.columnar_peers = self._str_to_bool(node.values[0])
+            elif node.key == PEER_EVENTS:
+                self.peer_events = self._str_to_bool(node.values[0])
+            elif node.key == PEER_NOTIFICATIONS:
+                self.peer_notifications = self._str_to_bool(node.values[0])
+            elif node.key == SKIP_UNCHANGED_RESPONSES:
+                self.skip_unchanged_responses = self._str_to_bool(node.values[0])
+            elif node.key == SHARED_POLL_CACHE:
+                shared_poll_cache_directory = node.values[0]
+            elif node.key == SHARED_POLL_CACHE_MAX_AGE:
+                shared_poll_cache_max_age = self._str_to_positive_int(node.values[0], SHARED_POLL_CACHE_MAX_AGE)
+            elif node.key == SNAPSHOT_LISTEN:
+                self.snapshot_listen = _str_to_snapshot_address(node.values[0])
+            elif node.key == READ_STAGGER:
+                self.read_stagger = self._str_to_positive_int(node.values[0], READ_STAGGER)
+            elif node.key == READ_INTERVAL:
+                self.read_interval = self._str_to_positive_int(node.values[0], READ_INTERVAL)
+            elif node.key == ADAPTIVE_INTERVAL and len(node.values) == 2:
+                self.adaptive_interval = self._str_to_adaptive_interval(*node.values)
+            elif node.key == PEER_EMISSION:
+                self.peer_emission = self._str_to_peer_emission(node.values[0])
+            elif node.key in METRIC_GROUP_CONFIG_KEYS and self._str_to_bool(node.values[0]):
+                self._log_emitter_group_enabled(node.key)
+                enabled_group_keys.add(node.key)
+
+        self.emitters = self._build_emitters(enabled_group_keys, group_read_multiples)
 
         self.sink = MetricSink()
-        self.nginx_agent = NginxStatusAgent(status_host, status_port, username, password, api_version, api_base_path)
+        if change_only:
+            LOGGER.debug('Change-only emission enabled, heartbeat: %ss', change_only_heartbeat)
+            self.sink = ChangeOnlyMetricSink(self.sink, change_only_heartbeat)
+        if rate_conversion:
+            LOGGER.debug('Counter to rate conversion enabled')
+            self._rate_sink = RateMetricSink(self.sink, DEFAULT_RATE_MAX_SAMPLE_AGE)
+            self.sink = self._rate_sink
+        if self.peer_notifications:
+            self.notification_sink = NotificationSink()
+        shared_resources = {}
+        if self.fleet_resources:
+            shared_resources = {'session' : self.fleet_resources.session,
+                                'object_fetch_pool' : self.fleet_resources.object_fetch_pool}
+        self.nginx_agent = NginxStatusAgent(status_host, status_port, username, password, api_version, api_base_path,\
+                                            **shared_resources)
+        self.nginx_agent.object_fetch_concurrency = object_fetch_concurrency
+        self.nginx_agent.skip_unchanged_responses = self.skip_unchanged_responses
+        if shared_poll_cache_directory:
+            LOGGER.debug('Shared poll cache enabled in %s, max age: %ss', shared_poll_cache_directory,\
+                         shared_poll_cache_max_age)
+            self.nginx_agent.shared_poll_cache = SharedPollCache(shared_poll_cache_directory, shared_poll_cache_max_age)
 
         LOGGER.debug('Finished configuration. Will read status from %s:%s', status_host, status_port)
 
@@ -367,128 +1463,293 @@ class NginxPlusPlugin(object):
         Called once per interval (see Interval configuration option of collectd).
         If an exception is thrown the plugin will be skipped for an
         increasing amount of time until it returns to normal.
+
+        Reads may be called from several threads, a read called while the previous
+        one is still running is skipped.
         '''
+        if not self._read_lock.acquire(False):
+            LOGGER.warning('Skipping read of %s, the previous read is still running', self.instance_id)
+            return
+
+        try:
+            self._read()
+        finally:
+            self._read_lock.release()
+
+    def _read(self):
         if not self.instance_id:
             LOGGER.warning('Skipping read, instance id is not set')
             return
 
+        if self.adaptive_interval and not self.adaptive_interval.is_due(time.time()):
+            LOGGER.debug('Instance %s skipping read, adaptive interval: %ss', self.instance_id,\
+                         self.adaptive_interval.interval)
+            return
+
         LOGGER.debug('Instance %s starting read', self.instance_id)
 
-        self.nginx_agent.validate_nginx_version()
+        # A single metadata response serves the version check and dimension, and the rate timestamps
+        nginx_metadata = self.nginx_agent.get_nginx_metadata()
+        self.nginx_agent.validate_nginx_version(nginx_metadata)
+
+        self._reload_ephemeral_global_dimensions(nginx_metadata)
 
-        self._reload_ephemeral_global_dimensions()
+        if self._rate_sink:
+            self._rate_sink.start_sample(*self.nginx_agent.get_nginx_timestamps(nginx_metadata))
 
-        for emitter in self.emitters:
-            emitter.emit(self.sink)
+        due_emitters = [emitter for emitter in self.emitters if emitter.is_due(self._read_count)]
+        self._read_count += 1
 
-    def _emit_connection_metrics(self, metrics, sink):
+        # Each endpoint is fetched at most once per read, however many emitters consume it
+        self._fetch_cache = {}
+        self._unchanged_fetch_names = set()
+        self._series_remaining = self.series_budget
+        try:
+            self._prefetch(due_emitters)
+            for emitter in due_emitters:
+                emitter.emit(self.sink)
+            if self.adaptive_interval:
+                self._adapt_interval()
+        finally:
+            self._fetch_cache = None
+            self._series_remaining = None
+
+    def _adapt_interval(self):
         '''
-        Extract and emit the connection metrics.
+        Adapt the interval between reads to the key metrics of this read, and emit it.
+        The 5xx responses are only counted when the server zones were read anyway.
         '''
-        LOGGER.debug('Emitting connection metrics, instance: %s', self.instance_id)
-
-        status_json = self.nginx_agent.get_connections()
-        self._fetch_and_emit_metrics(status_json, metrics, sink)
+        requests_total = _reduce_to_path(self._fetch('get_requests'), 'total')
+        active_connections = _reduce_to_path(self._fetch('get_connections'), 'active')
+        errors_total = None
+        server_zones = self._fetch_cache.get('get_server_zones')
+        if isinstance(server_zones, dict):
+            errors_total = sum(_reduce_to_path(zone, 'responses.5xx') or 0 for zone in server_zones.itervalues())
+
+        previous_interval = self.adaptive_interval.interval
+        interval = self.adaptive_interval.update(time.time(), requests_total, errors_total, active_connections)
+        if interval != previous_interval:
+            LOGGER.debug('Instance %s adaptive interval changed from %ss to %ss', self.instance_id,\
+                         previous_interval, interval)
+        self._emit_values([(POLL_INTERVAL_METRIC, interval)], self.sink)
 
-    def _emit_ssl_metrics(self, metrics, sink):
+    @property
+    def snapshot_target(self):
         '''
-        Extract and emit the ssl metrics.
+        The name of this instance in the snapshot store, its status endpoint.
         '''
-        LOGGER.debug('Emitting ssl metrics, instance: %s', self.instance_id)
-
-        status_json = self.nginx_agent.get_ssl()
-        self._fetch_and_emit_metrics(status_json, metrics, sink)
+        return '{}:{}'.format(self.nginx_agent.status_host, self.nginx_agent.status_port)
 
-    def _emit_requests_metrics(self, metrics, sink):
+    def read_offset(self):
         '''
-        Extract and emit the requests metrics.
+        Seconds the reads of this instance are delayed by, spreading the reads of
+        many instances over the ReadStagger window. The offset is derived from the
+        instance id, so an instance keeps its place in the window across reads
+        and collector restarts. The offset is wrapped to the Interval of the instance
+        when set. Zero when staggering is disabled.
         '''
-        LOGGER.debug('Emitting requests metrics, instance: %s', self.instance_id)
+        if not self.read_stagger:
+            return 0
 
-        status_json = self.nginx_agent.get_requests()
-        self._fetch_and_emit_metrics(status_json, metrics, sink)
+        stagger_key = self.instance_id or '{}:{}'.format(self.nginx_agent.status_host, self.nginx_agent.status_port)
+        read_offset = _stable_fraction(stagger_key) * self.read_stagger
+        if self.read_interval:
+            read_offset %= self.read_interval
+        return read_offset
 
-    def _emit_processes_metrics(self, metrics, sink):
+    def close(self):
         '''
-        Extract and emit the processes metrics.
+        Release the thread pools and connections of the plugin.
         '''
-        LOGGER.debug('Emitting processes metrics, instance: %s', self.instance_id)
+        if self._fetch_pool:
+            self._fetch_pool.terminate()
+            self._fetch_pool = None
+        if self.nginx_agent:
+            self.nginx_agent.close()
 
-        status_json = self.nginx_agent.get_processes()
-        self._fetch_and_emit_metrics(status_json, metrics, sink)
-
-    def _emit_server_zone_metrics(self, metrics, sink):
-        '''
-        Extract and emit the server-zone metrics.
+    def _emit_metric_group(self, group, metrics, sink):
         '''
-        LOGGER.debug('Emitting server-zone metrics, instance: %s', self.instance_id)
+        Extract and emit the metrics of a group, traversing the fetched JSON
+        as declared by the group.
 
-        server_zones_obj = self.nginx_agent.get_server_zones()
-        self._build_container_keyed_metrics(server_zones_obj, 'server.zone.name', metrics, sink)
+        When the response is unchanged and the records of the group only depend on it,
+        the extracted records of the previous read are emitted again. The peer events
+        are still diffed, so an unchanged response counts no event.
 
-    def _emit_upstreams_metrics(self, metrics, sink):
+        Within a series budget every series of the group counts, the aggregates, peer events
+        and idle object counts included, and none is emitted beyond the budget.
         '''
-        Extract and emit the upstreams metrics.
+        LOGGER.debug('Emitting %s metrics, instance: %s', group.name, self.instance_id)
+
+        metrics = self._with_derived_metrics(group, metrics)
+        status_json = self._fetch(group.fetch_name)
+        budget_sink = None
+        budget = self._get_series_budget(group)
+        report_dropped = bool(budget) and group.traversal != FLAT_TRAVERSAL
+        if budget is not None:
+            # One series of the budget is kept for series.budget.dropped
+            budget_sink = sink = SeriesBudgetMetricSink(sink, budget - 1 if report_dropped else budget)
+        # Only the extracted records are recorded, the event, idle and budget metrics are not
+        value_sink = sink
+        if self.skip_unchanged_responses and self._can_emit_last_records(group):
+            if group.fetch_name in self._unchanged_fetch_names and group.name in self._group_records:
+                if group.traversal == PEER_TRAVERSAL:
+                    self._update_peer_index(group, status_json, sink)
+                self._emit_last_records(group, sink)
+                return
+            value_sink = RecordingMetricSink(sink)
+            self._group_records[group.name] = value_sink.records
+        else:
+            self._group_records.pop(group.name, None)
+
+        folded_count = 0
+        if group.traversal == FLAT_TRAVERSAL:
+            self._fetch_and_emit_metrics(status_json, metrics, value_sink)
+        elif group.traversal == CONTAINER_TRAVERSAL:
+            containers_obj = self._demote_idle_objects(group, status_json, metrics, sink)
+            containers_obj, folded_count = self._apply_series_budget(group, containers_obj, metrics, sink)
+            self._build_container_keyed_metrics(containers_obj, group.dimension_names[0], metrics, value_sink)
+        elif group.traversal == PEER_TRAVERSAL:
+            peer_index = self._update_peer_index(group, status_json, sink)
+            snapshot, changed_peer_keys = self._take_peer_snapshot(group, status_json, metrics)
+            self._emit_peer_aggregates(status_json, group, value_sink, snapshot)
+            # Idle peers are tracked over every peer, sampled out or not
+            containers_obj = self._demote_idle_objects(group, status_json, metrics, sink, changed_peer_keys,\
+                                                       self._select_emitted_peers(group, status_json))
+            containers_obj, folded_count = self._apply_series_budget(group, containers_obj, metrics, sink)
+            self._build_container_keyed_peer_metrics(containers_obj, group.dimension_names[0],\
+                group.dimension_names[1], metrics, value_sink, peer_index)
+
+        if budget_sink:
+            self._end_series_budget(group, budget_sink, folded_count, report_dropped)
+
+    def _end_series_budget(self, group, budget_sink, folded_count, report_dropped):
         '''
-        LOGGER.debug('Emitting upstreams metrics, instance: %s', self.instance_id)
-
-        upstreams_obj = self.nginx_agent.get_upstreams()
-        self._build_container_keyed_metrics(upstreams_obj, 'upstream.name', metrics, sink)
-
-    def _emit_upstreams_peer_metrics(self, metrics, sink):
+        Emit the number of objects a group folded to stay within its series budget, in the
+        series kept for it, and deduct the series of the group from the instance budget.
         '''
-        Extract and emit the upstreams peer metrics.
+        series_count = budget_sink.emitted_count
+        if report_dropped:
+            self._emit_values([(SERIES_BUDGET_DROPPED_METRIC, folded_count)], budget_sink.sink,\
+                              {'metric.group' : group.name})
+            series_count += 1
+        if budget_sink.refused_count:
+            LOGGER.debug('Series budget of %s exceeded, %s series dropped', group.name, budget_sink.refused_count)
+        self._consume_series_budget(series_count)
+
+    def _can_emit_last_records(self, group):
         '''
-        LOGGER.debug('Emitting upstreams peer metrics, instance: %s', self.instance_id)
-
-        upstreams_obj = self.nginx_agent.get_upstreams()
-        self._build_container_keyed_peer_metrics(upstreams_obj, 'upstream.name', 'upstream.peer.name', metrics, sink)
+        Check that the records of a group only depend on its response, so the records of
+        an unchanged response can be emitted again. Idle object tracking, peer sampling
+        and series budgets select the emitted objects from one read to the next.
+        '''
+        if self.idle_threshold or self._get_series_budget(group) is not None:
+            return False
+        return group.traversal != PEER_TRAVERSAL or not self.peer_sample_size
 
-    def _emit_stream_server_zone_metrics(self, metrics, sink):
+    def _emit_last_records(self, group, sink):
         '''
-        Extract and emit the stream-server-zone metrics.
+        Emit the records last extracted for a group again, with the current time, as the
+        response they were built from is unchanged. Change-only sinks drop them until
+        their heartbeat is due.
         '''
-        LOGGER.debug('Emitting stream-server-zone metrics, instance: %s', self.instance_id)
-
-        server_zones_obj = self.nginx_agent.get_stream_server_zones()
-        self._build_container_keyed_metrics(server_zones_obj, 'stream.server.zone.name', metrics, sink)
-
-    def _emit_stream_upstreams_metrics(self, metrics, sink):
+        LOGGER.debug('Response for %s is unchanged, emitting the last %s records', group.name,\
+                     len(self._group_records[group.name]))
+        timestamp = time.time()
+        for record in self._group_records[group.name]:
+            sink.emit(MetricRecord(record.name, record.type, record.value, record.instance_id, record.dimensions,\
+                                   timestamp))
+
+    def _with_derived_metrics(self, group, metrics):
         '''
-        Extract and emit the stream-upstream metrics.
+        Add the derived metrics of a group to its metrics when enabled, or replace
+        the metrics with them when only the derived metrics are emitted.
         '''
-        LOGGER.debug('Emitting stream-upstreams metrics, instance: %s', self.instance_id)
-
-        upstreams_obj = self.nginx_agent.get_stream_upstreams()
-        self._build_container_keyed_metrics(upstreams_obj, 'stream.upstream.name', metrics, sink)
-
-    def _emit_stream_upstreams_peer_metrics(self, metrics, sink):
+        derived_metrics = GROUP_DERIVED_METRICS.get(group.name) if self.derived_metrics else None
+        if not derived_metrics:
+            return metrics
+        if self.derived_metrics_only:
+            return derived_metrics
+        return metrics + derived_metrics
+
+    def _fetch(self, fetch_name):
         '''
-        Extract and emit the stream-upstream peer metrics.
+        Fetch an endpoint with the named NginxStatusAgent method. During a read
+        the response is cached so that every emitter shares a single request.
         '''
-        LOGGER.debug('Emitting stream-upstreams peer metrics, instance: %s', self.instance_id)
+        if self._fetch_cache is None:
+            return self._fetch_filtered(fetch_name)
 
-        upstreams_obj = self.nginx_agent.get_stream_upstreams()
-        self._build_container_keyed_peer_metrics(upstreams_obj, 'stream.upstream.name', 'stream.upstream.peer.name',\
-            metrics, sink)
+        if fetch_name not in self._fetch_cache:
+            self._fetch_cache[fetch_name] = self._fetch_filtered(fetch_name)
+        return self._fetch_cache[fetch_name]
 
-    def _emit_memory_zone_metrics(self, metrics, sink):
+    def _fetch_filtered(self, fetch_name):
         '''
-        Extract and emit the memory zone metrics.
+        Fetch an endpoint and drop the containers and peers excluded by the name filters,
+        before any value is extracted. With the versioned API the agent is given the
+        filter, or the literal names it selects, to fetch just the selected objects when
+        that is cheaper.
         '''
-        LOGGER.debug('Emitting memory-zone metrics, instance: %s', self.instance_id)
+        container_filter = self.container_filters.get(fetch_name)
+        fetch = getattr(self.nginx_agent, fetch_name)
+        if container_filter and self.nginx_agent.api_version is not None:
+            if container_filter.literal_names is not None:
+                status_json = fetch(container_filter.literal_names)
+            else:
+                status_json = fetch(name_filter=container_filter.matches)
+        else:
+            status_json = fetch()
 
-        slab_obj = self.nginx_agent.get_slabs()
-        self._build_container_keyed_metrics(slab_obj, 'memory.zone.name', metrics, sink)
+        if self.snapshot_store and status_json is not None:
+            self.snapshot_store.put(self.snapshot_target, fetch_name[len(FETCH_NAME_PREFIX):], status_json)
 
-    def _emit_cache_metrics(self, metrics, sink):
+        # The agent returns the very same object when the response body is unchanged
+        if self.skip_unchanged_responses:
+            last_response = self._last_responses.get(fetch_name)
+            if last_response and last_response[0] is status_json:
+                self._unchanged_fetch_names.add(fetch_name)
+                return last_response[1]
+            response = status_json
+
+        if not isinstance(status_json, dict):
+            return status_json
+
+        if container_filter:
+            status_json = dict((name, container) for name, container in status_json.iteritems()\
+                               if container_filter.matches(name))
+
+        if self.peer_filter and fetch_name in PEER_FETCH_NAMES:
+            status_json = dict((name, dict(container, peers=[peer for peer in container.get('peers', [])\
+                                                             if self.peer_filter.matches(peer.get('name', ''))]))\
+                               for name, container in status_json.iteritems())
+
+        if self.skip_unchanged_responses:
+            self._last_responses[fetch_name] = (response, status_json)
+        return status_json
+
+    def _prefetch(self, emitters):
         '''
-        Extract and emit the cache metrics.
+        Fetch the endpoints needed by the given emitters concurrently, when a
+        read concurrency greater than one is configured.
         '''
-        LOGGER.debug('Emitting cache metrics, instance: %s', self.instance_id)
+        fetch_names = []
+        for emitter in emitters:
+            if emitter.group and emitter.group.fetch_name not in fetch_names:
+                fetch_names.append(emitter.group.fetch_name)
+
+        if self.read_concurrency < 2 or len(fetch_names) < 2:
+            return
+
+        if self.fleet_resources:
+            fetch_pool = self.fleet_resources.fetch_pool
+        else:
+            if not self._fetch_pool:
+                self._fetch_pool = ThreadPool(self.read_concurrency)
+            fetch_pool = self._fetch_pool
 
-        cache_obj = self.nginx_agent.get_caches()
-        self._build_container_keyed_metrics(cache_obj, 'cache.name', metrics, sink)
+        responses = fetch_pool.map(self._fetch_filtered, fetch_names)
+        self._fetch_cache.update(zip(fetch_names, responses))
 
     def _build_container_keyed_metrics(self, containers_obj, container_dim_name, metrics, sink):
         '''
@@ -520,7 +1781,8 @@ class NginxPlusPlugin(object):
                 dimensions = {container_dim_name : container_name}
                 self._fetch_and_emit_metrics(container, metrics, sink, dimensions)
 
-    def _build_container_keyed_peer_metrics(self, containers_obj, container_dim_name, peer_dim_name, metrics, sink):
+    def _build_container_keyed_peer_metrics(self, containers_obj, container_dim_name, peer_dim_name, metrics, sink,\
+                                            peer_index=None):
         '''
         Build metrics with two dimensions: name of the top level object and the name of each constituent object (peer).
 
@@ -560,46 +1822,425 @@ class NginxPlusPlugin(object):
 
                 MetricRecord('upstreams.value', 'counter', 27, self.instance_id,
                     {'upstream.name' : 'my_upstream_name'', 'upstream.peer.name' : 'bar'})
+
+        Given a PeerIndex, the dimensions it holds for the indexed peers are reused.
         '''
         if containers_obj:
             # Each key in the container object is the name of the container
             for container_name, container in containers_obj.iteritems():
                 # Each container is has multiple peer servers, this is where the metric values are pulled from
                 for peer in container['peers']:
+                    indexed_dimensions = peer_index.dimensions(container_name, peer) if peer_index else None
+                    if indexed_dimensions is not None:
+                        self._emit_extracted_metrics(peer, metrics, sink, indexed_dimensions)
+                        continue
                     # Get the dimensions from each peer server
                     dimensions = {container_dim_name : container_name, peer_dim_name : _reduce_to_path(peer, 'name')}
                     self._fetch_and_emit_metrics(peer, metrics, sink, dimensions)
 
-    def _fetch_and_emit_metrics(self, scoped_obj, metrics, sink, dimensions=None):
+    def _update_peer_index(self, group, containers_obj, sink):
         '''
-        For each metric the value is extracted from the given object and emitted
-        with the specified dimensions using the given sink. The current time will
-        be passed in on the emit.
+        Update the PeerIndex of a group with the peers of this read when peer events or
+        notifications are enabled. Emit the numbers of peers added, removed and changing
+        state in each container, and dispatch a notification for each peer changing state.
+        Returns the index, None when not enabled.
+        '''
+        if not (self.peer_events or self.notification_sink) or group.name not in PEER_EVENT_METRICS\
+                or not isinstance(containers_obj, dict):
+            return None
 
-        Any global dimensions will be applied to the given dimensions.
+        peer_index = self._peer_indexes.get(group.name)
+        if not peer_index:
+            peer_index = self._peer_indexes[group.name] = PeerIndex(*group.dimension_names)
+        events = peer_index.update(containers_obj, self.global_dimensions)
+
+        event_counts = dict((container_name, dict.fromkeys(PEER_EVENT_KINDS, 0)) for container_name in containers_obj)
+        for event in events:
+            LOGGER.info('Peer %s of %s %s, state: %s -> %s', event.peer_name, event.container_name, event.kind,\
+                        event.old_state, event.new_state)
+            event_counts.setdefault(event.container_name, dict.fromkeys(PEER_EVENT_KINDS, 0))[event.kind] += 1
+            if self.notification_sink and event.kind == PEER_STATE_CHANGED:
+                self._notify_peer_state_change(group, event)
+
+        if not self.peer_events:
+            return peer_index
+
+        event_metrics = PEER_EVENT_METRICS[group.name]
+        for container_name, counts in event_counts.iteritems():
+            self._emit_values([(event_metrics[kind], counts[kind]) for kind in PEER_EVENT_KINDS], sink,\
+                              {group.dimension_names[0] : container_name})
+        return peer_index
+
+    def _notify_peer_state_change(self, group, event):
         '''
-        for metric in metrics:
-            value = _reduce_to_path(scoped_obj, metric.scoped_object_key)
-            if value is not None:
-                updated_dims = dimensions.copy() if dimensions else {}
-                updated_dims.update(self.global_dimensions)
-                sink.emit(MetricRecord(metric.name, metric.type, value, self.instance_id, updated_dims, time.time()))
+        Dispatch a notification of a peer changing state, with the container and peer
+        names as dimensions.
+        '''
+        dimensions = {group.dimension_names[0] : event.container_name, group.dimension_names[1] : event.peer_name}
+        dimensions.update(self.global_dimensions)
+        message = 'Peer {} of {} changed state from {} to {}'.format(event.peer_name, event.container_name,\
+                                                                     event.old_state, event.new_state)
+        severity = PEER_STATE_SEVERITIES.get(event.new_state, WARNING_SEVERITY)
+        self.notification_sink.notify(NotificationRecord(PEER_NOTIFICATION_NAMES[group.name], severity, message,\
+                                                         self.instance_id, dimensions))
+
+    def _take_peer_snapshot(self, group, containers_obj, metrics):
+        '''
+        Take a columnar snapshot of the peers of a group when columnar peers are enabled,
+        with the columns read by the rollup and the idle object tracking. The peer metrics
+        are emitted from the peer dicts, so no snapshot is taken when neither is enabled.
+        Returns the snapshot and the keys of the peers changed since the previous
+        snapshot, None when not needed.
+        '''
+        peer_rollup = self.peer_rollup and group.name in PEER_ROLLUPS
+        if not self.columnar_peers or not (peer_rollup or self.idle_threshold) or not isinstance(containers_obj, dict):
+            return None, None
+
+        column_keys = []
+        if self.idle_threshold:
+            column_keys.extend(metric.scoped_object_key for metric in _input_metrics(metrics))
+        if peer_rollup:
+            column_keys.extend(metric.scoped_object_key for metric in PEER_ROLLUPS[group.name].metrics)
+        snapshot = PeerColumns(containers_obj, column_keys)
+
+        previous_snapshot = self._peer_snapshots.get(group.name)
+        self._peer_snapshots[group.name] = snapshot
+        if not self.idle_threshold:
+            return snapshot, None
+        changed_keys = snapshot.changed_keys(previous_snapshot, [metric.scoped_object_key for metric\
+                                                                 in _input_metrics(metrics)])
+        return snapshot, changed_keys
+
+    def _emit_peer_aggregates(self, containers_obj, group, sink, snapshot=None):
+        '''
+        Emit the aggregates of the enabled aggregators (PeerRollup, PeerDistribution) over
+        all peers of each container, with the container name as the only dimension. Given
+        a columnar snapshot of the peers, the rollup is computed over its columns.
+        '''
+        aggregators = self._get_peer_aggregators(group)
+        if not aggregators or not containers_obj:
+            return
 
-    def _reload_ephemeral_global_dimensions(self):
+        column_aggregates = {}
+        if snapshot:
+            column_aggregates = dict((aggregator, aggregator.aggregate_columns(snapshot)) for aggregator\
+                                     in aggregators if isinstance(aggregator, PeerRollup))
+
+        for container_name, container in containers_obj.iteritems():
+            dimensions = {group.dimension_names[0] : container_name}
+            for aggregator in aggregators:
+                if aggregator in column_aggregates:
+                    metric_values = column_aggregates[aggregator][container_name]
+                else:
+                    metric_values = aggregator.aggregate(container['peers'])
+                self._emit_values(metric_values, sink, dimensions)
+
+    def _select_emitted_peers(self, group, containers_obj):
         '''
-        Reload any global dimensions that have the potential to change after configuration.
+        Narrow the peers of each container to those the peer emission mode emits,
+        sampling the peers of large containers if a peer sample size is configured.
         '''
-        # Anticipate the nginx instance being upgraded between reads
-        self.global_dimensions['nginx.version'] = self.nginx_agent.get_nginx_version()
+        if not containers_obj or (self.peer_emission == ALL_PEER_EMISSION and not self.peer_sample_size):
+            return containers_obj
+
+        # Offsets of containers no longer present are dropped
+        sample_offsets = self._peer_sample_offsets.get(group.name, {})
+        self._peer_sample_offsets[group.name] = next_sample_offsets = {}
+
+        selected_obj = {}
+        for container_name, container in containers_obj.iteritems():
+            if self.peer_emission == ALL_PEER_EMISSION:
+                peers, next_sample_offsets[container_name] = self._sample_peers(container['peers'],\
+                                                                               sample_offsets.get(container_name, 0))
+            else:
+                peers = [peer for peer in container['peers'] if self._should_emit_peer(peer)]
+            selected_obj[container_name] = dict(container, peers=peers)
+        return selected_obj
 
-    def _check_bool_config_enabled(self, config_node, key):
+    def _sample_peers(self, peers, offset):
         '''
-        Convenience method to check if a collectd Config node contains the given
-        key and if that key's value is a True bool.
+        Select the failing peers and a rotating slice of peer sample size of the other
+        peers, starting at the given offset, so every peer is emitted over consecutive reads.
+        Returns the selected peers and the offset of the next slice.
         '''
-        return config_node.key == key and self._str_to_bool(config_node.values[0])
+        healthy_peers = [peer for peer in peers if peer.get('state') not in FAILING_PEER_STATES]
+        if len(healthy_peers) <= self.peer_sample_size:
+            return peers, 0
 
-    def _dimensions_str_to_dict(self, dimensions_str):
+        offset %= len(healthy_peers)
+        sampled_peers = healthy_peers[offset:offset + self.peer_sample_size]
+        sampled_peers += healthy_peers[:self.peer_sample_size - len(sampled_peers)]
+
+        failing_peers = [peer for peer in peers if peer.get('state') in FAILING_PEER_STATES]
+        return failing_peers + sampled_peers, (offset + self.peer_sample_size) % len(healthy_peers)
+
+    def _demote_idle_objects(self, group, containers_obj, metrics, sink, changed_keys=None, emitted_obj=None):
+        '''
+        Drop the containers (peers) of a group that are idle on this read. An object whose
+        metric values have not changed for idle threshold reads of the group is idle and
+        is only emitted on every idle interval-th read, any change restores it to every read.
+        The numbers of idle and active objects are emitted as objects.idle and objects.active.
+
+        The changed objects are detected by comparing their metric values with the previous
+        read, unless the keys of the changed objects are given. Every object of containers_obj
+        is tracked and counted; if emitted_obj is given, such as the sampled peers, the objects
+        of emitted_obj that are not idle on this read are returned.
+        '''
+        if emitted_obj is None:
+            emitted_obj = containers_obj
+        if not self.idle_threshold or not containers_obj or not metrics:
+            return emitted_obj
+
+        # States of objects no longer present are dropped
+        idle_states = self._idle_states.get(group.name, {})
+        self._idle_states[group.name] = next_idle_states = {}
+        counts = {IDLE_OBJECTS_METRIC : 0, ACTIVE_OBJECTS_METRIC : 0}
+
+        def is_emitted(object_key, obj):
+            last_signature, unchanged_reads = idle_states.get(object_key, (None, None))
+            if changed_keys is None:
+                signature = tuple(metric.extract(obj) for metric in metrics)
+                changed = signature != last_signature
+            else:
+                signature = None
+                changed = unchanged_reads is None or object_key in changed_keys
+            unchanged_reads = 0 if changed else unchanged_reads + 1
+            next_idle_states[object_key] = (signature, unchanged_reads)
+
+            idle_reads = unchanged_reads - self.idle_threshold
+            if idle_reads < 0:
+                counts[ACTIVE_OBJECTS_METRIC] += 1
+                return True
+            counts[IDLE_OBJECTS_METRIC] += 1
+            return idle_reads % self.idle_interval == 0
+
+        emitted_keys = set()
+        for container_name, container in containers_obj.iteritems():
+            if group.traversal == PEER_TRAVERSAL:
+                emitted_keys.update((container_name, peer.get('name')) for peer in container['peers']\
+                                    if is_emitted((container_name, peer.get('name')), peer))
+            elif is_emitted(container_name, container):
+                emitted_keys.add(container_name)
+
+        demoted_obj = {}
+        for container_name, container in emitted_obj.iteritems():
+            if group.traversal == PEER_TRAVERSAL:
+                peers = [peer for peer in container['peers'] if (container_name, peer.get('name')) in emitted_keys]
+                demoted_obj[container_name] = dict(container, peers=peers)
+            elif container_name in emitted_keys:
+                demoted_obj[container_name] = container
+
+        self._emit_values(counts.items(), sink, {'metric.group' : group.name})
+        return demoted_obj
+
+    def _get_series_budget(self, group):
+        '''
+        Get the number of series the group may emit, the smaller of its own budget and the
+        remaining instance budget. None is returned when no budget applies.
+        '''
+        budgets = [budget for budget in (self.group_series_budgets.get(group.name), self._series_remaining)\
+                   if budget is not None]
+        return min(budgets) if budgets else None
+
+    def _consume_series_budget(self, series_count):
+        '''
+        Deduct emitted series from the remaining instance budget of the current read.
+        '''
+        if self._series_remaining is not None:
+            self._series_remaining = max(self._series_remaining - series_count, 0)
+
+    def _apply_series_budget(self, group, containers_obj, metrics, sink):
+        '''
+        Keep the containers (peers) of a group within the series left in the budget of the
+        given SeriesBudgetMetricSink, once the aggregates, peer events and idle object counts
+        of the group are emitted. An object costs a series per metric it has a value for.
+
+        When the budget is exceeded only the top-N containers (peers) ranked by traffic are
+        kept, the others are folded into a single container (a peer of a container) named
+        "__other__" (see _fold_objects), so the group emits at most one "__other__" series
+        per metric. The "__other__" object is dropped as well when its series do not fit.
+        Returns the kept containers and the number of folded containers (peers).
+        '''
+        if not isinstance(sink, SeriesBudgetMetricSink) or not containers_obj or not metrics:
+            return containers_obj, 0
+
+        if group.traversal == PEER_TRAVERSAL:
+            objects = [(container_name, peer) for container_name, container in containers_obj.iteritems()\
+                       for peer in container['peers']]
+        else:
+            objects = containers_obj.items()
+
+        if len(objects) * len(metrics) <= sink.remaining:
+            return containers_obj, 0
+        costs = [_series_count(obj[1], metrics) for obj in objects]
+        if sum(costs) <= sink.remaining:
+            return containers_obj, 0
+
+        if group.rank_path:
+            ranked = sorted(zip(objects, costs), key=lambda (obj, _): _reduce_to_path(obj[1], group.rank_path) or 0,\
+                            reverse=True)
+        else:
+            ranked = sorted(zip(objects, costs),\
+                            key=lambda (obj, _): obj[0] if group.traversal != PEER_TRAVERSAL else obj[1].get('name'))
+
+        # Folding fewer objects never gives "__other__" more series than folding them all
+        other_cost = _series_count(_fold_objects([obj[1] for obj in objects], metrics), metrics)
+        kept = []
+        kept_cost = 0
+        for obj, cost in ranked:
+            if kept_cost + cost + other_cost > sink.remaining:
+                break
+            kept.append(obj)
+            kept_cost += cost
+        kept_ids = set(id(obj[1]) for obj in kept)
+        dropped = [obj for obj in objects if id(obj[1]) not in kept_ids]
+        other_obj = _fold_objects([obj[1] for obj in dropped], metrics)
+        if kept_cost + _series_count(other_obj, metrics) > sink.remaining:
+            other_obj = None
+
+        LOGGER.debug('Series budget of %s exceeded, folding %s objects into %s', group.name, len(dropped),\
+                     OTHER_BUCKET_NAME)
+
+        if group.traversal != PEER_TRAVERSAL:
+            limited_obj = dict(kept)
+            if other_obj is not None:
+                limited_obj[OTHER_BUCKET_NAME] = other_obj
+            return limited_obj, len(dropped)
+
+        limited_obj = dict((container_name, dict(container, peers=[]))\
+                           for container_name, container in containers_obj.iteritems())
+        for container_name, peer in kept:
+            limited_obj[container_name]['peers'].append(peer)
+
+        # The peers dropped from every container share the one "__other__" slot
+        if other_obj is not None:
+            other_obj['name'] = OTHER_BUCKET_NAME
+            limited_obj[OTHER_BUCKET_NAME] = {'peers' : [other_obj]}
+
+        return limited_obj, len(dropped)
+
+    def _get_peer_aggregators(self, group):
+        '''
+        Get the enabled aggregators computed over the peers of a peer group.
+        '''
+        aggregators = []
+        if self.peer_rollup and group.name in PEER_ROLLUPS:
+            aggregators.append(PEER_ROLLUPS[group.name])
+        if self.peer_distribution and group.name in PEER_DISTRIBUTIONS:
+            aggregators.append(PEER_DISTRIBUTIONS[group.name])
+        return aggregators
+
+    def _should_emit_peer(self, peer):
+        '''
+        Check the peer emission mode to determine if the metrics of a peer should be emitted.
+        '''
+        if self.peer_emission == ALL_PEER_EMISSION:
+            return True
+        if self.peer_emission == FAILING_PEER_EMISSION:
+            return peer.get('state') in FAILING_PEER_STATES
+        return False
+
+    def _fetch_and_emit_metrics(self, scoped_obj, metrics, sink, dimensions=None):
+        '''
+        For each metric the value is extracted from the given object and emitted
+        with the specified dimensions using the given sink. The current time will
+        be passed in on the emit.
+
+        Any global dimensions will be applied to the given dimensions.
+        '''
+        # The dimensions are shared by every record built from the scoped object
+        updated_dims = dimensions.copy() if dimensions else {}
+        updated_dims.update(self.global_dimensions)
+        self._emit_extracted_metrics(scoped_obj, metrics, sink, updated_dims)
+
+    def _emit_extracted_metrics(self, scoped_obj, metrics, sink, dimensions):
+        '''
+        For each metric the value is extracted from the given object and emitted with
+        the given dimensions, used as they are, and the current time.
+        '''
+        timestamp = time.time()
+
+        for metric in metrics:
+            value = metric.extract(scoped_obj)
+            if value is not None:
+                sink.emit(MetricRecord(metric.name, metric.type, value, self.instance_id, dimensions, timestamp))
+
+    def _emit_values(self, metric_values, sink, dimensions=None):
+        '''
+        Emit already computed values, given as (MetricDefinition, value) pairs, with
+        the specified dimensions. Pairs with a None value are skipped.
+
+        Any global dimensions will be applied to the given dimensions.
+        '''
+        updated_dims = dimensions.copy() if dimensions else {}
+        updated_dims.update(self.global_dimensions)
+        timestamp = time.time()
+
+        for metric, value in metric_values:
+            if value is not None:
+                sink.emit(MetricRecord(metric.name, metric.type, value, self.instance_id, updated_dims, timestamp))
+
+    def _build_emitters(self, enabled_group_keys, group_read_multiples=None):
+        '''
+        Generate the emitters for the default metric groups and the opted-in
+        groups from the registry, merged by shared endpoint and traversal.
+        The targets of a fleet configured alike share the merged metric definitions.
+        '''
+        group_read_multiples = group_read_multiples or {}
+
+        if self.fleet_resources:
+            plan_key = (frozenset(enabled_group_keys), frozenset(group_read_multiples.iteritems()))
+            plan = self.fleet_resources.emitter_plan(plan_key,\
+                                                     lambda: self._plan_emitters(enabled_group_keys, group_read_multiples))
+        else:
+            plan = self._plan_emitters(enabled_group_keys, group_read_multiples)
+
+        return [MetricEmitter(functools.partial(self._emit_metric_group, group), metrics, group, read_multiple)\
+                for group, metrics, read_multiple in plan]
+
+    def _plan_emitters(self, enabled_group_keys, group_read_multiples):
+        '''
+        Merge the metric groups of the emitters, returns a list of (MetricGroup,
+        merged list of MetricDefinition, read multiple).
+        '''
+        emitters = []
+        for group in METRIC_GROUPS:
+            if group.config_key is None or group.config_key in enabled_group_keys:
+                emitters.append(MetricEmitter(None, group.metrics, group, group_read_multiples.get(group.name, 1)))
+        return [(emitter.group, emitter.metrics, emitter.read_multiple) for emitter in self._merge_emitters(emitters)]
+
+    def _merge_emitters(self, emitters):
+        '''
+        Merge emitters sharing an endpoint and traversal shape into a single emitter,
+        so each container/peer is visited once per read with all enabled definitions.
+        The order in which the emitters were first added is preserved.
+        '''
+        merged = []
+        for emitter in emitters:
+            target = next((existing for existing in merged if existing.can_merge(emitter)), None)
+            if target:
+                target.merge(emitter)
+            else:
+                merged.append(MetricEmitter(emitter.emit_func, list(emitter.metrics), emitter.group,\
+                                            emitter.read_multiple))
+        return merged
+
+    def _reload_ephemeral_global_dimensions(self, nginx_metadata=None):
+        '''
+        Reload any global dimensions that have the potential to change after configuration,
+        from the nginx metadata of the read when given.
+        '''
+        # Anticipate the nginx instance being upgraded between reads
+        self.global_dimensions['nginx.version'] = self.nginx_agent.get_nginx_version(nginx_metadata)
+
+    def _check_bool_config_enabled(self, config_node, key):
+        '''
+        Convenience method to check if a collectd Config node contains the given
+        key and if that key's value is a True bool.
+        '''
+        return config_node.key == key and self._str_to_bool(config_node.values[0])
+
+    def _dimensions_str_to_dict(self, dimensions_str):
         dimensions = {}
         for key_pair in dimensions_str.split(','):
             key_pair_split = key_pair.split('=')
@@ -628,28 +2269,560 @@ class NginxPlusPlugin(object):
         else:
             raise ValueError('Unable to cast value (%s) to boolean' % value)
 
+    def _str_to_positive_int(self, value, config_key):
+        '''
+        Cast a configuration value to a positive integer, raising a ValueError
+        naming the configuration flag if the cast is not possible.
+        '''
+        return _str_to_positive_int(value, config_key)
+
+    def _str_to_adaptive_interval(self, min_value, max_value):
+        '''
+        Build the AdaptiveInterval of an AdaptiveInterval configuration flag, raising
+        a ValueError when the minimum interval is above the maximum.
+        '''
+        min_interval = self._str_to_positive_int(min_value, ADAPTIVE_INTERVAL)
+        max_interval = self._str_to_positive_int(max_value, ADAPTIVE_INTERVAL)
+        if min_interval > max_interval:
+            raise ValueError('Invalid value found: {} {}, please provide the minimum interval before the maximum '\
+                             'for the {}'.format(min_value, max_value, ADAPTIVE_INTERVAL))
+        return AdaptiveInterval(min_interval, max_interval)
+
+    def _add_name_filter_patterns(self, config_key, patterns):
+        '''
+        Add the patterns of a <prefix>Include or <prefix>Exclude configuration flag
+        to the name filter of the endpoint (or the peers) it applies to.
+        '''
+        if config_key.endswith(INCLUDE_SUFFIX):
+            prefix = config_key[:-len(INCLUDE_SUFFIX)]
+        else:
+            prefix = config_key[:-len(EXCLUDE_SUFFIX)]
+
+        if prefix == PEER:
+            self.peer_filter = self.peer_filter or NameFilter()
+            name_filter = self.peer_filter
+        else:
+            name_filter = self.container_filters.setdefault(CONTAINER_FILTER_FETCH_NAMES[prefix], NameFilter())
+
+        for pattern in patterns:
+            if config_key.endswith(INCLUDE_SUFFIX):
+                name_filter.add_include(pattern)
+            else:
+                name_filter.add_exclude(pattern)
+
+    def _str_to_peer_emission(self, value):
+        '''
+        Validate a peer emission mode, insensitive to case and leading/trailing spaces.
+        '''
+        mode = str(value).strip().lower()
+        if mode not in PEER_EMISSION_MODES:
+            raise ValueError('Invalid {} value: {}, expected one of: {}'.format(PEER_EMISSION, value,\
+                                                                               ', '.join(PEER_EMISSION_MODES)))
+        return mode
+
     def _log_emitter_group_enabled(self, emitter_group):
         LOGGER.debug('%s enabled, adding emitters', emitter_group)
 
+class TargetDiscovery(object):
+    '''
+    Reads the targets of a fleet from a JSON or YAML file, or from every such file of a
+    directory, and reads them again when a file is added, removed or modified. Changes
+    are detected from the modification times of the files, without reading them.
+
+    A file holds a list of targets, or an object with a "Targets" list as the standalone
+    runner's configuration file. Each target is an object of configuration keys to values.
+
+    Constructor Arguements:
+        path: The path of the targets file, or of the directory of targets files
+        shared_nodes: The configuration nodes applied to every target, before its own
+    '''
+    def __init__(self, path, shared_nodes):
+        self.path = path
+        self.shared_nodes = shared_nodes
+        self.fleet_resources = None
+        self.shard_ring = None
+        self.targets = []
+        self.failed_count = 0
+        # Key of each configured target -> plugin
+        self.plugins = {}
+        self._signature = None
+
+    def check(self):
+        '''
+        Read the targets again when the files changed since the last check.
+        Returns True when the targets were read, a file failing to read is
+        logged and the last targets are kept.
+        '''
+        signature = self._files_signature()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+
+        try:
+            targets = []
+            for file_path, _, _ in signature:
+                targets.extend(_load_targets_file(file_path))
+        except Exception:
+            LOGGER.exception('Failed to read the targets of %s, keeping the current targets', self.path)
+            return False
+
+        self.targets = targets
+        return True
+
+    def _files_signature(self):
+        '''
+        The (path, modification time, size) of each targets file.
+        '''
+        if os.path.isdir(self.path):
+            file_paths = [os.path.join(self.path, name) for name in sorted(os.listdir(self.path))\
+                          if name.endswith(JSON_TARGETS_FILE_EXTENSIONS + YAML_TARGETS_FILE_EXTENSIONS)]
+        else:
+            file_paths = [self.path]
+
+        signature = []
+        for file_path in file_paths:
+            try:
+                file_stat = os.stat(file_path)
+                signature.append((file_path, file_stat.st_mtime, file_stat.st_size))
+            except OSError:
+                LOGGER.warning('Targets file %s not found', file_path)
+        return tuple(signature)
+
+class ShardRing(object):
+    '''
+    Consistent hash ring assigning targets to the collectors sharing them. Each collector
+    is placed at SHARD_RING_REPLICAS points of the ring, a target belongs to the collector
+    of the first point following the hash of the target. When a collector is added or
+    removed only the targets of its points move, about one in the number of collectors.
+
+    Constructor Arguements:
+        members: The names of every collector sharing the targets
+        member: The name of this collector, one of the members
+    '''
+    def __init__(self, members, member):
+        if member not in members:
+            raise ValueError('Invalid shard name: {}, expected one of: {}'.format(member, ', '.join(members)))
+
+        self.member = member
+        points = sorted((_stable_fraction('{}#{}'.format(ring_member, replica)), ring_member)\
+                        for ring_member in set(members) for replica in range(SHARD_RING_REPLICAS))
+        self._point_hashes = [point_hash for point_hash, _ in points]
+        self._point_members = [ring_member for _, ring_member in points]
+
+    def owner(self, key):
+        '''
+        Get the collector a target key belongs to.
+        '''
+        index = bisect.bisect(self._point_hashes, _stable_fraction(key)) % len(self._point_hashes)
+        return self._point_members[index]
+
+    def owns(self, key):
+        '''
+        Check whether a target key belongs to this collector.
+        '''
+        return self.owner(key) == self.member
+
+class LazyThreadPool(object):
+    '''
+    A ThreadPool started on its first use. A pool created while collectd reads its
+    configuration is started by the first read, after a daemonized collectd forked,
+    as threads do not survive the fork.
+
+    Constructor Arguements:
+        threads: The number of threads of the pool
+    '''
+    def __init__(self, threads):
+        self.threads = threads
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def map(self, func, iterable):
+        '''
+        Apply func to each item on the threads of the pool, returning the results in order.
+        '''
+        with self._lock:
+            if not self._pool:
+                self._pool = ThreadPool(self.threads)
+            pool = self._pool
+        return pool.map(func, iterable)
+
+    def terminate(self):
+        '''
+        Stop the threads of the pool, if started.
+        '''
+        with self._lock:
+            if self._pool:
+                self._pool.terminate()
+                self._pool = None
+
+class FleetResources(object):
+    '''
+    Resources shared by the NginxPlusPlugins of a fleet, the targets configured in a
+    single Module block: the pool of HTTP connections, the thread pools fetching
+    endpoints and single objects, and the emitter plans of targets configured alike.
+    The thread pools are only started by the first read.
+
+    Constructor Arguements:
+        threads: The number of threads of each thread pool, and of connections kept per target
+        target_count: The number of targets, connections are pooled for each
+    '''
+    def __init__(self, threads, target_count):
+        self.threads = threads
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=max(target_count, 1), pool_maxsize=threads)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.fetch_pool = LazyThreadPool(threads)
+        # Endpoint fetches running on the fetch pool fetch their objects on this pool
+        self.object_fetch_pool = LazyThreadPool(threads)
+
+        self._emitter_plans = {}
+        self._lock = threading.Lock()
+
+    def emitter_plan(self, plan_key, build_plan):
+        '''
+        Get the emitter plan of a configuration, built by build_plan the first time.
+        '''
+        with self._lock:
+            if plan_key not in self._emitter_plans:
+                self._emitter_plans[plan_key] = build_plan()
+            return self._emitter_plans[plan_key]
+
+    def close(self):
+        '''
+        Release the thread pools and the connections.
+        '''
+        self.fetch_pool.terminate()
+        self.object_fetch_pool.terminate()
+        self.session.close()
+
+class StaggeredReadRegistrar(object):
+    '''
+    Registers the read callbacks of staggered instances with collectd after their read
+    offset, on a single thread. collectd then reads each instance in its read threads at
+    that place in every interval, with its own backoff, and no thread is started per read.
+    The thread is started from the init callback, as threads do not survive the fork of a
+    daemonized collectd.
+
+    Constructor Arguements:
+        register: The function registering the read callback of a plugin
+    '''
+    def __init__(self, register):
+        self._register = register
+        # Heap of (registration time, sequence, plugin)
+        self._pending = []
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def add(self, plugin, read_offset):
+        '''
+        Register the read callback of a plugin read_offset seconds from now.
+        '''
+        with self._condition:
+            self._sequence += 1
+            heapq.heappush(self._pending, (time.time() + read_offset, self._sequence, plugin))
+            self._condition.notify()
+
+    def remove(self, plugin):
+        '''
+        Drop the pending registration of a plugin, if any.
+        '''
+        with self._condition:
+            self._pending = [entry for entry in self._pending if entry[2] is not plugin]
+            heapq.heapify(self._pending)
+
+    def start(self):
+        '''
+        Start the registration thread, once.
+        '''
+        with self._condition:
+            if self._thread or self._closed:
+                return
+            self._thread = threading.Thread(target=self._run, name='nginx-plus-collectd.stagger')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def close(self):
+        '''
+        Stop the registration thread, dropping the pending registrations.
+        '''
+        with self._condition:
+            self._closed = True
+            self._pending = []
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and (not self._pending or self._pending[0][0] > time.time()):
+                    timeout = self._pending[0][0] - time.time() if self._pending else None
+                    self._condition.wait(timeout)
+                if self._closed:
+                    return
+                _, _, plugin = heapq.heappop(self._pending)
+
+            try:
+                self._register(plugin)
+            except Exception:
+                LOGGER.exception('Failed to register the reads of %s', plugin.instance_id)
+
 class NginxPlusPluginManager(object):
     '''
     Class to create, configure and manage instances of NginxPlusPlugin.
-    The config and read methods of this class will be registered with collectd,
-    proxying to the configure and read methods of the plugin instances it is composed of.
+    The config method of this class is registered with collectd, proxying to the configure
+    method of the plugin instances it is composed of. The read method of each instance is
+    registered as its own read callback, so that collectd's ReadThreads read instances in parallel.
     '''
     def __init__(self):
         self.plugins = []
+        self.fleets = []
+        self.discoveries = []
+        self.staggered_reads = StaggeredReadRegistrar(self._register_read)
+        self._read_callback_names = {}
+        self._read_callback_ids = {}
+        self._lock = threading.Lock()
+        self._initialized = False
+        self.snapshot_servers = {}
 
     def config_callback(self, conf):
         '''
         Create and configure an instance of NginxPlusPlugin.
         The created plugin will be added to the list of plugins
-        managed by this instance.
+        managed by this instance, and its reads registered with collectd
+        at the Interval of the instance, or the collectd Interval.
+
+        A Module block with Target blocks, or a TargetsPath, configures a fleet instead,
+        one instance per target.
         '''
+        target_nodes = [node for node in conf.children if node.key == TARGET]
+        if target_nodes or any(node.key == TARGETS_PATH for node in conf.children):
+            self._configure_fleet(conf, target_nodes)
+            return
+
+        shard_ring = _build_shard_ring(conf.children)
+        if shard_ring and not shard_ring.owns(_target_endpoint(conf.children)):
+            LOGGER.info('Skipping target %s, it belongs to shard %s', _target_endpoint(conf.children),\
+                        shard_ring.owner(_target_endpoint(conf.children)))
+            return
+
         plugin = NginxPlusPlugin()
         plugin.configure(conf)
+        self._add_plugin(plugin)
 
-        self.plugins.append(plugin)
+    def init_callback(self):
+        '''
+        Start the threads of the manager, once collectd has forked.
+        '''
+        self._initialized = True
+        self.staggered_reads.start()
+        with self._lock:
+            self._start_snapshot_servers()
+
+    def shutdown_callback(self):
+        '''
+        Release the thread pools and connections of the plugins and fleets.
+        '''
+        self.staggered_reads.close()
+        for plugin in self.plugins:
+            plugin.close()
+        for fleet_resources in self.fleets:
+            fleet_resources.close()
+        for snapshot_server in self.snapshot_servers.itervalues():
+            snapshot_server.close()
+
+    def _configure_fleet(self, conf, target_nodes):
+        '''
+        Configure an instance of NginxPlusPlugin per Target block, and per target of the
+        TargetsPath, sharing FleetResources. The options outside of the Target blocks apply
+        to every target, before the target's own options. Targets are configured
+        concurrently, a target failing its configuration is logged and skipped.
+        When sharded, only the targets belonging to this collector are configured.
+        '''
+        fleet_threads = DEFAULT_FLEET_THREADS
+        targets_path = None
+        targets_check_interval = None
+        shared_nodes = []
+        for node in conf.children:
+            if node.key == FLEET_THREADS:
+                fleet_threads = _str_to_positive_int(node.values[0], FLEET_THREADS)
+            elif node.key == TARGETS_PATH:
+                targets_path = node.values[0]
+            elif node.key == TARGETS_CHECK_INTERVAL:
+                targets_check_interval = _str_to_positive_int(node.values[0], TARGETS_CHECK_INTERVAL)
+            elif node.key != TARGET and node.key not in SHARD_CONFIG_KEYS:
+                shared_nodes.append(node)
+
+        shard_ring = _build_shard_ring(conf.children)
+        if shard_ring:
+            owned_target_nodes = [node for node in target_nodes\
+                                  if shard_ring.owns(_target_endpoint(shared_nodes + list(node.children)))]
+            LOGGER.info('Shard %s owns %s targets out of %s', shard_ring.member, len(owned_target_nodes),\
+                        len(target_nodes))
+            target_nodes = owned_target_nodes
+
+        discovery = TargetDiscovery(targets_path, shared_nodes) if targets_path else None
+        if discovery:
+            discovery.shard_ring = shard_ring
+            discovery.check()
+
+        target_count = len(target_nodes) + (len(discovery.targets) if discovery else 0)
+        fleet_resources = FleetResources(fleet_threads, target_count)
+        self.fleets.append(fleet_resources)
+
+        plugins = [plugin for plugin in self._configure_fleet_targets(fleet_resources, shared_nodes,\
+                                                                      [node.children for node in target_nodes])\
+                   if plugin]
+        for plugin in plugins:
+            self._add_plugin(plugin)
+        LOGGER.info('Configured a fleet of %s targets out of %s', len(plugins), len(target_nodes))
+
+        if discovery:
+            discovery.fleet_resources = fleet_resources
+            self.discoveries.append(discovery)
+            self._sync_discovered_targets(discovery)
+
+            read_kwargs = {'data' : discovery, 'name' : 'nginx-plus-collectd.targets.{}'.format(targets_path)}
+            if targets_check_interval:
+                read_kwargs['interval'] = targets_check_interval
+            collectd.register_read(self.discovery_callback, **read_kwargs)
+
+    def discovery_callback(self, discovery):
+        '''
+        Called once per TargetsCheckInterval, or collectd Interval, to check the targets
+        files of a TargetDiscovery for changes. Targets that failed their configuration
+        are retried even when the files are unchanged.
+        '''
+        if discovery.check() or discovery.failed_count:
+            self._sync_discovered_targets(discovery)
+
+    def _sync_discovered_targets(self, discovery):
+        '''
+        Add an instance of NginxPlusPlugin for each new target of a TargetDiscovery, and remove
+        the instances of the targets no longer listed. Unchanged targets are left untouched,
+        a target is identified by all of its configuration. When sharded, the targets
+        belonging to other collectors are ignored.
+        '''
+        targets = OrderedDict((json.dumps(target, sort_keys=True), target) for target in discovery.targets)
+        if discovery.shard_ring:
+            targets = OrderedDict((target_key, target) for target_key, target in targets.iteritems()\
+                                  if discovery.shard_ring.owns(_target_endpoint(discovery.shared_nodes +\
+                                                                                _target_to_config(target).children)))
+
+        removed_keys = [target_key for target_key in discovery.plugins if target_key not in targets]
+        for target_key in removed_keys:
+            self._remove_plugin(discovery.plugins.pop(target_key))
+
+        added_keys = [target_key for target_key in targets if target_key not in discovery.plugins]
+        plugins = self._configure_fleet_targets(discovery.fleet_resources, discovery.shared_nodes,\
+                                                [_target_to_config(targets[target_key]).children\
+                                                 for target_key in added_keys])
+        for target_key, plugin in zip(added_keys, plugins):
+            if plugin:
+                discovery.plugins[target_key] = plugin
+                self._add_plugin(plugin)
+        discovery.failed_count = len(targets) - len(discovery.plugins)
+
+        if removed_keys or added_keys:
+            LOGGER.info('Targets of %s changed, %s removed, %s added, %s failed', discovery.path, len(removed_keys),\
+                        len(added_keys), len([plugin for plugin in plugins if not plugin]))
+
+    def _configure_fleet_targets(self, fleet_resources, shared_nodes, targets_children):
+        '''
+        Configure an instance of NginxPlusPlugin per list of target configuration nodes,
+        concurrently. Returns the plugins in order, None for each target failing its configuration.
+        The configuration threads are joined before returning, collectd may fork right after.
+        '''
+        def configure_target(target_children):
+            plugin = NginxPlusPlugin(fleet_resources)
+            try:
+                plugin.configure(CollectdConfigMock(shared_nodes + list(target_children)))
+            except Exception:
+                LOGGER.exception('Failed to configure target %s, skipping it',\
+                                 ', '.join('{} {}'.format(node.key, node.values[0]) for node in target_children\
+                                           if node.key in (STATUS_HOST, STATUS_PORT)))
+                return None
+            return plugin
+
+        if not targets_children:
+            return []
+        configure_pool = ThreadPool(min(fleet_resources.threads, len(targets_children)))
+        try:
+            return configure_pool.map(configure_target, targets_children)
+        finally:
+            configure_pool.close()
+            configure_pool.join()
+
+    def _add_plugin(self, plugin):
+        '''
+        Manage a configured plugin, registering its reads with collectd. The reads of
+        instances configured with a ReadStagger are registered after their offset.
+
+        Discovered targets are added from collectd's read threads, the plugins list is
+        replaced by a copy under the lock so it can be iterated without it.
+        '''
+        with self._lock:
+            self.plugins = self.plugins + [plugin]
+            _attach_snapshot_store(self.snapshot_servers, plugin)
+            if self._initialized:
+                self._start_snapshot_servers()
+
+        read_offset = plugin.read_offset()
+        if read_offset:
+            self.staggered_reads.add(plugin, read_offset)
+        else:
+            self._register_read(plugin)
+
+    def _start_snapshot_servers(self):
+        '''
+        Start the snapshot servers not started yet, a server failing to start is logged.
+        Called with the lock held.
+        '''
+        for snapshot_server in self.snapshot_servers.itervalues():
+            try:
+                snapshot_server.start()
+            except Exception:
+                LOGGER.exception('Failed to serve snapshots on %s', snapshot_server.address)
+
+    def _register_read(self, plugin):
+        '''
+        Register the read callback of a managed plugin with collectd, at its Interval.
+        '''
+        with self._lock:
+            if plugin not in self.plugins:
+                return
+            read_callback_name = self._read_callback_name(plugin)
+            self._read_callback_names[plugin] = read_callback_name
+            read_kwargs = {'data' : plugin, 'name' : read_callback_name}
+            if plugin.read_interval:
+                read_kwargs['interval'] = plugin.read_interval
+            self._read_callback_ids[plugin] = collectd.register_read(self.read_plugin_callback, **read_kwargs)
+
+    def _remove_plugin(self, plugin):
+        '''
+        Stop managing a plugin, unregistering its reads with collectd, and close it.
+        '''
+        with self._lock:
+            plugins = list(self.plugins)
+            plugins.remove(plugin)
+            self.plugins = plugins
+            self.staggered_reads.remove(plugin)
+            self._read_callback_names.pop(plugin, None)
+            read_callback_id = self._read_callback_ids.pop(plugin, None)
+            if read_callback_id is not None:
+                collectd.unregister_read(read_callback_id)
+
+        if plugin.snapshot_store:
+            plugin.snapshot_store.remove_target(plugin.snapshot_target)
+        plugin.close()
+
+    def read_plugin_callback(self, plugin):
+        '''
+        Called to emit the metrics of a single instance of NginxPlusPlugin, once per
+        interval of the instance.
+        '''
+        plugin.read()
 
     def read_callback(self):
         '''
@@ -660,7 +2833,254 @@ class NginxPlusPluginManager(object):
         increasing amount of time until it returns to normal.
         '''
         for plugin in self.plugins:
-            plugin.read()
+            self.read_plugin_callback(plugin)
+
+    def _read_callback_name(self, plugin):
+        '''
+        Name the read callback of an instance after its status endpoint, unique among the instances.
+        '''
+        base_name = 'nginx-plus-collectd.{}:{}'.format(plugin.nginx_agent.status_host, plugin.nginx_agent.status_port)
+        used_names = set(self._read_callback_names.itervalues())
+        name = base_name
+        suffix = 0
+        while name in used_names:
+            suffix += 1
+            name = '{}.{}'.format(base_name, suffix)
+        return name
+
+def _format_dimensions(dimensions):
+    '''
+    Formats a dictionary of key/value pairs as a comma-delimited list of key=value tokens.
+    This was copied from docker-collectd-plugin.
+    '''
+    return ','.join(['='.join((key.replace('.', '_'), value)) for key, value in dimensions.iteritems()])
+
+def _series_key(metric_record):
+    '''
+    Build a hashable key identifying the series a record belongs to.
+    '''
+    return (metric_record.name, metric_record.instance_id, tuple(sorted(metric_record.dimensions.iteritems())))
+
+def _parse_nginx_timestamp(value):
+    '''
+    Convert an NGINX+ timestamp to epoch seconds. The legacy API gives milliseconds
+    since the epoch, the versioned API gives ISO 8601 strings, e.g. "2021-10-11T05:55:23.459Z".
+    None is returned for missing or malformed values.
+    '''
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return value / 1000.0
+
+    try:
+        seconds, _, fraction = value.rstrip('Z').partition('.')
+        epoch_seconds = calendar.timegm(time.strptime(seconds, '%Y-%m-%dT%H:%M:%S'))
+        return epoch_seconds + (float('0.' + fraction) if fraction else 0.0)
+    except Exception:
+        sys.exc_clear()
+    return None
+
+def _weighted_summary(samples):
+    '''
+    Summarize a list of (value, weight) pairs: min, max, weighted mean and weighted
+    percentiles. A percentile is the smallest value whose cumulative weight reaches
+    the percentile of the total weight. When every weight is zero, e.g. no requests
+    were made yet, the values are weighted equally.
+    '''
+    samples = sorted(samples)
+    total_weight = sum(weight for _, weight in samples)
+    if total_weight <= 0:
+        samples = [(value, 1) for value, _ in samples]
+        total_weight = len(samples)
+
+    summary = {
+        'min' : samples[0][0],
+        'max' : samples[-1][0],
+        'mean' : sum(value * weight for value, weight in samples) / float(total_weight)
+    }
+
+    percentiles = [(stat, float(stat[1:]) / 100 * total_weight) for stat in DISTRIBUTION_STATS if stat[0] == 'p']
+    cumulative_weight = 0
+    for value, weight in samples:
+        cumulative_weight += weight
+        while percentiles and cumulative_weight >= percentiles[0][1]:
+            summary[percentiles.pop(0)[0]] = value
+    for stat, _ in percentiles:
+        summary[stat] = samples[-1][0]
+
+    return summary
+
+def _literal_pattern_value(pattern):
+    '''
+    Get the name matched by a pattern if it only matches that exact name, i.e. an
+    anchored regular expression without special characters ("^name$") or a glob
+    without wildcards ("glob:name"). None is returned otherwise.
+    '''
+    if pattern.startswith(GLOB_PATTERN_PREFIX):
+        glob = pattern[len(GLOB_PATTERN_PREFIX):]
+        return glob if glob and not re.search(r'[*?\[]', glob) else None
+
+    match = re.match(r'^\^((?:\\[^\w\s]|[\w\-:/@ ])+)\$$', pattern)
+    if match:
+        return re.sub(r'\\(.)', r'\1', match.group(1))
+    return None
+
+def _peer_id(peer):
+    '''
+    Get the id of a peer, its name when the peer has no id.
+    '''
+    return peer.get('id', peer.get('name'))
+
+def _str_to_positive_int(value, config_key):
+    '''
+    Cast a configuration value to a positive integer, raising a ValueError
+    naming the configuration flag if the cast is not possible.
+    '''
+    err_msg = "{err}, please provide a valid positive integer value for the {key}"
+    try:
+        int_value = int(value)
+        if int_value < 1:
+            raise ValueError("Invalid value found: {}".format(value))
+    except Exception as e:
+        raise ValueError(err_msg.format(err=e, key=config_key))
+    return int_value
+
+def _build_shard_ring(nodes):
+    '''
+    Build the ShardRing of the ShardIndex and ShardCount, or ShardPeers and ShardName,
+    configuration flags. Returns None when not sharded.
+    '''
+    shard_index = None
+    shard_count = None
+    shard_peers = None
+    shard_name = None
+    for node in nodes:
+        if node.key == SHARD_COUNT:
+            shard_count = _str_to_positive_int(node.values[0], SHARD_COUNT)
+        elif node.key == SHARD_INDEX:
+            try:
+                shard_index = int(node.values[0])
+            except ValueError:
+                shard_index = -1
+        elif node.key == SHARD_PEERS:
+            shard_peers = list(node.values)
+        elif node.key == SHARD_NAME:
+            shard_name = node.values[0]
+
+    if shard_peers:
+        return ShardRing(shard_peers, shard_name or _standalone_host())
+    if shard_count is None and shard_index is None:
+        return None
+    if shard_count is None or shard_index is None or not 0 <= shard_index < shard_count:
+        raise ValueError('Invalid sharding, please provide a {} from 0 to the {} - 1'.format(SHARD_INDEX, SHARD_COUNT))
+    return ShardRing([str(index) for index in range(shard_count)], str(shard_index))
+
+def _target_endpoint(nodes):
+    '''
+    The "<host>:<port>" of a target's status endpoint, from its configuration nodes.
+    Used as the target's id before its instance id is known.
+    '''
+    status_host = 'localhost'
+    status_port = 8080
+    for node in nodes:
+        if node.key == STATUS_HOST:
+            status_host = node.values[0]
+        elif node.key == STATUS_PORT:
+            status_port = node.values[0]
+    return '{}:{}'.format(status_host, status_port)
+
+def _load_targets_file(file_path):
+    '''
+    Read the list of targets of a JSON or YAML targets file, YAML requires PyYAML.
+    '''
+    with open(file_path) as targets_file:
+        if file_path.endswith(YAML_TARGETS_FILE_EXTENSIONS):
+            if yaml is None:
+                raise RuntimeError('PyYAML is required to read the targets file {}'.format(file_path))
+            targets = yaml.safe_load(targets_file)
+        else:
+            targets = json.load(targets_file, object_pairs_hook=OrderedDict)
+
+    if isinstance(targets, dict):
+        targets = targets.get(RUNNER_TARGETS)
+    if not isinstance(targets, list) or not all(isinstance(target, dict) for target in targets):
+        raise ValueError('Invalid targets file {}, expected a list of targets'.format(file_path))
+    return targets
+
+def _stable_fraction(key):
+    '''
+    Map a string to a fraction in [0, 1), the same for every process and host.
+    '''
+    return int(hashlib.sha1(key).hexdigest()[:8], 16) / float(0x100000000)
+
+def _relative_change(old_value, new_value):
+    '''
+    The change between two values relative to the first one, with values below 1 counted as 1.
+    '''
+    return abs(new_value - old_value) / float(max(abs(old_value), 1))
+
+def _input_metrics(metrics):
+    '''
+    Get the metrics whose values are read from an object to build the given metrics,
+    the counters read by a derived metric in its place.
+    '''
+    return [input_metric for metric in metrics for input_metric in getattr(metric, 'input_metrics', [metric])]
+
+def _to_int64_column(values):
+    '''
+    Build a NumPy column of 64 bit integers from values, or of Python objects if any value
+    is not an integer in their range, e.g. a float, so no value is rounded. Missing values
+    are 0 in the column. Returns the column and the mask of the values present.
+    '''
+    try:
+        # Integers below 2 ** 53 are exact as floats, the common case is converted at once
+        floats = numpy.array(values, dtype=float)
+    except (TypeError, ValueError):
+        floats = None
+    if floats is not None:
+        present = ~numpy.isnan(floats)
+        floats[~present] = 0
+        if numpy.all(numpy.abs(floats) < 2 ** 53) and numpy.all(floats == numpy.floor(floats)):
+            return floats.astype(numpy.int64), present
+
+    present = numpy.array([value is not None for value in values], dtype=bool)
+    values = [0 if value is None else value for value in values]
+    column = numpy.array(values)
+    # NumPy infers floats for integers beyond 64 bits mixed with smaller ones
+    if column.dtype.kind in 'bi':
+        return column.astype(numpy.int64, copy=False), present
+    return numpy.array(values, dtype=object), present
+
+def _to_number(value):
+    '''
+    Convert a NumPy scalar into a Python number, integral floats into integers.
+    '''
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _fold_objects(objs, metrics):
+    '''
+    Fold several objects into one holding, at the path of each metric, the sum of the
+    counters of the objects and the largest value of their gauges, e.g. the longest
+    response time. Derived metrics are computed from the folded counters they read.
+    '''
+    folded = {}
+    for metric in _input_metrics(metrics):
+        values = [value for value in (_reduce_to_path(obj, metric.scoped_object_path) for obj in objs)\
+                  if value is not None]
+        if values:
+            target = folded
+            for key in metric.scoped_object_path[:-1]:
+                target = target.setdefault(key, {})
+            target[metric.scoped_object_path[-1]] = sum(values) if metric.type == 'counter' else max(values)
+    return folded
+
+def _series_count(obj, metrics):
+    '''
+    Count the series the given metrics emit for an object, those it has a value for.
+    '''
+    return len([metric for metric in metrics if metric.extract(obj) is not None])
 
 def _reduce_to_path(obj, path):
     '''
@@ -689,16 +3109,149 @@ def _reduce_to_path(obj, path):
     return None
 
 
+class CachedResponse(object):
+    '''
+    A response body read from a SharedPollCache, standing in for the requests response.
+    '''
+    def __init__(self, content):
+        self.status_code = requests.codes.ok
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+class SharedPollCache(object):
+    '''
+    Cache of the status API responses shared by every process polling NGINX+ on a host,
+    e.g. collectd and a standalone runner. The body of each url is cached in its own
+    memory-mapped file, after a header holding the time it was fetched and its length,
+    guarded by a file lock. The first process getting a url once its cached body is
+    older than max_age fetches it while holding the lock, the other processes wait for
+    the lock and read the body it fetched.
+
+    Constructor Arguements:
+        directory: The directory of the cache files, created if missing
+        max_age: Number of seconds a cached body is served for
+    '''
+    def __init__(self, directory, max_age):
+        self.directory = directory
+        self.max_age = max_age
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    def get(self, url, fetch):
+        '''
+        Get the response of a url, a CachedResponse when the cached body is fresh, the
+        response returned by fetch otherwise. The bodies of OK responses are cached.
+        The cache is bypassed when its file can't be opened, e.g. not writable.
+        '''
+        path = os.path.join(self.directory, hashlib.sha1(url).hexdigest() + SHARED_POLL_CACHE_EXTENSION)
+        try:
+            cache_fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+        except OSError as e:
+            LOGGER.debug('Bypassing the shared poll cache file %s. %s', path, e)
+            return fetch()
+
+        # Closing the file releases the lock
+        try:
+            fcntl.flock(cache_fd, fcntl.LOCK_SH)
+            content = self._read_fresh(cache_fd)
+            if content is None:
+                # The lock is released while converted, check again once exclusive
+                fcntl.flock(cache_fd, fcntl.LOCK_EX)
+                content = self._read_fresh(cache_fd)
+            if content is not None:
+                return CachedResponse(content)
+
+            response = fetch()
+            if response.status_code == requests.codes.ok:
+                self._write(cache_fd, response.content)
+            return response
+        finally:
+            os.close(cache_fd)
+
+    def _read_fresh(self, cache_fd):
+        '''
+        Read the cached body, None when missing or older than max_age.
+        '''
+        size = os.fstat(cache_fd).st_size
+        if size < SHARED_POLL_CACHE_HEADER.size:
+            return None
+
+        cache_map = mmap.mmap(cache_fd, size, access=mmap.ACCESS_READ)
+        try:
+            fetch_time, length = SHARED_POLL_CACHE_HEADER.unpack_from(cache_map)
+            if SHARED_POLL_CACHE_HEADER.size + length > size or not 0 <= time.time() - fetch_time < self.max_age:
+                return None
+            return cache_map[SHARED_POLL_CACHE_HEADER.size:SHARED_POLL_CACHE_HEADER.size + length]
+        finally:
+            cache_map.close()
+
+    def _write(self, cache_fd, content):
+        '''
+        Write a body and its header, growing the file as needed.
+        '''
+        size = SHARED_POLL_CACHE_HEADER.size + len(content)
+        if os.fstat(cache_fd).st_size < size:
+            os.ftruncate(cache_fd, size)
+
+        cache_map = mmap.mmap(cache_fd, size)
+        try:
+            cache_map[SHARED_POLL_CACHE_HEADER.size:size] = content
+            SHARED_POLL_CACHE_HEADER.pack_into(cache_map, 0, time.time(), len(content))
+        finally:
+            cache_map.close()
+
+class CollectionStats(object):
+    '''
+    Struct for the size, in bytes, and object names of a collection the last time
+    it was fetched whole. Used to estimate if fetching single objects is cheaper.
+    '''
+    def __init__(self, size, names):
+        self.size = size
+        self.names = names
+
+    def per_object_cheaper(self, selected_count, listing):
+        '''
+        Estimate if fetching the selected number of objects one by one, after listing the
+        collection's names if listing is set, costs less than fetching the whole collection.
+        '''
+        object_size = self.size / float(max(len(self.names), 1))
+        cost = selected_count * (REQUEST_OVERHEAD_BYTES + object_size)
+        if listing:
+            cost += REQUEST_OVERHEAD_BYTES + len(self.names) * LISTED_NAME_BYTES
+        return cost < REQUEST_OVERHEAD_BYTES + self.size
+
 class NginxStatusAgent(object):
     '''
     Helper class for interacting with a single NGINX+ instance.
+
+    A requests session and a thread pool shared with other agents may be given,
+    every request is then made over the shared session's connections.
     '''
-    def __init__(self, status_host=None, status_port=None, username=None, password=None, api_version=None, api_base_path=None):
+    def __init__(self, status_host=None, status_port=None, username=None, password=None, api_version=None, api_base_path=None,\
+                 session=None, object_fetch_pool=None):
         self.status_host = status_host or 'localhost'
         self.status_port = status_port or 8080
         self.auth_tuple = (username, password) if username or password else None
         self.api_version = api_version
         self.api_base_path = api_base_path
+        self.object_fetch_concurrency = DEFAULT_OBJECT_FETCH_CONCURRENCY
+        self.skip_unchanged_responses = False
+        self.shared_poll_cache = None
+
+        # Url -> (digest of the last response body, decoded last response)
+        self._last_responses = {}
+        # Used to estimate whether fetching single objects is cheaper than whole collections
+        self._collection_stats = {}
+        self._session = None
+        self._object_fetch_pool = None
+        self._object_fetch_pool_lock = threading.Lock()
+        self._shared_session = session
+        self._shared_object_fetch_pool = object_fetch_pool
 
         if self.api_version is None:
             detected_api_version = self._get_api_version()
@@ -745,17 +3298,38 @@ class NginxStatusAgent(object):
         '''
         return self._send_get(self.ssl_url)
 
-    def get_slabs(self):
+    def get_slabs(self, names=None, name_filter=None):
         '''
         Fetch the memory slabs status summary.
+        If names (or a name_filter) are given, the selected objects may be fetched on their own.
+        '''
+        return self._send_get_objects(self.slabs_url, names, name_filter)
+
+    def get_nginx_metadata(self):
+        '''
+        Fetch the metadata of nginx+ once, for the getters below to share within a read.
+        This is the /nginx response with the versioned API, and a dict holding the version
+        with the legacy API. None is returned for an unexpected response.
         '''
-        return self._send_get(self.slabs_url)
+        if self.api_version is None:
+            return {'version' : self._send_get(self.nginx_version_url)}
+
+        json_response = self._send_get(self.nginx_metadata_url)
+        if isinstance(json_response, dict):
+            return json_response
+
+        LOGGER.error("Unexpected response of type: %s from %s", type(json_response), self.nginx_metadata_url)
 
-    def get_nginx_version(self):
+        return None
+
+    def get_nginx_version(self, nginx_metadata=None):
         '''
-        Fetch the version of nginx+.
+        Fetch the version of nginx+, or take it from the given metadata.
         Note, this will only return the value, not a dict.
         '''
+        if nginx_metadata is not None:
+            return nginx_metadata.get('version', None)
+
         if self.api_version is not None:
             json_response = self._send_get(self.nginx_metadata_url)
             if isinstance(json_response, dict):
@@ -767,6 +3341,22 @@ class NginxStatusAgent(object):
 
         return self._send_get(self.nginx_version_url)
 
+    def get_nginx_timestamps(self, nginx_metadata=None):
+        '''
+        Get the current time of nginx+ and the time it was last (re)loaded from the given
+        metadata, fetched when not given.
+        Note, this will return a (timestamp, load_timestamp) tuple of epoch seconds,
+        either of which may be None. The legacy API has no timestamps in its metadata, and
+        they are not fetched on their own, so both are None.
+        '''
+        if nginx_metadata is None:
+            nginx_metadata = self.get_nginx_metadata()
+        if nginx_metadata is None:
+            return (None, None)
+
+        return (_parse_nginx_timestamp(nginx_metadata.get('timestamp', None)),
+                _parse_nginx_timestamp(nginx_metadata.get('load_timestamp', None)))
+
     def get_nginx_address(self):
         '''
         Fetch the address of the nginx+ instance.
@@ -783,35 +3373,40 @@ class NginxStatusAgent(object):
 
         return self._send_get(self.address_url)
 
-    def get_caches(self):
+    def get_caches(self, names=None, name_filter=None):
         '''
         Fetch the caches status summary.
+        If names (or a name_filter) are given, the selected objects may be fetched on their own.
         '''
-        return self._send_get(self.caches_url)
+        return self._send_get_objects(self.caches_url, names, name_filter)
 
-    def get_server_zones(self):
+    def get_server_zones(self, names=None, name_filter=None):
         '''
         Fetch the server-zones status summary.
+        If names (or a name_filter) are given, the selected objects may be fetched on their own.
         '''
-        return self._send_get(self.server_zones_url)
+        return self._send_get_objects(self.server_zones_url, names, name_filter)
 
-    def get_upstreams(self):
+    def get_upstreams(self, names=None, name_filter=None):
         '''
         Fetch the upstreams status summary.
+        If names (or a name_filter) are given, the selected objects may be fetched on their own.
         '''
-        return self._send_get(self.upstreams_url)
+        return self._send_get_objects(self.upstreams_url, names, name_filter)
 
-    def get_stream_upstreams(self):
+    def get_stream_upstreams(self, names=None, name_filter=None):
         '''
         Fetch the stream upstreams status summary.
+        If names (or a name_filter) are given, the selected objects may be fetched on their own.
         '''
-        return self._send_get(self.stream_upstream_url)
+        return self._send_get_objects(self.stream_upstream_url, names, name_filter)
 
-    def get_stream_server_zones(self):
+    def get_stream_server_zones(self, names=None, name_filter=None):
         '''
         Fetch the stream server zones status summary.
+        If names (or a name_filter) are given, the selected objects may be fetched on their own.
         '''
-        return self._send_get(self.stream_server_zones_url)
+        return self._send_get_objects(self.stream_server_zones_url, names, name_filter)
 
     def get_processes(self):
         '''
@@ -819,6 +3414,18 @@ class NginxStatusAgent(object):
         '''
         return self._send_get(self.processes_url)
 
+    def close(self):
+        '''
+        Release the thread pool and the connections of the agent.
+        '''
+        with self._object_fetch_pool_lock:
+            if self._object_fetch_pool:
+                self._object_fetch_pool.terminate()
+                self._object_fetch_pool = None
+        if self._session:
+            self._session.close()
+            self._session = None
+
     def _get_api_version(self):
         '''
         Determines whether the Nginx-plus plugin has a versioned API or legacy API.
@@ -827,12 +3434,13 @@ class NginxStatusAgent(object):
         legacy_api_base_path = self.api_base_path if self.api_base_path is not None else '/status'
         base_url = 'http://{}:{}'.format(self.status_host, str(self.status_port))
 
+        requester = self._shared_session or requests
         try:
-            response = requests.get("{}{}/{}".format(base_url, newer_api_base_path, DEFAULT_API_VERSION), auth=self.auth_tuple)
+            response = requester.get("{}{}/{}".format(base_url, newer_api_base_path, DEFAULT_API_VERSION), auth=self.auth_tuple)
             if response.status_code == requests.codes.ok:
                 return DEFAULT_API_VERSION
             else:
-                response = requests.get("{}{}".format(base_url, legacy_api_base_path), auth=self.auth_tuple)
+                response = requester.get("{}{}".format(base_url, legacy_api_base_path), auth=self.auth_tuple)
                 if response.status_code == requests.codes.ok:
                     return None
             raise RuntimeError(
@@ -840,11 +3448,11 @@ class NginxStatusAgent(object):
         except RequestException as e:
             raise RequestException("Failed to detect the Nginx-plus API type (versioned or legacy), due to the error: %s", e)
 
-    def validate_nginx_version(self):
+    def validate_nginx_version(self, nginx_metadata=None):
         '''
         Detects the change in the Nginx version and raise an error in case of a version change or unable to get the version
         '''
-        cur_nginx_version = self.get_nginx_version()
+        cur_nginx_version = self.get_nginx_version(nginx_metadata)
 
         if cur_nginx_version is None:
             raise RuntimeError("Unable to get the Nginx version")
@@ -852,21 +3460,136 @@ class NginxStatusAgent(object):
         if self.nginx_version != cur_nginx_version:
             raise RuntimeError("Nginx version change detected from {} to {}".format(self.nginx_version, cur_nginx_version))
 
-    def _send_get(self, url):
+    def _send_get(self, url, session=None, sizes=None, missing_ok=False):
         '''
         Performs a GET against the given url.
+        If a requests session is given it is used to reuse its connections. If a sizes
+        list is given, the size of the response body is appended to it. With a shared
+        poll cache, a body fetched by another process during its max age is reused.
+        If missing_ok is set, a url not found is only logged at debug level.
         '''
         status = None
+        requester = session or self._shared_session or requests
         try:
-            response = requests.get(url, auth=self.auth_tuple)
+            if self.shared_poll_cache:
+                response = self.shared_poll_cache.get(url, lambda: requester.get(url, auth=self.auth_tuple))
+            else:
+                response = requester.get(url, auth=self.auth_tuple)
             if response.status_code == requests.codes.ok:
-                status = response.json()
+                status = self._decode_response(url, response)
+                if sizes is not None:
+                    sizes.append(len(response.content))
+            elif missing_ok and response.status_code == requests.codes.not_found:
+                LOGGER.debug('No object found at %s', url)
             else:
                 LOGGER.error('Unexpected status code: %s, received from %s', response.status_code, url)
         except RequestException as e:
             LOGGER.exception('Failed request to %s. %s', self.base_status_url, e)
         return status
 
+    def _decode_response(self, url, response):
+        '''
+        Decode the JSON body of a response. When skipping unchanged responses, a body
+        identical to the last response from the url is not decoded again, the very
+        same object is returned instead.
+        '''
+        if not self.skip_unchanged_responses:
+            return response.json()
+
+        digest = hashlib.sha1(response.content).digest()
+        last_response = self._last_responses.get(url)
+        if last_response and last_response[0] == digest:
+            return last_response[1]
+
+        status = response.json()
+        self._last_responses[url] = (digest, status)
+        return status
+
+    def _send_get_objects(self, url, names=None, name_filter=None):
+        '''
+        Performs a GET against the given collection url, or against the url of each
+        selected object of the collection when that is cheaper. Objects are selected by
+        names or by a name_filter callable. Either way the objects are returned keyed by
+        name, as the whole collection would be; callers still filter the result as a
+        whole collection may be returned.
+
+        Only the versioned API serves single objects. Which fetch is cheaper is estimated
+        from the size and names of the collection the last time it was fetched whole. Names
+        selected by a filter are resolved by listing the collection without its fields.
+        More than MAX_NAMED_OBJECT_FETCHES names are always fetched with their collection.
+        '''
+        if self.api_version is None or (names is None and name_filter is None):
+            return self._send_get(url)
+
+        stats = self._collection_stats.get(url)
+        if names is None:
+            if stats is None:
+                return self._send_get_collection(url)
+
+            selected_count = len([name for name in stats.names if name_filter(name)])
+            if selected_count > MAX_NAMED_OBJECT_FETCHES or not stats.per_object_cheaper(selected_count, listing=True):
+                return self._send_get_collection(url)
+
+            listing = self._send_get('{}?fields='.format(url), self._get_session())
+            if not isinstance(listing, dict):
+                return self._send_get_collection(url)
+
+            stats.names = listing.keys()
+            names = [name for name in stats.names if name_filter(name)]
+        elif len(names) > MAX_NAMED_OBJECT_FETCHES or\
+                (stats is not None and not stats.per_object_cheaper(len(names), listing=False)):
+            return self._send_get_collection(url)
+
+        return self._send_get_named_objects(url, names)
+
+    def _send_get_collection(self, url):
+        '''
+        Performs a GET against the given collection url, recording the size and object
+        names of the collection to estimate the cost of the next fetches.
+        '''
+        sizes = []
+        status = self._send_get(url, self._get_session(), sizes)
+        if isinstance(status, dict) and sizes:
+            self._collection_stats[url] = CollectionStats(sizes[0], status.keys())
+        return status
+
+    def _send_get_named_objects(self, url, names):
+        '''
+        Performs a GET for each named object of the given collection url, in parallel
+        over the connections of a shared session.
+        '''
+        object_urls = ['{}/{}'.format(url, urllib.quote(name, safe='')) for name in names]
+        session = self._get_session()
+
+        fetch = lambda object_url: self._send_get(object_url, session, missing_ok=True)
+
+        if self.object_fetch_concurrency > 1 and len(object_urls) > 1:
+            object_fetch_pool = self._shared_object_fetch_pool or self._get_object_fetch_pool()
+            objs = object_fetch_pool.map(fetch, object_urls)
+        else:
+            objs = [fetch(object_url) for object_url in object_urls]
+
+        return dict((name, obj) for name, obj in zip(names, objs) if obj is not None)
+
+    def _get_object_fetch_pool(self):
+        '''
+        Get the thread pool of the agent fetching single objects, started on first use.
+        '''
+        with self._object_fetch_pool_lock:
+            if not self._object_fetch_pool:
+                self._object_fetch_pool = ThreadPool(self.object_fetch_concurrency)
+            return self._object_fetch_pool
+
+    def _get_session(self):
+        '''
+        Get the requests session whose connections are reused across fetches.
+        '''
+        if self._shared_session:
+            return self._shared_session
+        if not self._session:
+            self._session = requests.Session()
+        return self._session
+
     def _initialize_newer_api_urls(self):
         '''
         Initialize the newer API URL
@@ -902,6 +3625,203 @@ class NginxStatusAgent(object):
         self.slabs_url = '{}/slabs'.format(self.base_status_url)
         self.processes_url = '{}/processes'.format(self.base_status_url)
 
+class Snapshot(object):
+    '''
+    Struct for the latest response of a section of a target, serialized to JSON when
+    first served.
+    '''
+    def __init__(self, fetch_time, status_json, json_bytes=None):
+        self.fetch_time = fetch_time
+        self.status_json = status_json
+        self.json_bytes = json_bytes
+
+    def data_json(self):
+        '''
+        The JSON of the response, serialized on the first call. Concurrent first calls
+        may each serialize it, to the same JSON.
+        '''
+        if self.json_bytes is None:
+            self.json_bytes = json.dumps(self.status_json, separators=(',', ':'))
+        return self.json_bytes
+
+class SnapshotStore(object):
+    '''
+    Keeps the latest status API response of each section of each target. Storing a response
+    costs the read nothing, it is serialized to JSON when first served and then served as is.
+    A response identical to the previous one, the very same object when skipping unchanged
+    responses, keeps the JSON already serialized.
+    '''
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def put(self, target, section, status_json):
+        with self._lock:
+            last_snapshot = self._snapshots.get((target, section))
+            json_bytes = None
+            if last_snapshot and last_snapshot.status_json is status_json:
+                json_bytes = last_snapshot.json_bytes
+            self._snapshots[(target, section)] = Snapshot(time.time(), status_json, json_bytes)
+
+    def remove_target(self, target):
+        with self._lock:
+            for key in [key for key in self._snapshots if key[0] == target]:
+                del self._snapshots[key]
+
+    def index_json(self):
+        '''
+        The JSON of the age in seconds of each section of each target.
+        '''
+        now = time.time()
+        with self._lock:
+            snapshots = self._snapshots.items()
+
+        index = {}
+        for (target, section), snapshot in snapshots:
+            index.setdefault(target, {})[section] = now - snapshot.fetch_time
+        return json.dumps({'targets' : index})
+
+    def snapshot_json(self, target, section):
+        '''
+        The JSON of the latest response of a section of a target, with its fetch time
+        and age. None when there is no such snapshot.
+        '''
+        with self._lock:
+            snapshot = self._snapshots.get((target, section))
+        if not snapshot:
+            return None
+
+        header = json.dumps({'target' : target, 'section' : section, 'time' : snapshot.fetch_time,\
+                             'age' : time.time() - snapshot.fetch_time})
+        return '{},"data":{}}}'.format(header[:-1], snapshot.data_json())
+
+class SnapshotRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Serves the snapshots of the server's SnapshotStore: the index at "/" and the
+    latest response of a section of a target at "/targets/<host>:<port>/<section>".
+    '''
+    def do_GET(self):
+        path = [urllib.unquote(segment) for segment in self.path.split('?')[0].strip('/').split('/')]
+        body = None
+        if path == ['']:
+            body = self.server.snapshot_store.index_json()
+        elif len(path) == 3 and path[0] == 'targets':
+            body = self.server.snapshot_store.snapshot_json(path[1], path[2])
+
+        if body is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, msg_format, *args):
+        LOGGER.debug('Snapshot server: %s', msg_format % args)
+
+class SnapshotHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class UnixSnapshotHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+class SnapshotServer(object):
+    '''
+    Serves the snapshots of a SnapshotStore over HTTP on a daemon thread, so that local
+    tools reuse the responses fetched by the plugin instead of querying NGINX+ again.
+    Under collectd the server is started from the init callback, as threads do not
+    survive the fork of a daemonized collectd.
+
+    Constructor Arguements:
+        address: A port listened on at 127.0.0.1, or the path of a unix socket
+        store: The SnapshotStore served
+    '''
+    def __init__(self, address, store):
+        self.address = address
+        self.store = store
+        self._server = None
+
+    def start(self):
+        '''
+        Listen and serve, unless already started. A socket left at the unix socket path
+        is replaced, a ValueError is raised if another kind of file is there.
+        '''
+        if self._server:
+            return
+
+        if isinstance(self.address, basestring):
+            if os.path.lexists(self.address):
+                if not _is_unix_socket(self.address):
+                    raise ValueError('{} is not a unix socket, please provide a free path for the {}'\
+                                     .format(self.address, SNAPSHOT_LISTEN))
+                os.remove(self.address)
+            self._server = UnixSnapshotHTTPServer(self.address, SnapshotRequestHandler)
+        else:
+            self._server = SnapshotHTTPServer((SNAPSHOT_SERVER_HOST, self.address), SnapshotRequestHandler)
+        self._server.snapshot_store = self.store
+
+        server_thread = threading.Thread(target=self._server.serve_forever, name='nginx-plus-snapshot-server')
+        server_thread.daemon = True
+        server_thread.start()
+        LOGGER.info('Serving snapshots on %s', self.address)
+
+    def close(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if isinstance(self.address, basestring) and _is_unix_socket(self.address):
+                os.remove(self.address)
+
+def _str_to_snapshot_address(value):
+    '''
+    Convert a SnapshotListen value to the address of a SnapshotServer: the path of a
+    unix socket when the value is an absolute path, a port otherwise.
+    '''
+    if value.startswith('/'):
+        if os.path.lexists(value) and not _is_unix_socket(value):
+            raise ValueError("{} is not a unix socket, please provide a free path for the {}"\
+                             .format(value, SNAPSHOT_LISTEN))
+        return value
+    try:
+        port = int(value)
+        if not 0 < port < 65536:
+            raise ValueError("Invalid value found: {}".format(value))
+    except Exception as e:
+        raise ValueError("{}, please provide a port or the absolute path of a unix socket for the {}"\
+                         .format(e, SNAPSHOT_LISTEN))
+    return port
+
+def _is_unix_socket(path):
+    '''
+    Check whether a path is a unix socket, without following symbolic links.
+    '''
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except OSError:
+        return False
+
+def _attach_snapshot_store(snapshot_servers, plugin):
+    '''
+    Give a plugin the SnapshotStore served at its SnapshotListen address, creating the
+    SnapshotServer the first time the address is used. Servers are kept by address,
+    and started by the caller.
+    '''
+    if not plugin.snapshot_listen:
+        return
+
+    snapshot_server = snapshot_servers.get(plugin.snapshot_listen)
+    if not snapshot_server:
+        snapshot_server = SnapshotServer(plugin.snapshot_listen, SnapshotStore())
+        snapshot_servers[plugin.snapshot_listen] = snapshot_server
+    plugin.snapshot_store = snapshot_server.store
 
 class CollectdLogHandler(logging.Handler):
     '''
@@ -958,30 +3878,38 @@ class CollectdMock(object):
     '''
     Mock of the collectd module.
 
-    This is used when running the plugin locally.
-    All log messages are printed to stdout.
-    The Values() method will return an instance of CollectdValuesMock
+    This is used when running the plugin standalone, see StandaloneRunner.
+    All log messages are printed to stderr.
+    The Values() and Notification() methods will return instances of CollectdValuesMock
+    and CollectdNotificationMock, dispatching to the output (a PutvalOutput by default).
     '''
-    def __init__(self):
-        self.value_mock = CollectdValuesMock
+    def __init__(self, output=None):
+        self.output = output or PutvalOutput()
 
     def debug(self, msg):
-        print msg
+        print >> sys.stderr, msg
 
     def info(self, msg):
-        print msg
+        print >> sys.stderr, msg
 
     def notice(self, msg):
-        print msg
+        print >> sys.stderr, msg
 
     def warning(self, msg):
-        print msg
+        print >> sys.stderr, msg
 
     def error(self, msg):
-        print msg
+        print >> sys.stderr, msg
 
     def Values(self):
-        return (self.value_mock)()
+        return CollectdValuesMock(self.output)
+
+    def Notification(self):
+        return CollectdNotificationMock(self.output)
+
+    NOTIF_FAILURE = 1
+    NOTIF_WARNING = 2
+    NOTIF_OKAY = 4
 
 
 class CollectdValuesMock(object):
@@ -989,30 +3917,40 @@ class CollectdValuesMock(object):
     Mock of the collectd Values class.
 
     Instanes of this class are returned by CollectdMock, which is used to mock
-    collectd when running locally.
-    The dispatch() method will print the emitted record to stdout.
+    collectd when running standalone.
+    The dispatch() method will write the emitted record to the output.
     '''
+    def __init__(self, output):
+        self.output = output
+
     def dispatch(self):
         if not getattr(self, 'host', None):
-            self.host = os.environ.get('COLLECTD_HOSTNAME', 'localhost')
-
-        identifier = '%s/%s' % (self.host, self.plugin)
-        if getattr(self, 'plugin_instance', None):
-            identifier += '-' + self.plugin_instance
-        identifier += '/' + self.type
-
-        if getattr(self, 'type_instance', None):
-            identifier += '-' + self.type_instance
-
-        print '[PUTVAL]', identifier, ':'.join(map(str, [int(self.time)] + self.values))
+            self.host = _standalone_host()
+        self.output.write_values(self)
 
     def __str__(self):
         attrs = []
         for name in dir(self):
-            if not name.startswith('_') and name != 'dispatch':
+            if not name.startswith('_') and name not in ('dispatch', 'output'):
                 attrs.append("{}={}".format(name, getattr(self, name)))
         return "<CollectdValues {}>".format(' '.join(attrs))
 
+class CollectdNotificationMock(object):
+    '''
+    Mock of the collectd Notification class.
+
+    Instances of this class are returned by CollectdMock, which is used to mock
+    collectd when running standalone.
+    The dispatch() method will write the notification to the output.
+    '''
+    def __init__(self, output):
+        self.output = output
+
+    def dispatch(self):
+        if not getattr(self, 'host', None):
+            self.host = _standalone_host()
+        self.output.write_notification(self)
+
 class CollectdConfigMock(object):
     '''
     Mock of the collectd Config class.
@@ -1034,6 +3972,368 @@ class CollectdConfigChildMock(object):
         self.key = key
         self.values = values
 
+class PutvalOutput(object):
+    '''
+    Output of the standalone runner writing each value (notification) as a PUTVAL
+    (PUTNOTIF) command of the collectd plain text protocol, to stdout or to a file.
+
+    Constructor Arguements:
+        path: Optional path of the file appended to, stdout by default
+    '''
+    def __init__(self, path=None):
+        self.stream = open(path, 'a') if path else sys.stdout
+        self._lock = threading.Lock()
+
+    def write_values(self, values):
+        identifier = '{}/{}-{}/{}-{}'.format(values.host, values.plugin, values.plugin_instance, values.type,\
+                                             values.type_instance)
+        self._write('PUTVAL "{}" {}'.format(identifier, ':'.join(map(str, [int(values.time)] + values.values))))
+
+    def write_notification(self, notification):
+        self._write('PUTNOTIF severity={} time={} host={} plugin={} plugin_instance="{}" type={} '
+                    'type_instance={} message="{}"'.format(NOTIFICATION_SEVERITY_NAMES[notification.severity],\
+                                                           int(notification.time), notification.host,\
+                                                           notification.plugin, notification.plugin_instance,\
+                                                           notification.type, notification.type_instance,\
+                                                           notification.message))
+
+    def flush(self):
+        with self._lock:
+            self.stream.flush()
+
+    def close(self):
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+    def _write(self, line):
+        with self._lock:
+            self.stream.write(line + '\n')
+
+class JsonLinesOutput(PutvalOutput):
+    '''
+    Output of the standalone runner writing each value (notification) as a line of
+    JSON, in the format of the collectd write_http plugin, to stdout or to a file.
+
+    Constructor Arguements:
+        path: Optional path of the file appended to, stdout by default
+    '''
+    def write_values(self, values):
+        self._write(json.dumps(_values_to_dict(values)))
+
+    def write_notification(self, notification):
+        self._write(json.dumps(_notification_to_dict(notification)))
+
+class HttpOutput(object):
+    '''
+    Output of the standalone runner posting the values (notifications) dispatched
+    by each read as a JSON array, in the format of the collectd write_http plugin.
+
+    Constructor Arguements:
+        url: The url the values are posted to
+    '''
+    def __init__(self, url):
+        self.url = url
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+    def write_values(self, values):
+        with self._lock:
+            self._buffer.append(_values_to_dict(values))
+
+    def write_notification(self, notification):
+        with self._lock:
+            self._buffer.append(_notification_to_dict(notification))
+
+    def flush(self):
+        '''
+        Post the buffered values, which are dropped if the post fails.
+        '''
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+
+        try:
+            response = self._session.post(self.url, data=json.dumps(batch),\
+                                          headers={'Content-Type' : 'application/json'})
+            if response.status_code >= 300:
+                LOGGER.error('Unexpected status code: %s, received from %s', response.status_code, self.url)
+        except RequestException as e:
+            LOGGER.error('Failed to post %s values to %s. %s', len(batch), self.url, e)
+
+    def close(self):
+        self.flush()
+        self._session.close()
+
+class ScheduledRead(object):
+    '''
+    Struct for the schedule of the reads of a plugin.
+    '''
+    def __init__(self, plugin, interval, next_time):
+        self.plugin = plugin
+        self.interval = interval
+        self.next_time = next_time
+        self.running = False
+
+class ReadScheduler(object):
+    '''
+    Runs the reads of NginxPlusPlugins at their own intervals, on a pool of read
+    threads. A read still running when it is due again is skipped, as are the
+    intervals missed while the process was not scheduled.
+
+    Constructor Arguements:
+        read_threads: The number of reads run concurrently, reads are run on the
+                        scheduling thread when 1
+        after_read: Optional function called after each read, e.g. to flush an output
+    '''
+    def __init__(self, read_threads, after_read=None):
+        self.reads = []
+        self.after_read = after_read
+        self._pool = ThreadPool(read_threads) if read_threads > 1 else None
+
+    def add(self, plugin, interval, now=None, offset=0):
+        '''
+        Schedule the reads of a plugin every interval seconds, the first one after
+        offset seconds, wrapped to the interval.
+        '''
+        now = now if now is not None else time.time()
+        self.reads.append(ScheduledRead(plugin, interval, now + offset % interval))
+
+    def run_pending(self, now):
+        '''
+        Start the reads due at the given time. Returns the time the next read is due.
+        '''
+        for scheduled_read in self.reads:
+            if scheduled_read.next_time > now:
+                continue
+
+            missed_intervals = int((now - scheduled_read.next_time) // scheduled_read.interval)
+            scheduled_read.next_time += scheduled_read.interval * (missed_intervals + 1)
+            if scheduled_read.running:
+                LOGGER.warning('Skipping read of %s, the previous read is still running',\
+                               scheduled_read.plugin.nginx_agent.status_host)
+                continue
+
+            scheduled_read.running = True
+            if self._pool:
+                self._pool.apply_async(self._run, (scheduled_read,))
+            else:
+                self._run(scheduled_read)
+
+        return min(scheduled_read.next_time for scheduled_read in self.reads) if self.reads else None
+
+    def close(self):
+        '''
+        Wait for the running reads, then close every plugin.
+        '''
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+        for scheduled_read in self.reads:
+            scheduled_read.plugin.close()
+
+    def _run(self, scheduled_read):
+        try:
+            scheduled_read.plugin.read()
+        except Exception:
+            LOGGER.exception('Failed read of %s', scheduled_read.plugin.nginx_agent.status_host)
+        finally:
+            scheduled_read.running = False
+            if self.after_read:
+                self.after_read()
+
+class StandaloneRunner(object):
+    '''
+    Runs NginxPlusPlugins outside of collectd, configured by a JSON file in the format:
+    {
+        "Interval" : 10,
+        "ReadThreads" : 4,
+        "Output" : {"Type" : "json", "Path" : "/var/log/nginx-plus.json"},
+        "Targets" : [
+            {"StatusHost" : "10.0.0.1", "StatusPort" : 8080, "Upstream" : true, "Interval" : 5}
+        ]
+    }
+    Each target holds the configuration keys of the plugin, and optionally its own interval.
+
+    The configuration file is read again on SIGHUP, keeping the current configuration
+    if it is invalid, and the runner stops on SIGTERM or SIGINT. The signal handlers
+    only set a flag, the loop sleeps for short periods and checks the flags between.
+
+    Constructor Arguements:
+        config_path: The path of the JSON configuration file
+    '''
+    def __init__(self, config_path):
+        self.config_path = config_path
+        self.scheduler = None
+        self.output = None
+        self.snapshot_servers = {}
+        self._reload_requested = False
+        self._stop_requested = False
+
+    def load(self):
+        '''
+        Read the configuration file and replace the scheduled plugins, the output and the
+        snapshot servers. The current ones are kept if any error is raised, and whatever
+        was built for the new configuration is closed.
+        '''
+        with open(self.config_path) as config_file:
+            config = json.load(config_file, object_pairs_hook=OrderedDict)
+
+        output = _build_runner_output(config.get(RUNNER_OUTPUT, {}))
+        snapshot_servers = {}
+        scheduler = None
+        plugin = None
+        try:
+            interval = float(config.get(RUNNER_INTERVAL, DEFAULT_RUNNER_INTERVAL))
+            scheduler = ReadScheduler(int(config.get(RUNNER_READ_THREADS, DEFAULT_RUNNER_READ_THREADS)), output.flush)
+            for target in config.get(RUNNER_TARGETS, []):
+                target = OrderedDict(target)
+                plugin = NginxPlusPlugin()
+                plugin_interval = float(target.pop(RUNNER_INTERVAL, interval))
+                plugin.configure(_target_to_config(target))
+                _attach_snapshot_store(snapshot_servers, plugin)
+                scheduler.add(plugin, plugin_interval, offset=plugin.read_offset())
+                plugin = None
+        except Exception:
+            # The plugin that failed to configure is not scheduled yet
+            if plugin:
+                plugin.close()
+            _close_runner_state(scheduler, output, {})
+            raise
+
+        # The servers of the current configuration release their addresses first
+        _close_runner_state(None, None, self.snapshot_servers)
+        try:
+            for snapshot_server in snapshot_servers.itervalues():
+                snapshot_server.start()
+        except Exception:
+            _close_runner_state(scheduler, output, snapshot_servers)
+            for snapshot_server in self.snapshot_servers.itervalues():
+                snapshot_server.start()
+            raise
+
+        _close_runner_state(self.scheduler, self.output, {})
+        self.scheduler = scheduler
+        self.output = collectd.output = output
+        self.snapshot_servers = snapshot_servers
+        LOGGER.info('Loaded %s targets from %s', len(scheduler.reads), self.config_path)
+
+    def run(self):
+        '''
+        Load the configuration and run the scheduled reads until stopped.
+        '''
+        self.load()
+        signal.signal(signal.SIGHUP, self.request_reload)
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+        while not self._stop_requested:
+            if self._reload_requested:
+                self._reload_requested = False
+                try:
+                    self.load()
+                except Exception:
+                    LOGGER.exception('Failed to reload %s, keeping the current configuration', self.config_path)
+
+            next_time = self.scheduler.run_pending(time.time())
+            timeout = next_time - time.time() if next_time is not None else DEFAULT_RUNNER_INTERVAL
+            # No lock may be taken here, a signal handler could interrupt its holder
+            time.sleep(min(max(timeout, 0), RUNNER_WAKEUP_INTERVAL))
+
+        _close_runner_state(self.scheduler, self.output, self.snapshot_servers)
+
+    def request_reload(self, *_):
+        self._reload_requested = True
+
+    def request_stop(self, *_):
+        self._stop_requested = True
+
+def _close_runner_state(scheduler, output, snapshot_servers):
+    '''
+    Close the read scheduler, with its plugins, the output and the snapshot servers of a
+    standalone runner configuration, any of which may be missing.
+    '''
+    if scheduler:
+        scheduler.close()
+    if output:
+        output.close()
+    for snapshot_server in snapshot_servers.itervalues():
+        snapshot_server.close()
+
+def _build_runner_output(output_config):
+    '''
+    Build the output of the standalone runner from the "Output" configuration.
+    '''
+    output_type = output_config.get(RUNNER_OUTPUT_TYPE, PUTVAL_OUTPUT)
+    if output_type == HTTP_OUTPUT:
+        return HttpOutput(output_config[RUNNER_OUTPUT_URL])
+    if output_type == JSON_OUTPUT:
+        return JsonLinesOutput(output_config.get(RUNNER_OUTPUT_PATH))
+    if output_type == PUTVAL_OUTPUT:
+        return PutvalOutput(output_config.get(RUNNER_OUTPUT_PATH))
+    raise ValueError('Invalid output type: {}, valid types are: {}'.format(output_type, ', '.join(RUNNER_OUTPUT_TYPES)))
+
+def _target_to_config(target):
+    '''
+    Build the collectd configuration of a plugin from a standalone runner target, a dict
+    of configuration keys to values. A list holds the values of a key and a list of lists
+    repeats the key, e.g. "Dimension" : [["foo", "bar"], ["bat", "baz"]].
+    '''
+    children = []
+    for key, value in target.iteritems():
+        if isinstance(value, list) and value and all(isinstance(values, list) for values in value):
+            values_lists = value
+        else:
+            values_lists = [value if isinstance(value, list) else [value]]
+        for values in values_lists:
+            children.append(CollectdConfigChildMock(key, [_to_config_value(child_value) for child_value in values]))
+    return CollectdConfigMock(children)
+
+def _to_config_value(value):
+    '''
+    Convert a JSON value into a configuration value as collectd would give it.
+    '''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, basestring):
+        return value
+    return str(value)
+
+def _standalone_host():
+    return os.environ.get('COLLECTD_HOSTNAME', socket.gethostname())
+
+def _values_to_dict(values):
+    '''
+    Convert dispatched values into the JSON format of the collectd write_http plugin.
+    '''
+    return {
+        'host' : values.host,
+        'plugin' : values.plugin,
+        'plugin_instance' : values.plugin_instance,
+        'type' : values.type,
+        'type_instance' : values.type_instance,
+        'time' : values.time,
+        'values' : values.values,
+        'dstypes' : [values.type],
+        'dsnames' : ['value'],
+        'meta' : getattr(values, 'meta', {})
+    }
+
+def _notification_to_dict(notification):
+    '''
+    Convert a dispatched notification into the JSON format of the collectd write_http plugin.
+    '''
+    return {
+        'host' : notification.host,
+        'plugin' : notification.plugin,
+        'plugin_instance' : notification.plugin_instance,
+        'type' : notification.type,
+        'type_instance' : notification.type_instance,
+        'time' : notification.time,
+        'severity' : NOTIFICATION_SEVERITY_NAMES[notification.severity],
+        'message' : notification.message
+    }
 
 # Set up logging
 LOG_FILE_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
@@ -1047,69 +4347,20 @@ LOGGER.propagate = False
 LOGGER.addHandler(log_handler)
 
 if __name__ == '__main__':
-    kwargs = dict(arg.split('=') for arg in sys.argv[1:])
-    cli_status_host = kwargs['host'] if kwargs.get('host', None) else 'demo.nginx.com'
-    cli_status_port = kwargs['port'] if kwargs.get('port', None) else 80
-    cli_api_version = kwargs.get('api_version', None)
-    cli_api_base_path = kwargs.get('api_base_path', None)
+    parser = argparse.ArgumentParser(description='Run the NGINX+ plugin standalone, outside of collectd.')
+    parser.add_argument('config', help='path of the JSON configuration file')
+    parser.add_argument('--debug', action='store_true', help='log debug statements')
+    cli_args = parser.parse_args()
 
     collectd = CollectdMock()
+    log_handler.debug = cli_args.debug
 
-    mock_config_ip_child = CollectdConfigChildMock(STATUS_HOST, [cli_status_host])
-    mock_config_port_child = CollectdConfigChildMock(STATUS_PORT, [cli_status_port])
-    mock_config_debug_log_level = CollectdConfigChildMock(DEBUG_LOG_LEVEL, ['true'])
-
-    mock_config_username = CollectdConfigChildMock(USERNAME, ['user1'])
-    mock_config_password = CollectdConfigChildMock(PASSWORD, ['test'])
-
-    mock_config_dimension = CollectdConfigChildMock(DIMENSION, ['foo', 'bar'])
-    mock_config_dimensions = CollectdConfigChildMock(DIMENSIONS, ['bat=baz'])
-
-
-    # Setup the mock config to enable all metric groups
-    mock_config_server_zone_child = CollectdConfigChildMock(SERVER_ZONE, ['true'])
-    mock_config_memory_zone_child = CollectdConfigChildMock(MEMORY_ZONE, ['true'])
-    mock_config_upstream_child = CollectdConfigChildMock(UPSTREAM, ['true'])
-    mock_config_cache_child = CollectdConfigChildMock(CACHE, ['true'])
-    mock_config_stream_server_zone_child = CollectdConfigChildMock(STREAM_SERVER_ZONE, ['true'])
-    mock_config_stream_upstream_child = CollectdConfigChildMock(STREAM_UPSTREAM, ['true'])
-    mock_config_processes_child = CollectdConfigChildMock(PROCESSES, ['true'])
-
-    mock_config_input_list = [mock_config_ip_child,
-                                mock_config_port_child,
-                                mock_config_debug_log_level,
-                                mock_config_server_zone_child,
-                                mock_config_memory_zone_child,
-                                mock_config_upstream_child,
-                                mock_config_cache_child,
-                                mock_config_stream_server_zone_child,
-                                mock_config_stream_upstream_child,
-                                mock_config_username,
-                                mock_config_password,
-                                mock_config_dimension,
-                                mock_config_dimensions,
-                                mock_config_processes_child]
-
-    if cli_api_version is not None:
-        mock_config_api_version = CollectdConfigChildMock(API_VERSION, [cli_api_version])
-        mock_config_input_list.append(mock_config_api_version)
-
-    if cli_api_base_path is not None:
-        mock_config_api_base_path = CollectdConfigChildMock(API_BASE_PATH, [cli_api_base_path])
-        mock_config_input_list.append(mock_config_api_base_path)
-
-    mock_config = CollectdConfigMock(mock_config_input_list)
-
-    plugin_manager = NginxPlusPluginManager()
-    plugin_manager.config_callback(mock_config)
-
-    while True:
-        plugin_manager.read_callback()
-        time.sleep(5)
+    StandaloneRunner(cli_args.config).run()
 else:
     import collectd
 
     plugin_manager = NginxPlusPluginManager()
 
     collectd.register_config(plugin_manager.config_callback)
-    collectd.register_read(plugin_manager.read_callback)
+    collectd.register_init(plugin_manager.init_callback)
+    collectd.register_shutdown(plugin_manager.shutdown_callback)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+'''
+Benchmark of the upstream peer rollup and change detection, computed from the peer
+dicts and from PeerColumns snapshots with and without NumPy. The columnar passes are
+timed on their own, then as the plugin runs them: a whole upstream peers read with
+PeerRollup and IdleThreshold enabled, with and without ColumnarPeers.
+
+Run from the repository root: python -m test.benchmark_peer_columns
+'''
+import sys
+import random
+import timeit
+from mock import Mock
+
+# Mock out the collectd module
+sys.modules['collectd'] = Mock()
+
+from plugin.nginx_plus_collectd import NginxPlusPlugin, PeerColumns, METRIC_GROUPS, PEER_ROLLUPS,\
+                                       UPSTREAM_PEER_METRICS, PEER_STATES, numpy
+
+PEER_COUNTS = (1000, 10000, 50000)
+PEERS_PER_UPSTREAM = 100
+REPEAT = 5
+
+def build_upstreams_json(peer_count):
+    upstreams_json = {}
+    for index in range(peer_count):
+        peers = upstreams_json.setdefault('upstream_{}'.format(index // PEERS_PER_UPSTREAM), {'peers' : []})['peers']
+        peers.append({
+            'name' : '10.0.{}.{}:80'.format(index // 256, index % 256),
+            'state' : random.choice(PEER_STATES),
+            'requests' : random.randint(0, 10 ** 6),
+            'responses' : dict((status, random.randint(0, 10 ** 5)) for status in ('1xx', '2xx', '3xx', '4xx', '5xx',
+                                                                                   'total')),
+            'sent' : random.randint(0, 10 ** 9),
+            'received' : random.randint(0, 10 ** 9),
+            'fails' : random.randint(0, 10),
+            'unavail' : random.randint(0, 10),
+            'active' : random.randint(0, 100),
+            'response_time' : random.randint(0, 1000)
+        })
+    return upstreams_json
+
+def dict_pass(upstreams_json, previous_signatures, rollup):
+    signatures = {}
+    changed = 0
+    for upstream_name, upstream in upstreams_json.iteritems():
+        rollup.aggregate(upstream['peers'])
+        for peer in upstream['peers']:
+            key = (upstream_name, peer['name'])
+            signatures[key] = tuple(metric.extract(peer) for metric in UPSTREAM_PEER_METRICS)
+            changed += signatures[key] != previous_signatures.get(key)
+    return signatures
+
+def columns_pass(upstreams_json, previous_columns, rollup, column_keys, use_numpy):
+    columns = PeerColumns(upstreams_json, column_keys, use_numpy)
+    rollup.aggregate_columns(columns)
+    columns.changed_keys(previous_columns, column_keys)
+    return columns
+
+class NullSink(object):
+    def emit(self, metric_record):
+        pass
+
+def build_plugin(upstreams_json, columnar_peers):
+    plugin = NginxPlusPlugin()
+    plugin._instance_id = 'benchmark'
+    plugin.nginx_agent = Mock(get_upstreams=Mock(return_value=upstreams_json))
+    plugin.peer_rollup = True
+    plugin.idle_threshold = 3
+    plugin.columnar_peers = columnar_peers
+    return plugin
+
+def plugin_pass(plugin, group, sink):
+    plugin._emit_metric_group(group, UPSTREAM_PEER_METRICS, sink)
+
+def main():
+    rollup = PEER_ROLLUPS['upstream.peers']
+    column_keys = list(set(metric.scoped_object_key for metric in UPSTREAM_PEER_METRICS + rollup.metrics))
+    backends = [('dicts', None), ('columns (lists)', False)]
+    if numpy is not None:
+        backends.append(('columns (numpy)', True))
+    else:
+        print 'NumPy is not installed, skipping the NumPy columns'
+
+    for peer_count in PEER_COUNTS:
+        upstreams_json = build_upstreams_json(peer_count)
+        previous_signatures = dict_pass(upstreams_json, {}, rollup)
+        for backend_name, use_numpy in backends:
+            if use_numpy is None:
+                run = lambda: dict_pass(upstreams_json, previous_signatures, rollup)
+            else:
+                previous_columns = PeerColumns(upstreams_json, column_keys, use_numpy)
+                run = lambda: columns_pass(upstreams_json, previous_columns, rollup, column_keys, use_numpy)
+            best = min(timeit.repeat(run, number=1, repeat=REPEAT))
+            print '{:>6} peers  {:<16} {:8.1f} ms'.format(peer_count, backend_name, best * 1000)
+
+        group = next(group for group in METRIC_GROUPS if group.name == 'upstream.peers')
+        for backend_name, columnar_peers in (('plugin (dicts)', False), ('plugin (columns)', True)):
+            plugin = build_plugin(upstreams_json, columnar_peers)
+            plugin_pass(plugin, group, NullSink())
+            run = lambda: plugin_pass(plugin, group, NullSink())
+            best = min(timeit.repeat(run, number=1, repeat=REPEAT))
+            print '{:>6} peers  {:<16} {:8.1f} ms'.format(peer_count, backend_name, best * 1000)
+
+if __name__ == '__main__':
+    main()
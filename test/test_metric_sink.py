@@ -6,7 +6,8 @@ from mock import Mock, patch
 # Mock out the collectd module
 sys.modules['collectd'] = Mock()
 
-from plugin.nginx_plus_collectd import MetricSink, MetricRecord
+from plugin.nginx_plus_collectd import MetricSink, MetricRecord, ChangeOnlyMetricSink, RateMetricSink,\
+                                        NotificationSink, NotificationRecord, _format_dimensions
 
 class MetricSinkTest(TestCase):
     def setUp(self):
@@ -53,12 +54,138 @@ class MetricSinkTest(TestCase):
         expected_pair_1 = '{}={}'.format(key_1.replace('.', '_'), value_1)
         expected_pair_2 = '{}={}'.format(key_2.replace('.', '_'), value_2)
 
-        actual_dimensions = self.sink._format_dimensions(raw_dimensions)
+        actual_dimensions = _format_dimensions(raw_dimensions)
         pairs = actual_dimensions.split(',')
         self.assertEquals(2, len(pairs))
         self.assertTrue(expected_pair_1 in pairs)
         self.assertTrue(expected_pair_2 in pairs)
 
+class NotificationSinkTest(TestCase):
+    def setUp(self):
+        self.sink = NotificationSink()
+        self.mock_notification = CollectdValuesMock()
+
+    @patch('plugin.nginx_plus_collectd.collectd')
+    def test_notify_record(self, mock_collectd):
+        mock_collectd.Notification.return_value = self.mock_notification
+        mock_collectd.NOTIF_FAILURE = 1
+
+        record = NotificationRecord('upstreams.peer.state', 'failure', 'Peer 10.0.0.2:80 of backend changed state',
+                                    'my_plugin', {'upstream.name' : 'backend'})
+
+        self.sink.notify(record)
+        self.assertEquals(1, len(self.mock_notification.dispatch_collector))
+
+        notification = self.mock_notification.dispatch_collector[0]
+        self.assertIsNotNone(notification.time)
+        self.assertEquals(1, notification.severity)
+        self.assertEquals('Peer 10.0.0.2:80 of backend changed state', notification.message)
+        self.assertEquals('nginx-plus', notification.plugin)
+        self.assertEquals('upstreams.peer.state', notification.type_instance)
+        self.assertEquals('my_plugin[upstream_name=backend]', notification.plugin_instance)
+
+class ChangeOnlyMetricSinkTest(TestCase):
+    def setUp(self):
+        self.wrapped_sink = Mock()
+        self.sink = ChangeOnlyMetricSink(self.wrapped_sink, 60)
+
+    def test_emit_first_value(self):
+        self.sink.emit(_build_record(5, 1000))
+        self.assertEquals(1, self.wrapped_sink.emit.call_count)
+
+    def test_suppress_unchanged_value(self):
+        self.sink.emit(_build_record(5, 1000))
+        self.sink.emit(_build_record(5, 1010))
+        self.assertEquals(1, self.wrapped_sink.emit.call_count)
+
+    def test_emit_changed_value(self):
+        self.sink.emit(_build_record(5, 1000))
+        self.sink.emit(_build_record(6, 1010))
+        self.assertEquals(2, self.wrapped_sink.emit.call_count)
+
+    def test_emit_unchanged_value_on_heartbeat(self):
+        self.sink.emit(_build_record(5, 1000))
+        self.sink.emit(_build_record(5, 1030))
+        self.sink.emit(_build_record(5, 1060))
+        self.assertEquals(2, self.wrapped_sink.emit.call_count)
+
+    def test_series_distinguished_by_dimensions(self):
+        self.sink.emit(_build_record(5, 1000, {'upstream.peer.name' : 'foo'}))
+        self.sink.emit(_build_record(5, 1010, {'upstream.peer.name' : 'bar'}))
+        self.assertEquals(2, self.wrapped_sink.emit.call_count)
+
+    def test_prune_unseen_series(self):
+        self.sink._last_pruned = 1000
+        self.sink.emit(_build_record(5, 1000, {'upstream.peer.name' : 'foo'}))
+        self.sink.emit(_build_record(5, 1070, {'upstream.peer.name' : 'bar'}))
+        self.assertEquals(1, len(self.sink._last_dispatched))
+
+class RateMetricSinkTest(TestCase):
+    def setUp(self):
+        self.wrapped_sink = Mock()
+        self.sink = RateMetricSink(self.wrapped_sink, 900)
+
+    def test_no_rate_for_first_sample(self):
+        self.sink.start_sample(1000, 10)
+        self.sink.emit(_build_record(50, 1000.5))
+        self.wrapped_sink.emit.assert_not_called()
+
+    def test_rate_uses_sample_time(self):
+        self.sink.start_sample(1000, 10)
+        self.sink.emit(_build_record(50, 1000.5))
+        self.sink.start_sample(1010, 10)
+        self.sink.emit(_build_record(150, 1013))
+
+        self.assertEquals(1, self.wrapped_sink.emit.call_count)
+        rate_record = self.wrapped_sink.emit.call_args[0][0]
+        self.assertEquals('gauge', rate_record.type)
+        self.assertEquals(10.0, rate_record.value)
+        self.assertEquals('upstreams.fails', rate_record.name)
+
+    def test_no_rate_on_counter_reset(self):
+        self.sink.start_sample(1000, 10)
+        self.sink.emit(_build_record(150, 1000))
+        self.sink.start_sample(1010, 10)
+        self.sink.emit(_build_record(20, 1010))
+        self.sink.start_sample(1020, 10)
+        self.sink.emit(_build_record(40, 1020))
+
+        self.assertEquals(1, self.wrapped_sink.emit.call_count)
+        self.assertEquals(2.0, self.wrapped_sink.emit.call_args[0][0].value)
+
+    def test_no_rate_after_reload(self):
+        self.sink.start_sample(1000, 10)
+        self.sink.emit(_build_record(150, 1000))
+        self.sink.start_sample(1010, 1005)
+        self.sink.emit(_build_record(160, 1010))
+
+        self.wrapped_sink.emit.assert_not_called()
+
+    def test_samples_kept_without_load_timestamp(self):
+        self.sink.start_sample(1000, 10)
+        self.sink.emit(_build_record(150, 1000))
+        # The load timestamp could not be fetched
+        self.sink.start_sample(1010, None)
+        self.sink.emit(_build_record(160, 1010))
+        self.sink.start_sample(1020, 10)
+        self.sink.emit(_build_record(180, 1020))
+
+        self.assertEquals([1.0, 2.0], [call[0][0].value for call in self.wrapped_sink.emit.call_args_list])
+
+    def test_gauge_forwarded_unchanged(self):
+        record = MetricRecord('connections.active', 'gauge', 4, 'my_plugin')
+        self.sink.emit(record)
+        self.wrapped_sink.emit.assert_called_with(record)
+
+    def test_stale_samples_pruned(self):
+        self.sink.start_sample(1000, 10)
+        self.sink.emit(_build_record(150, 1000))
+        self.sink.start_sample(2000, 10)
+        self.assertEquals(0, len(self.sink._samples))
+
+def _build_record(value, timestamp, dimensions=None):
+    return MetricRecord('upstreams.fails', 'counter', value, 'my_plugin', dimensions, timestamp)
+
 class CollectdValuesMock(object):
     def __init__(self):
         self.dispatch_collector = []
@@ -10,7 +10,7 @@ from mock import Mock, MagicMock, patch
 # Mock out the collectd module
 sys.modules['collectd'] = Mock()
 
-from plugin.nginx_plus_collectd import NginxPlusPlugin, MetricRecord, MetricDefinition,\
+from plugin.nginx_plus_collectd import NginxPlusPlugin, MetricRecord, MetricDefinition, METRIC_GROUPS,\
                                         DEFAULT_CONNECTION_METRICS, DEFAULT_SERVER_ZONE_METRICS,\
                                         DEFAULT_UPSTREAM_METRICS, SERVER_ZONE_METRICS, SERVER_ZONE,\
                                         MEMORY_ZONE_METRICS, MEMORY_ZONE, UPSTREAM_PEER_METRICS, UPSTREAM,\
@@ -18,7 +18,13 @@ from plugin.nginx_plus_collectd import NginxPlusPlugin, MetricRecord, MetricDefi
                                         STREAM_UPSTREAM_PEER_METRICS, STREAM_UPSTREAM, STATUS_HOST, STATUS_PORT,\
                                         DEFAULT_SSL_METRICS, DEFAULT_REQUESTS_METRICS, DEBUG_LOG_LEVEL, log_handler,\
                                         USERNAME, PASSWORD, DIMENSION, DIMENSIONS, DEFAULT_CACHE_METRICS,\
-                                        PROCESSES_METRICS, PROCESSES, UPSTREAM_METRICS, STREAM_UPSTREAM_METRICS
+                                        PROCESSES_METRICS, PROCESSES, UPSTREAM_METRICS, STREAM_UPSTREAM_METRICS,\
+                                        READ_CONCURRENCY, METRIC_GROUP_INTERVAL,\
+                                        CHANGE_ONLY, CHANGE_ONLY_HEARTBEAT, ChangeOnlyMetricSink,\
+                                        RATE_CONVERSION, RateMetricSink, MetricSink,\
+                                        PEER_ROLLUP, PEER_EMISSION, _weighted_summary, SERIES_BUDGET,\
+                                        NameFilter, DerivedMetricDefinition, PeerIndex, READ_STAGGER,\
+                                        ADAPTIVE_INTERVAL, AdaptiveInterval, SnapshotStore
 
 
 class NginxCollectdTest(TestCase):
@@ -41,7 +47,7 @@ class NginxCollectdTest(TestCase):
 
     def test_no_emit_invalid_path(self):
         metrics = [MetricDefinition('connection.accepted', 'counter', 'foo.bar')]
-        self.plugin._emit_connection_metrics(metrics, self.mock_sink)
+        self._emit_group('connections', metrics)
 
         self.assertEquals(0, len(self.mock_sink.captured_records))
 
@@ -202,6 +208,37 @@ class NginxCollectdTest(TestCase):
         self.assertEquals(len(expected_metric_names), len(actual_metric_names))
         self.assertItemsEqual(expected_metric_names, actual_metric_names)
 
+    @patch('requests.get')
+    def test_configure_merges_emitters_on_same_endpoint(self, mock_requests_get):
+        mock_requests_get.side_effect = self._mocked_requests_get
+
+        mock_config = Mock()
+        mock_config.children = [self._build_mock_config_child(SERVER_ZONE, 'true'),
+                                self._build_mock_config_child(UPSTREAM, 'true'),
+                                self._build_mock_config_child(CACHE, 'true')]
+
+        self.plugin.configure(mock_config)
+
+        group_names = [emitter.group.name for emitter in self.plugin.emitters]
+        self.assertEquals(1, group_names.count('server.zones'))
+        self.assertEquals(1, group_names.count('upstream.peers'))
+        self.assertEquals(1, group_names.count('caches'))
+
+        actual_metric_names = self._get_metrics_names_from_plugin()
+        self.assertEquals(len(set(actual_metric_names)), len(actual_metric_names))
+
+    def test_merged_emitter_single_traversal(self):
+        self.plugin.emitters = self.plugin._build_emitters(set([SERVER_ZONE]))
+        self.plugin.emitters = [emitter for emitter in self.plugin.emitters if emitter.group.name == 'server.zones']
+
+        self.assertEquals(1, len(self.plugin.emitters))
+        self.plugin.emitters[0].emit(self.mock_sink)
+
+        self.assertEquals(1, self.plugin.nginx_agent.get_server_zones.call_count)
+        expected_names = self._extract_metric_names_from_definitions(DEFAULT_SERVER_ZONE_METRICS + SERVER_ZONE_METRICS)
+        actual_names = set(record.name for record in self.mock_sink.captured_records)
+        self.assertItemsEqual(expected_names, actual_names)
+
     @patch('requests.get')
     def test_configure_status_host_port(self, mock_requests_get):
         mock_requests_get.side_effect = self._mocked_requests_get
@@ -375,6 +412,123 @@ class NginxCollectdTest(TestCase):
         mock_emitter_1.emit.assert_called_with(mock_sink)
         mock_emitter_2.emit.assert_called_with(mock_sink)
 
+    def test_read_skipped_while_running(self):
+        mock_emitter = Mock()
+        self.plugin.sink = Mock()
+        self.plugin.emitters = [mock_emitter]
+
+        self.plugin._read_lock.acquire()
+        self.plugin.read()
+        self.plugin._read_lock.release()
+        self.plugin.read()
+
+        self.assertEquals(1, mock_emitter.emit.call_count)
+
+    def test_read_fetches_shared_endpoint_once(self):
+        self.plugin.sink = self.mock_sink
+        self.plugin.emitters = self.plugin._build_emitters(set([UPSTREAM, STREAM_UPSTREAM]))
+
+        self.plugin.read()
+
+        self.assertEquals(1, self.plugin.nginx_agent.get_upstreams.call_count)
+        self.assertEquals(1, self.plugin.nginx_agent.get_stream_upstreams.call_count)
+        record_names = set(record.name for record in self.mock_sink.captured_records)
+        self.assertTrue('upstreams.keepalive' in record_names)
+        self.assertTrue('upstreams.fails' in record_names)
+
+    def test_read_concurrent_prefetch(self):
+        self.plugin.sink = self.mock_sink
+        self.plugin.read_concurrency = 4
+        self.plugin.emitters = self.plugin._build_emitters(set([CACHE, PROCESSES]))
+
+        self.plugin.read()
+
+        self.assertEquals(1, self.plugin.nginx_agent.get_caches.call_count)
+        self.assertEquals(1, self.plugin.nginx_agent.get_processes.call_count)
+        record_names = set(record.name for record in self.mock_sink.captured_records)
+        self.assertTrue('caches.hit.responses' in record_names)
+        self.assertTrue('processes.respawned' in record_names)
+
+    def test_read_group_interval(self):
+        self.plugin.sink = self.mock_sink
+        self.plugin.emitters = self.plugin._build_emitters(set(), {'server.zones' : 3})
+
+        for _ in range(3):
+            self.plugin.read()
+
+        self.assertEquals(1, self.plugin.nginx_agent.get_server_zones.call_count)
+        self.assertEquals(3, self.plugin.nginx_agent.get_connections.call_count)
+
+    @patch('requests.get')
+    def test_configure_group_interval(self, mock_requests_get):
+        mock_requests_get.side_effect = self._mocked_requests_get
+
+        mock_config = Mock()
+        mock_config.children = [self._build_mock_config_child(METRIC_GROUP_INTERVAL, 'caches', '6'),
+                                self._build_mock_config_child(READ_CONCURRENCY, '3')]
+
+        self.plugin.configure(mock_config)
+
+        cache_emitter = next(emitter for emitter in self.plugin.emitters if emitter.group.name == 'caches')
+        self.assertEquals(6, cache_emitter.read_multiple)
+        self.assertEquals(3, self.plugin.read_concurrency)
+
+    @patch('requests.get')
+    def test_configure_change_only(self, mock_requests_get):
+        mock_requests_get.side_effect = self._mocked_requests_get
+
+        mock_config = Mock()
+        mock_config.children = [self._build_mock_config_child(CHANGE_ONLY, 'true'),
+                                self._build_mock_config_child(CHANGE_ONLY_HEARTBEAT, '120')]
+
+        self.plugin.configure(mock_config)
+
+        self.assertIsInstance(self.plugin.sink, ChangeOnlyMetricSink)
+        self.assertEquals(120, self.plugin.sink.heartbeat)
+
+    def test_read_rate_conversion(self):
+        self.plugin._rate_sink = RateMetricSink(self.mock_sink, 900)
+        self.plugin.sink = self.plugin._rate_sink
+        self.plugin.emitters = [emitter for emitter in self.plugin._build_emitters(set())
+                                if emitter.group.name == 'connections']
+
+        self.plugin.nginx_agent.get_nginx_timestamps = MagicMock(return_value=(1000.0, 10.0))
+        self.plugin.read()
+        self.plugin.nginx_agent.get_nginx_timestamps = MagicMock(return_value=(1010.0, 10.0))
+        self.plugin.read()
+
+        records = dict((record.name, record) for record in self.mock_sink.captured_records)
+        self.assertEquals('gauge', records['connections.accepted'].type)
+        self.assertEquals(0.0, records['connections.accepted'].value)
+        self.assertEquals(2, len([record for record in self.mock_sink.captured_records
+                                  if record.name == 'connections.active']))
+        # The timestamps come from the metadata fetched for the version
+        nginx_metadata = self.plugin.nginx_agent.get_nginx_metadata.return_value
+        self.plugin.nginx_agent.get_nginx_timestamps.assert_called_once_with(nginx_metadata)
+        self.plugin.nginx_agent.validate_nginx_version.assert_called_with(nginx_metadata)
+
+    @patch('requests.get')
+    def test_configure_rate_conversion(self, mock_requests_get):
+        mock_requests_get.side_effect = self._mocked_requests_get
+
+        mock_config = Mock()
+        mock_config.children = [self._build_mock_config_child(RATE_CONVERSION, 'true')]
+
+        self.plugin.configure(mock_config)
+
+        self.assertIsInstance(self.plugin.sink, RateMetricSink)
+        self.assertIsInstance(self.plugin.sink.sink, MetricSink)
+
+    @patch('requests.get')
+    def test_configure_invalid_read_concurrency(self, mock_requests_get):
+        mock_requests_get.side_effect = self._mocked_requests_get
+
+        mock_config = Mock()
+        mock_config.children = [self._build_mock_config_child(READ_CONCURRENCY, '0')]
+
+        with self.assertRaises(ValueError):
+            self.plugin.configure(mock_config)
+
     def test_read_null_instance_id(self):
         mock_nginx_agent = Mock()
         mock_nginx_agent.get_nginx_address = MagicMock(return_value=None)
@@ -398,7 +552,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('connections.accepted', 'counter', 18717986, self.plugin.instance_id,
                                        {'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_connection_metrics(metrics, self.mock_sink)
+        self._emit_group('connections', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -408,7 +562,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('connections.dropped', 'counter', 0, self.plugin.instance_id,
                                        {'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_connection_metrics(metrics, self.mock_sink)
+        self._emit_group('connections', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -418,7 +572,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('connections.idle', 'counter', 44, self.plugin.instance_id,
                                        {'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_connection_metrics(metrics, self.mock_sink)
+        self._emit_group('connections', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -428,7 +582,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('ssl.handshakes.successful', 'counter', 172619, self.plugin.instance_id,
                                        {'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_ssl_metrics(metrics, self.mock_sink)
+        self._emit_group('ssl', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -438,7 +592,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('ssl.handshakes.failed', 'counter', 32483, self.plugin.instance_id,
                                        {'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_ssl_metrics(metrics, self.mock_sink)
+        self._emit_group('ssl', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -448,7 +602,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('ssl.sessions.reuses', 'counter', 26952, self.plugin.instance_id,
                                        {'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_ssl_metrics(metrics, self.mock_sink)
+        self._emit_group('ssl', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -458,7 +612,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('requests.total', 'counter', 56371877, self.plugin.instance_id,
                                        {'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_requests_metrics(metrics, self.mock_sink)
+        self._emit_group('requests', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -468,7 +622,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('requests.current', 'gauge', 6, self.plugin.instance_id,
                                        {'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_requests_metrics(metrics, self.mock_sink)
+        self._emit_group('requests', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -478,7 +632,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('server.zone.requests', 'counter', 64475, self.plugin.instance_id,
                                         {'server.zone.name' : 'hg.nginx.org', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -488,7 +642,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('server.zone.processing', 'counter', 0, self.plugin.instance_id,
                                          {'server.zone.name' : 'hg.nginx.org', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -498,7 +652,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('server.zone.discarded', 'counter', 0, self.plugin.instance_id,
                                          {'server.zone.name' : 'hg.nginx.org', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -508,7 +662,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('server.zone.responses.total', 'counter', 64475, self.plugin.instance_id,
                                          {'server.zone.name' : 'hg.nginx.org', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -518,7 +672,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('server.zone.responses.1xx', 'counter', 0, self.plugin.instance_id,
                                          {'server.zone.name' : 'hg.nginx.org', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -528,7 +682,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('server.zone.responses.2xx', 'counter', 63239, self.plugin.instance_id,
                                          {'server.zone.name' : 'hg.nginx.org', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -538,7 +692,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('server.zone.responses.3xx', 'counter', 883, self.plugin.instance_id,
                                          {'server.zone.name' : 'hg.nginx.org', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -548,7 +702,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('server.zone.responses.4xx', 'counter', 353, self.plugin.instance_id,
                                          {'server.zone.name' : 'hg.nginx.org', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -558,7 +712,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('server.zone.responses.5xx', 'counter', 0, self.plugin.instance_id,
                                          {'server.zone.name' : 'hg.nginx.org', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -568,7 +722,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('server.zone.bytes.received', 'counter', 34641169, self.plugin.instance_id,
                                          {'server.zone.name' : 'hg.nginx.org', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -578,7 +732,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('server.zone.bytes.sent', 'counter', 8187139290, self.plugin.instance_id,
                                          {'server.zone.name' : 'hg.nginx.org', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -588,7 +742,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('zones.pages.used', 'counter', 6, self.plugin.instance_id,
                                        {'memory.zone.name' : 'nginxorg', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_memory_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('memory.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -598,7 +752,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('zones.pages.free', 'counter', 9, self.plugin.instance_id,
                                        {'memory.zone.name' : 'nginxorg', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_memory_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('memory.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -609,7 +763,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -620,7 +774,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -631,7 +785,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -642,7 +796,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -653,7 +807,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -664,7 +818,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -675,7 +829,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -686,7 +840,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -697,7 +851,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -708,7 +862,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -719,7 +873,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -730,7 +884,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -741,7 +895,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -755,7 +909,7 @@ class NginxCollectdTest(TestCase):
 
 
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -768,7 +922,7 @@ class NginxCollectdTest(TestCase):
 
 
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -779,7 +933,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -790,7 +944,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -801,7 +955,7 @@ class NginxCollectdTest(TestCase):
                                          {'upstream.name' : 'trac-backend', 'upstream.peer.name' : '10.0.0.10:8080',
                                           'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -811,7 +965,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('upstreams.keepalive', 'gauge', 0, self.plugin.instance_id,
                                          {'upstream.name' : 'trac-backend', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_metrics(metrics, self.mock_sink)
+        self._emit_group('upstreams', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -821,7 +975,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('upstreams.zombies', 'gauge', 0, self.plugin.instance_id,
                                          {'upstream.name' : 'trac-backend', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_upstreams_metrics(metrics, self.mock_sink)
+        self._emit_group('upstreams', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -831,7 +985,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.size', 'gauge', 19005440, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -841,7 +995,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.size.max', 'gauge', 536870912, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -851,7 +1005,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.hit.responses', 'counter', 284813, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -861,7 +1015,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.miss.responses', 'counter', 1304, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -871,7 +1025,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.stale.responses', 'counter', 0, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -881,7 +1035,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.revalidated.responses', 'counter', 0, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -891,7 +1045,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.expired.responses', 'counter', 4058, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -901,7 +1055,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.bypass.responses', 'counter', 0, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -911,7 +1065,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.updating.responses', 'counter', 0, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -921,7 +1075,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.hit.bytes', 'counter', 36874385656, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -931,7 +1085,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.miss.bytes', 'counter', 160222600, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -941,7 +1095,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.stale.bytes', 'counter', 0, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -951,7 +1105,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.revalidated.bytes', 'counter', 0, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -961,7 +1115,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.expired.bytes', 'counter', 497995136, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -971,7 +1125,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.bypass.bytes', 'counter', 0, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -981,7 +1135,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.updating.bytes', 'counter', 0, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -991,7 +1145,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.miss.responses.written', 'counter', 1304, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -1001,7 +1155,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.miss.bytes.written', 'counter', 160222600, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -1011,7 +1165,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.expired.responses.written', 'counter', 4058, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -1021,7 +1175,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.expired.bytes.written', 'counter', 497995136, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -1031,7 +1185,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.bypass.responses.written', 'counter', 0, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -1041,7 +1195,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('caches.bypass.bytes.written', 'counter', 0, self.plugin.instance_id,
                                        {'cache.name' : 'http_cache', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_cache_metrics(metrics, self.mock_sink)
+        self._emit_group('caches', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -1051,7 +1205,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('stream.server.zone.connections', 'counter', 132765, self.plugin.instance_id,
                                          {'stream.server.zone.name' : 'dns_loadbalancer', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_stream_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -1061,7 +1215,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('stream.server.zone.processing', 'counter', 0, self.plugin.instance_id,
                                          {'stream.server.zone.name' : 'dns_loadbalancer', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_stream_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -1071,7 +1225,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('stream.server.zone.session.2xx', 'counter', 132765, self.plugin.instance_id,
                                          {'stream.server.zone.name' : 'dns_loadbalancer', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_stream_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -1081,7 +1235,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('stream.server.zone.session.4xx', 'counter', 0, self.plugin.instance_id,
                                          {'stream.server.zone.name' : 'dns_loadbalancer', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_stream_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -1091,7 +1245,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('stream.server.zone.session.5xx', 'counter', 0, self.plugin.instance_id,
                                          {'stream.server.zone.name' : 'dns_loadbalancer', 'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_stream_server_zone_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.server.zones', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -1114,7 +1268,7 @@ class NginxCollectdTest(TestCase):
 
         expected_records = [expected_record_1, expected_record_2, expected_record_3, expected_record_4]
 
-        self.plugin._emit_stream_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.upstream.peers', metrics)
 
         self.assertEquals(len(expected_records), len(self.mock_sink.captured_records))
         self._verify_records_captured(expected_records)
@@ -1137,7 +1291,7 @@ class NginxCollectdTest(TestCase):
 
         expected_records = [expected_record_1, expected_record_2, expected_record_3, expected_record_4]
 
-        self.plugin._emit_stream_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.upstream.peers', metrics)
 
         self.assertEquals(len(expected_records), len(self.mock_sink.captured_records))
         self._verify_records_captured(expected_records)
@@ -1150,7 +1304,7 @@ class NginxCollectdTest(TestCase):
 
         expected_records = [expected_record_1]
 
-        self.plugin._emit_stream_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.upstream.peers', metrics)
 
         self.assertEquals(len(expected_records), len(self.mock_sink.captured_records))
         self._verify_records_captured(expected_records)
@@ -1173,7 +1327,7 @@ class NginxCollectdTest(TestCase):
 
         expected_records = [expected_record_1, expected_record_2, expected_record_3, expected_record_4]
 
-        self.plugin._emit_stream_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.upstream.peers', metrics)
 
         self.assertEquals(len(expected_records), len(self.mock_sink.captured_records))
         self._verify_records_captured(expected_records)
@@ -1196,7 +1350,7 @@ class NginxCollectdTest(TestCase):
 
         expected_records = [expected_record_1, expected_record_2, expected_record_3, expected_record_4]
 
-        self.plugin._emit_stream_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.upstream.peers', metrics)
 
         self.assertEquals(len(expected_records), len(self.mock_sink.captured_records))
         self._verify_records_captured(expected_records)
@@ -1220,7 +1374,7 @@ class NginxCollectdTest(TestCase):
 
         expected_records = [expected_record_1, expected_record_2, expected_record_3, expected_record_4]
 
-        self.plugin._emit_stream_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.upstream.peers', metrics)
 
         self.assertEquals(len(expected_records), len(self.mock_sink.captured_records))
         self._verify_records_captured(expected_records)
@@ -1243,7 +1397,7 @@ class NginxCollectdTest(TestCase):
 
         expected_records = [expected_record_1, expected_record_2, expected_record_3, expected_record_4]
 
-        self.plugin._emit_stream_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.upstream.peers', metrics)
 
         self.assertEquals(len(expected_records), len(self.mock_sink.captured_records))
         self._verify_records_captured(expected_records)
@@ -1267,7 +1421,7 @@ class NginxCollectdTest(TestCase):
 
         expected_records = [expected_record_1, expected_record_2, expected_record_3, expected_record_4]
 
-        self.plugin._emit_stream_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.upstream.peers', metrics)
 
         self.assertEquals(len(expected_records), len(self.mock_sink.captured_records))
         self._verify_records_captured(expected_records)
@@ -1284,7 +1438,7 @@ class NginxCollectdTest(TestCase):
 
         expected_records = [expected_record_1, expected_record_2]
 
-        self.plugin._emit_stream_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.upstream.peers', metrics)
 
         self.assertEquals(len(expected_records), len(self.mock_sink.captured_records))
         self._verify_records_captured(expected_records)
@@ -1308,7 +1462,7 @@ class NginxCollectdTest(TestCase):
 
         expected_records = [expected_record_1, expected_record_2, expected_record_3, expected_record_4]
 
-        self.plugin._emit_stream_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.upstream.peers', metrics)
 
         self.assertEquals(len(expected_records), len(self.mock_sink.captured_records))
         self._verify_records_captured(expected_records)
@@ -1332,7 +1486,7 @@ class NginxCollectdTest(TestCase):
 
         expected_records = [expected_record_1, expected_record_2, expected_record_3, expected_record_4]
 
-        self.plugin._emit_stream_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.upstream.peers', metrics)
 
         self.assertEquals(len(expected_records), len(self.mock_sink.captured_records))
         self._verify_records_captured(expected_records)
@@ -1356,7 +1510,7 @@ class NginxCollectdTest(TestCase):
 
         expected_records = [expected_record_1, expected_record_2, expected_record_3, expected_record_4]
 
-        self.plugin._emit_stream_upstreams_peer_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.upstream.peers', metrics)
 
         self.assertEquals(len(expected_records), len(self.mock_sink.captured_records))
         self._verify_records_captured(expected_records)
@@ -1371,7 +1525,7 @@ class NginxCollectdTest(TestCase):
 
         expected_records = [expected_record_1, expected_record_2]
 
-        self.plugin._emit_stream_upstreams_metrics(metrics, self.mock_sink)
+        self._emit_group('stream.upstreams', metrics)
 
         self.assertEquals(len(expected_records), len(self.mock_sink.captured_records))
         self._verify_records_captured(expected_records)
@@ -1381,10 +1535,711 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('processes.respawned', 'counter', 0, self.plugin.instance_id,
                                        {'nginx.version' : '1.21.3'})
 
-        self.plugin._emit_processes_metrics(metrics, self.mock_sink)
+        self._emit_group('processes', metrics)
+
+        self.assertEquals(1, len(self.mock_sink.captured_records))
+        self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
+
+    def test_upstreams_peer_rollup(self):
+        self.plugin.peer_rollup = True
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=self._build_upstreams_json())
+
+        self._emit_group('upstream.peers', [])
+
+        expected_dims = {'nginx.version' : '1.21.3', 'upstream.name' : 'backend'}
+        self._verify_records_captured([
+            MetricRecord('upstreams.rollup.requests', 'counter', 30, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.rollup.responses.5xx', 'counter', 4, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.rollup.fails', 'counter', 3, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.peers.up', 'gauge', 1, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.peers.unhealthy', 'gauge', 1, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.peers.down', 'gauge', 0, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.peers.total', 'gauge', 2, self.plugin.instance_id, expected_dims)])
+
+    def test_upstreams_columnar_peer_rollup(self):
+        self.plugin.peer_rollup = True
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=self._build_upstreams_json())
+
+        self._emit_group('upstream.peers', [])
+        records = self._untimed_records()
+
+        self.mock_sink.captured_records = []
+        self.plugin.columnar_peers = True
+        self._emit_group('upstream.peers', [])
+
+        self.assertEquals(records, self._untimed_records())
+        self.assertIn('upstream.peers', self.plugin._peer_snapshots)
+
+    def test_columnar_peers_without_consumer(self):
+        self.plugin.columnar_peers = True
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=self._build_upstreams_json())
+
+        self._emit_group('upstream.peers', [MetricDefinition('upstreams.requests', 'counter', 'requests')])
+
+        self.assertEquals(2, len(self.mock_sink.captured_records))
+        self.assertFalse(self.plugin._peer_snapshots)
+
+    def test_upstreams_columnar_idle_peer_demotion(self):
+        self.plugin.columnar_peers = True
+        self.plugin.idle_threshold = 1
+        upstreams_json = self._build_upstreams_json()
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=upstreams_json)
+
+        metrics = [MetricDefinition('upstreams.requests', 'counter', 'requests')]
+        for _ in range(3):
+            upstreams_json['backend']['peers'][0]['requests'] += 1
+            self.mock_sink.captured_records = []
+            self._emit_group('upstream.peers', metrics)
+
+        peer_names = [record.dimensions['upstream.peer.name'] for record in self.mock_sink.captured_records
+                      if record.name == 'upstreams.requests']
+        self.assertEquals(['10.0.0.1:80'], peer_names)
+
+    def test_peer_index_events(self):
+        peer_index = PeerIndex('upstream.name', 'upstream.peer.name')
+        upstreams_json = self._build_upstreams_json()
+        self.assertEquals([], peer_index.update(upstreams_json, {}))
+
+        peers = upstreams_json['backend']['peers']
+        peers[0]['state'] = 'draining'
+        peers[1] = {'id' : 1, 'name' : '10.0.0.9:80', 'state' : 'up'}
+        peers.append({'id' : 2, 'name' : '10.0.0.3:80', 'state' : 'checking'})
+        events = peer_index.update(upstreams_json, {})
+
+        self.assertItemsEqual([('state.changes', '10.0.0.1:80', 'up', 'draining'),
+                               ('removed', '10.0.0.2:80', 'unhealthy', None),
+                               ('added', '10.0.0.9:80', None, 'up'),
+                               ('added', '10.0.0.3:80', None, 'checking')],
+                              [(event.kind, event.peer_name, event.old_state, event.new_state) for event in events])
+        self.assertEquals([], peer_index.update(upstreams_json, {}))
+
+        del upstreams_json['backend']
+        self.assertEquals(['removed'] * 3, [event.kind for event in peer_index.update(upstreams_json, {})])
+
+    def test_upstreams_peer_events(self):
+        self.plugin.peer_events = True
+        upstreams_json = self._build_upstreams_json()
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=upstreams_json)
+        metrics = [MetricDefinition('upstreams.requests', 'counter', 'requests')]
+
+        self._emit_group('upstream.peers', metrics)
+        first_dims = [record.dimensions for record in self.mock_sink.captured_records
+                      if record.name == 'upstreams.requests']
+
+        upstreams_json['backend']['peers'][1]['state'] = 'up'
+        self.mock_sink.captured_records = []
+        self._emit_group('upstream.peers', metrics)
+
+        expected_dims = {'nginx.version' : '1.21.3', 'upstream.name' : 'backend'}
+        self._verify_records_captured([
+            MetricRecord('upstreams.peers.state.changes', 'gauge', 1, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.peers.added', 'gauge', 0, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.peers.removed', 'gauge', 0, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.requests', 'counter', 10, self.plugin.instance_id,
+                         dict(expected_dims, **{'upstream.peer.name' : '10.0.0.2:80'}))])
+        # The dimensions of unchanged peers are reused
+        second_dims = [record.dimensions for record in self.mock_sink.captured_records
+                       if record.name == 'upstreams.requests']
+        self.assertTrue(all(first is second for first, second in zip(first_dims, second_dims)))
+
+    def test_upstreams_peer_state_notifications(self):
+        self.plugin.notification_sink = Mock()
+        upstreams_json = self._build_upstreams_json()
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=upstreams_json)
+
+        self._emit_group('upstream.peers', [])
+        upstreams_json['backend']['peers'][0]['state'] = 'unavail'
+        self._emit_group('upstream.peers', [])
+
+        self.assertEquals(1, self.plugin.notification_sink.notify.call_count)
+        notification = self.plugin.notification_sink.notify.call_args[0][0]
+        self.assertEquals('upstreams.peer.state', notification.name)
+        self.assertEquals('failure', notification.severity)
+        self.assertEquals('Peer 10.0.0.1:80 of backend changed state from up to unavail', notification.message)
+        self.assertDictEqual({'nginx.version' : '1.21.3', 'upstream.name' : 'backend',
+                              'upstream.peer.name' : '10.0.0.1:80'}, notification.dimensions)
+        # Peer event metrics are not emitted unless enabled
+        self.assertEquals(0, len(self.mock_sink.captured_records))
+
+    def test_skip_unchanged_responses(self):
+        self.plugin.skip_unchanged_responses = True
+        slabs_json = {'zone' : {'pages' : {'used' : 1, 'free' : 2}}}
+        self.plugin.nginx_agent.get_slabs = MagicMock(return_value=slabs_json)
+        metrics = [MetricDefinition('zone.pages.used', 'counter', 'pages.used')]
+
+        self._emit_group('memory.zones', metrics)
+        first_records = self.mock_sink.captured_records
+        self.mock_sink.captured_records = []
+        self.plugin._unchanged_fetch_names = set()
+        with patch.object(self.plugin, '_fetch_and_emit_metrics') as mock_fetch_and_emit:
+            self._emit_group('memory.zones', metrics)
+            self.assertFalse(mock_fetch_and_emit.called)
+
+        self.assertEquals([record.to_string().split(',timestamp')[0] for record in first_records],
+                          [record.to_string().split(',timestamp')[0] for record in self.mock_sink.captured_records])
+
+        # A changed response is extracted again
+        self.plugin.nginx_agent.get_slabs.return_value = {'zone' : {'pages' : {'used' : 3, 'free' : 0}}}
+        self.mock_sink.captured_records = []
+        self.plugin._unchanged_fetch_names = set()
+        self._emit_group('memory.zones', metrics)
+        self.assertEquals(3, self.mock_sink.captured_records[0].value)
+
+    def test_skip_unchanged_responses_peer_events(self):
+        self.plugin.skip_unchanged_responses = True
+        self.plugin.peer_events = True
+        upstreams_json = self._build_upstreams_json()
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=upstreams_json)
+        metrics = [MetricDefinition('upstreams.requests', 'counter', 'requests')]
+        self._emit_group('upstream.peers', metrics)
+
+        changed_json = self._build_upstreams_json()
+        changed_json['backend']['peers'].append({'id' : 2, 'name' : '10.0.0.3:80', 'state' : 'up', 'requests' : 5})
+        self.plugin.nginx_agent.get_upstreams.return_value = changed_json
+        self.plugin._unchanged_fetch_names = set()
+        self._emit_group('upstream.peers', metrics)
+
+        self.mock_sink.captured_records = []
+        self.plugin._unchanged_fetch_names = set()
+        self._emit_group('upstream.peers', metrics)
+
+        added_records = [record for record in self.mock_sink.captured_records
+                         if record.name == 'upstreams.peers.added']
+        self.assertEquals([0], [record.value for record in added_records])
+        self.assertEquals(3, len([record for record in self.mock_sink.captured_records
+                                  if record.name == 'upstreams.requests']))
+
+    def test_skip_unchanged_responses_peer_sampling(self):
+        self.plugin.skip_unchanged_responses = True
+        self.plugin.peer_sample_size = 1
+        upstreams_json = self._build_upstreams_json()
+        upstreams_json['backend']['peers'].append({'id' : 2, 'name' : '10.0.0.3:80', 'state' : 'up', 'requests' : 5})
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=upstreams_json)
+        metrics = [MetricDefinition('upstreams.requests', 'counter', 'requests')]
+
+        peer_names = set()
+        for _ in range(2):
+            self.mock_sink.captured_records = []
+            self.plugin._unchanged_fetch_names = set()
+            self._emit_group('upstream.peers', metrics)
+            peer_names.update(record.dimensions['upstream.peer.name'] for record in self.mock_sink.captured_records)
+
+        # Every peer is covered by the rotating sample although the response is unchanged
+        self.assertEquals(set(peer['name'] for peer in upstreams_json['backend']['peers']), peer_names)
+
+    def test_skip_unchanged_responses_idle_objects(self):
+        self.plugin.skip_unchanged_responses = True
+        self.plugin.idle_threshold = 1
+        self.plugin.idle_interval = 10
+        self.plugin.nginx_agent.get_slabs = MagicMock(return_value={'zone' : {'pages' : {'used' : 1}}})
+        metrics = [MetricDefinition('zone.pages.used', 'counter', 'pages.used')]
+
+        for _ in range(3):
+            self.mock_sink.captured_records = []
+            self.plugin._unchanged_fetch_names = set()
+            self._emit_group('memory.zones', metrics)
+
+        self._verify_records_captured([
+            MetricRecord('objects.idle', 'gauge', 1, self.plugin.instance_id,
+                         {'nginx.version' : '1.21.3', 'metric.group' : 'memory.zones'})])
+        self.assertFalse([record for record in self.mock_sink.captured_records if record.name == 'zone.pages.used'])
+
+    def test_adaptive_interval(self):
+        adaptive_interval = AdaptiveInterval(10, 40)
+
+        # The first read only sets the baseline
+        self.assertEquals(10, adaptive_interval.update(0, 1000, 0, 50))
+        # Stable metrics lengthen the interval up to the maximum
+        self.assertEquals(20, adaptive_interval.update(10, 2000, 0, 50))
+        self.assertEquals(40, adaptive_interval.update(30, 4000, 0, 51))
+        self.assertEquals(40, adaptive_interval.update(40, 5050, 0, 50))
+        self.assertEquals(40, adaptive_interval.update(80, 9050, 0, 50))
+        # A request rate spike drops it to the minimum
+        self.assertEquals(10, adaptive_interval.update(120, 20000, 0, 50))
+        # As do new 5xx responses
+        adaptive_interval.interval = 40
+        self.assertEquals(10, adaptive_interval.update(130, 22700, 3, 50))
+
+    def test_adaptive_interval_due(self):
+        adaptive_interval = AdaptiveInterval(10, 40)
+        self.assertTrue(adaptive_interval.is_due(0))
+
+        adaptive_interval.update(0, 1000, 0, 50)
+        adaptive_interval.interval = 20
+        self.assertFalse(adaptive_interval.is_due(10))
+        self.assertTrue(adaptive_interval.is_due(19.9))
+
+    def test_read_adaptive_interval(self):
+        self.plugin.sink = self.mock_sink
+        self.plugin.emitters = [emitter for emitter in self.plugin._build_emitters(set())
+                                if emitter.group.name == 'connections']
+        self.plugin.adaptive_interval = AdaptiveInterval(10, 40)
+
+        self.plugin.read()
+        self.plugin.read()
+
+        self.assertEquals(1, self.plugin.nginx_agent.get_connections.call_count)
+        interval_records = [record for record in self.mock_sink.captured_records if record.name == 'poll.interval']
+        self.assertEquals(1, len(interval_records))
+        self.assertEquals(10, interval_records[0].value)
+
+    @patch('requests.get')
+    def test_configure_adaptive_interval(self, mock_requests_get):
+        mock_requests_get.side_effect = self._mocked_requests_get
+
+        mock_config = Mock()
+        mock_config.children = [self._build_mock_config_child(ADAPTIVE_INTERVAL, '10', '120')]
+        self.plugin.configure(mock_config)
+
+        self.assertEquals(10, self.plugin.adaptive_interval.min_interval)
+        self.assertEquals(120, self.plugin.adaptive_interval.max_interval)
+
+        mock_config.children = [self._build_mock_config_child(ADAPTIVE_INTERVAL, '120', '10')]
+        with self.assertRaises(ValueError):
+            NginxPlusPlugin().configure(mock_config)
+
+    def test_fetch_stores_snapshot(self):
+        self.plugin.snapshot_store = SnapshotStore()
+        self.plugin.nginx_agent.status_host = 'nginx-1'
+        self.plugin.nginx_agent.status_port = 8080
+
+        self.plugin._fetch('get_connections')
+
+        snapshot = json.loads(self.plugin.snapshot_store.snapshot_json('nginx-1:8080', 'connections'))
+        self.assertDictEqual(self.plugin.nginx_agent.get_connections.return_value, snapshot['data'])
+
+    def test_read_offset(self):
+        self.assertEquals(0, self.plugin.read_offset())
+
+        self.plugin.read_stagger = 10
+        offset = self.plugin.read_offset()
+        self.assertTrue(0 <= offset < 10)
+        self.assertEquals(offset, self.plugin.read_offset())
+
+        # Wrapped to the interval of the instance
+        self.plugin.read_stagger = 100
+        self.plugin.read_interval = 10
+        self.assertTrue(0 <= self.plugin.read_offset() < 10)
+        self.plugin.read_stagger = 10
+        self.plugin.read_interval = None
+
+        offsets = set()
+        for _ in range(20):
+            self.plugin._instance_id = self._random_string()
+            offsets.add(int(self.plugin.read_offset()))
+        self.assertTrue(len(offsets) > 1)
+
+    @patch('requests.get')
+    def test_configure_read_stagger(self, mock_requests_get):
+        mock_requests_get.side_effect = self._mocked_requests_get
+
+        mock_config = Mock()
+        mock_config.children = [self._build_mock_config_child(READ_STAGGER, '10')]
+
+        self.plugin.configure(mock_config)
+
+        self.assertEquals(10, self.plugin.read_stagger)
+
+    def test_upstreams_failing_peer_emission(self):
+        self.plugin.peer_emission = 'failing'
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=self._build_upstreams_json())
+
+        metrics = [MetricDefinition('upstreams.requests', 'counter', 'requests')]
+        self._emit_group('upstream.peers', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
-        self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
+        self.assertEquals('10.0.0.2:80', self.mock_sink.captured_records[0].dimensions['upstream.peer.name'])
+
+    def test_upstreams_no_peer_emission(self):
+        self.plugin.peer_emission = 'none'
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=self._build_upstreams_json())
+
+        metrics = [MetricDefinition('upstreams.requests', 'counter', 'requests')]
+        self._emit_group('upstream.peers', metrics)
+
+        self.assertEquals(0, len(self.mock_sink.captured_records))
+
+    def test_upstreams_peer_distribution(self):
+        self.plugin.peer_distribution = True
+        self.plugin.peer_emission = 'none'
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=self._build_upstreams_json())
+
+        self._emit_group('upstream.peers', [])
+
+        expected_dims = {'nginx.version' : '1.21.3', 'upstream.name' : 'backend'}
+        self._verify_records_captured([
+            MetricRecord('upstreams.response.time.min', 'gauge', 10, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.response.time.max', 'gauge', 50, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.response.time.mean', 'gauge', 70 / 3.0, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.response.time.p50', 'gauge', 10, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.response.time.p90', 'gauge', 50, self.plugin.instance_id, expected_dims),
+            MetricRecord('upstreams.response.time.p99', 'gauge', 50, self.plugin.instance_id, expected_dims)])
+        self.assertFalse([record for record in self.mock_sink.captured_records
+                          if record.name.startswith('upstreams.header.time')])
+
+    def test_weighted_summary_zero_weights(self):
+        summary = _weighted_summary([(30, 0), (10, 0), (20, 0)])
+
+        self.assertEquals(10, summary['min'])
+        self.assertEquals(30, summary['max'])
+        self.assertEquals(20.0, summary['mean'])
+        self.assertEquals(20, summary['p50'])
+        self.assertEquals(30, summary['p99'])
+
+    def test_upstreams_peer_series_budget(self):
+        self.plugin.group_series_budgets = {'upstream.peers' : 3}
+        upstreams_json = self._build_upstreams_json()
+        upstreams_json['backend']['peers'].append({'id' : 2, 'name' : '10.0.0.3:80', 'state' : 'up',
+                                                   'requests' : 5, 'fails' : 1})
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=upstreams_json)
+
+        metrics = [MetricDefinition('upstreams.requests', 'counter', 'requests')]
+        self._emit_group('upstream.peers', metrics)
+
+        self._verify_records_captured([
+            MetricRecord('upstreams.requests', 'counter', 20, self.plugin.instance_id,
+                         {'nginx.version' : '1.21.3', 'upstream.name' : 'backend',
+                          'upstream.peer.name' : '10.0.0.1:80'}),
+            MetricRecord('upstreams.requests', 'counter', 15, self.plugin.instance_id,
+                         {'nginx.version' : '1.21.3', 'upstream.name' : '__other__',
+                          'upstream.peer.name' : '__other__'}),
+            MetricRecord('series.budget.dropped', 'gauge', 2, self.plugin.instance_id,
+                         {'nginx.version' : '1.21.3', 'metric.group' : 'upstream.peers'})])
+        self.assertEquals(3, len(self.mock_sink.captured_records))
+
+    def test_peer_series_budget_across_upstreams(self):
+        self.plugin.group_series_budgets = {'upstream.peers' : 10}
+        upstreams_json = {}
+        for upstream_index in range(20):
+            upstreams_json['backend_{}'.format(upstream_index)] = {'peers' : [
+                {'id' : peer_index, 'name' : '10.0.{}.{}:80'.format(upstream_index, peer_index), 'state' : 'up',
+                 'requests' : upstream_index * 5 + peer_index} for peer_index in range(5)]}
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=upstreams_json)
+
+        metrics = [MetricDefinition('upstreams.requests', 'counter', 'requests')]
+        self._emit_group('upstream.peers', metrics)
+
+        peer_records = [record for record in self.mock_sink.captured_records if record.name == 'upstreams.requests']
+        other_records = [record for record in peer_records if record.dimensions['upstream.peer.name'] == '__other__']
+        self.assertEquals(10, len(self.mock_sink.captured_records))
+        self.assertEquals(9, len(peer_records))
+        self.assertEquals(1, len(other_records))
+        self.assertEquals(sum(range(92)), other_records[0].value)
+        self._verify_records_captured([
+            MetricRecord('series.budget.dropped', 'gauge', 92, self.plugin.instance_id,
+                         {'nginx.version' : '1.21.3', 'metric.group' : 'upstream.peers'})])
+
+    def test_peer_series_budget_counts_aggregates_and_events(self):
+        self.plugin.group_series_budgets = {'upstream.peers' : 12}
+        self.plugin.peer_rollup = True
+        self.plugin.peer_events = True
+        upstreams_json = self._build_upstreams_json()
+        for peer_index in range(2, 10):
+            upstreams_json['backend']['peers'].append({'id' : peer_index, 'name' : '10.0.0.{}:80'.format(peer_index),
+                                                       'state' : 'up', 'requests' : peer_index})
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=upstreams_json)
+
+        metrics = [MetricDefinition('upstreams.requests', 'counter', 'requests'),
+                   MetricDefinition('upstreams.fails', 'counter', 'fails')]
+        self._emit_group('upstream.peers', metrics)
+
+        # The event and rollup series spend the budget, none is left for the peers
+        record_names = [record.name for record in self.mock_sink.captured_records]
+        self.assertEquals(12, len(record_names))
+        self.assertEquals(['upstreams.peers.added', 'upstreams.peers.removed', 'upstreams.peers.state.changes'],
+                          record_names[:3])
+        self.assertFalse([name for name in record_names if name in ('upstreams.requests', 'upstreams.fails')])
+        self.assertEquals(10, self.mock_sink.captured_records[-1].value)
+
+    def test_series_budget_counts_emitted_series(self):
+        self.plugin.group_series_budgets = {'server.zones' : 6}
+        self.plugin.nginx_agent.get_server_zones = MagicMock(return_value={
+            'zone_a' : {'requests' : 5, 'processing' : 1},
+            'zone_b' : {'requests' : 50, 'processing' : 4},
+            'zone_c' : {'requests' : 7, 'processing' : 2}})
+        # Metrics without a value in the response cost no series
+        metrics = [MetricDefinition('server.zone.requests', 'counter', 'requests'),
+                   MetricDefinition('server.zone.processing', 'gauge', 'processing'),
+                   MetricDefinition('server.zone.discarded', 'counter', 'discarded'),
+                   MetricDefinition('server.zone.received', 'counter', 'received')]
+
+        self._emit_group('server.zones', metrics)
+
+        self.assertEquals(5, len(self.mock_sink.captured_records))
+        self._verify_records_captured([
+            MetricRecord('server.zone.requests', 'counter', 50, self.plugin.instance_id,
+                         {'nginx.version' : '1.21.3', 'server.zone.name' : 'zone_b'}),
+            MetricRecord('server.zone.requests', 'counter', 12, self.plugin.instance_id,
+                         {'nginx.version' : '1.21.3', 'server.zone.name' : '__other__'}),
+            # Gauges are folded into their largest value
+            MetricRecord('server.zone.processing', 'gauge', 2, self.plugin.instance_id,
+                         {'nginx.version' : '1.21.3', 'server.zone.name' : '__other__'}),
+            MetricRecord('series.budget.dropped', 'gauge', 2, self.plugin.instance_id,
+                         {'nginx.version' : '1.21.3', 'metric.group' : 'server.zones'})])
+
+    def test_series_budget_smaller_than_metrics(self):
+        self.plugin.group_series_budgets = {'server.zones' : 2}
+        self.plugin.nginx_agent.get_server_zones = MagicMock(return_value={
+            'zone_a' : {'requests' : 5, 'responses' : {'total' : 5}},
+            'zone_b' : {'requests' : 50, 'responses' : {'total' : 49}}})
+        metrics = [MetricDefinition('server.zone.requests', 'counter', 'requests'),
+                   MetricDefinition('server.zone.responses.total', 'counter', 'responses.total')]
+
+        self._emit_group('server.zones', metrics)
+
+        # Neither a zone nor "__other__" fits
+        self.assertEquals(['series.budget.dropped'], [record.name for record in self.mock_sink.captured_records])
+        self.assertEquals(2, self.mock_sink.captured_records[0].value)
+
+    def test_flat_group_series_budget(self):
+        self.plugin._series_remaining = 2
+        metrics = [MetricDefinition('connections.accepted', 'counter', 'accepted'),
+                   MetricDefinition('connections.dropped', 'counter', 'dropped'),
+                   MetricDefinition('connections.active', 'gauge', 'active')]
+
+        self._emit_group('connections', metrics)
+
+        self.assertEquals(2, len(self.mock_sink.captured_records))
+        self.assertEquals(0, self.plugin._series_remaining)
+
+    def test_server_zone_instance_series_budget(self):
+        self.plugin._series_remaining = 5
+        self.plugin.nginx_agent.get_server_zones = MagicMock(return_value={
+            'zone_a' : {'requests' : 5, 'responses' : {'total' : 5}},
+            'zone_b' : {'requests' : 50, 'responses' : {'total' : 49}},
+            'zone_c' : {'requests' : 7, 'responses' : {'total' : 7}}})
+        metrics = [MetricDefinition('server.zone.requests', 'counter', 'requests'),
+                   MetricDefinition('server.zone.responses.total', 'counter', 'responses.total')]
+
+        self._emit_group('server.zones', metrics)
+
+        zone_names = set(record.dimensions.get('server.zone.name') for record in self.mock_sink.captured_records
+                         if record.name == 'server.zone.requests')
+        self.assertItemsEqual(['zone_b', '__other__'], zone_names)
+        self._verify_records_captured([
+            MetricRecord('server.zone.requests', 'counter', 12, self.plugin.instance_id,
+                         {'nginx.version' : '1.21.3', 'server.zone.name' : '__other__'})])
+        self.assertEquals(0, self.plugin._series_remaining)
+
+    def test_series_budget_not_exceeded(self):
+        self.plugin.group_series_budgets = {'upstream.peers' : 100}
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=self._build_upstreams_json())
+
+        metrics = [MetricDefinition('upstreams.requests', 'counter', 'requests')]
+        self._emit_group('upstream.peers', metrics)
+
+        self._verify_records_captured([
+            MetricRecord('series.budget.dropped', 'gauge', 0, self.plugin.instance_id,
+                         {'nginx.version' : '1.21.3', 'metric.group' : 'upstream.peers'})])
+        self.assertEquals(3, len(self.mock_sink.captured_records))
+
+    @patch('requests.get')
+    def test_configure_series_budget(self, mock_requests_get):
+        mock_requests_get.side_effect = self._mocked_requests_get
+
+        mock_config = Mock()
+        mock_config.children = [self._build_mock_config_child(SERIES_BUDGET, '10000'),
+                                self._build_mock_config_child(SERIES_BUDGET, 'upstream.peers', '2000')]
+
+        self.plugin.configure(mock_config)
+
+        self.assertEquals(10000, self.plugin.series_budget)
+        self.assertDictEqual({'upstream.peers' : 2000}, self.plugin.group_series_budgets)
+
+    def test_upstreams_name_filters(self):
+        upstreams_json = self._build_upstreams_json()
+        upstreams_json['api-backend'] = upstreams_json['backend']
+        upstreams_json['api-legacy'] = upstreams_json['backend']
+        self.plugin.nginx_agent.api_version = None
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=upstreams_json)
+        self.plugin._add_name_filter_patterns('UpstreamInclude', ['^api-.*'])
+        self.plugin._add_name_filter_patterns('UpstreamExclude', ['glob:*-legacy'])
+        self.plugin._add_name_filter_patterns('PeerExclude', ['^10\\.0\\.0\\.2:'])
+
+        metrics = [MetricDefinition('upstreams.requests', 'counter', 'requests')]
+        self._emit_group('upstream.peers', metrics)
+
+        self.assertEquals(1, len(self.mock_sink.captured_records))
+        self.assertDictEqual({'nginx.version' : '1.21.3', 'upstream.name' : 'api-backend',
+                              'upstream.peer.name' : '10.0.0.1:80'}, self.mock_sink.captured_records[0].dimensions)
+
+    def test_literal_name_filter_fetches_named_objects(self):
+        self.plugin.nginx_agent.api_version = 6
+        self.plugin._add_name_filter_patterns('CacheInclude', ['^http_cache$', 'glob:other_cache'])
+
+        self._emit_group('caches', [MetricDefinition('caches.size', 'gauge', 'size')])
+
+        self.plugin.nginx_agent.get_caches.assert_called_with(['http_cache', 'other_cache'])
+        self.assertEquals(1, len(self.mock_sink.captured_records))
+
+    def test_name_filter_given_to_agent(self):
+        self.plugin.nginx_agent.api_version = 6
+        self.plugin._add_name_filter_patterns('ServerZoneInclude', ['^hg'])
+
+        self._emit_group('server.zones', [MetricDefinition('server.zone.requests', 'counter', 'requests')])
+
+        name_filter = self.plugin.nginx_agent.get_server_zones.call_args[1]['name_filter']
+        self.assertTrue(name_filter('hg.nginx.org'))
+        self.assertFalse(name_filter('trac.nginx.org'))
+        self.assertEquals(1, len(self.mock_sink.captured_records))
+
+    def test_name_filter_literal_names(self):
+        name_filter = NameFilter()
+        self.assertIsNone(name_filter.literal_names)
+
+        name_filter.add_include('^api\\.example$')
+        self.assertEquals(['api.example'], name_filter.literal_names)
+
+        name_filter.add_include('^web-.*$')
+        self.assertIsNone(name_filter.literal_names)
+        self.assertTrue(name_filter.matches('web-1'))
+        self.assertFalse(name_filter.matches('apiXexample'))
+
+    @patch('requests.get')
+    def test_configure_name_filters(self, mock_requests_get):
+        mock_requests_get.side_effect = self._mocked_requests_get
+
+        mock_config = Mock()
+        mock_config.children = [self._build_mock_config_child('ServerZoneInclude', '^api-', '^web-'),
+                                self._build_mock_config_child('PeerExclude', 'glob:10.0.*')]
+
+        self.plugin.configure(mock_config)
+
+        self.assertEquals(2, len(self.plugin.container_filters['get_server_zones'].includes))
+        self.assertEquals(1, len(self.plugin.peer_filter.excludes))
+
+    def test_server_zone_derived_metrics(self):
+        self.plugin.derived_metrics = True
+        self.plugin.nginx_agent.get_server_zones = MagicMock(return_value={
+            'zone_a' : {'requests' : 4, 'sent' : 100, 'responses' : {'total' : 4, '5xx' : 1}},
+            'zone_b' : {'requests' : 0, 'sent' : 0, 'responses' : {'total' : 0, '5xx' : 0}}})
+        metrics = [MetricDefinition('server.zone.requests', 'counter', 'requests')]
+
+        self._emit_group('server.zones', metrics)
+
+        expected_dims = {'nginx.version' : '1.21.3', 'server.zone.name' : 'zone_a'}
+        self._verify_records_captured([
+            MetricRecord('server.zone.requests', 'counter', 4, self.plugin.instance_id, expected_dims),
+            MetricRecord('server.zone.responses.5xx.ratio', 'gauge', 0.25, self.plugin.instance_id, expected_dims),
+            MetricRecord('server.zone.bytes.per.request', 'gauge', 25.0, self.plugin.instance_id, expected_dims)])
+        # Ratios dividing by zero are not emitted
+        self.assertEquals(4, len(self.mock_sink.captured_records))
+
+    def test_derived_metrics_only(self):
+        self.plugin.derived_metrics = True
+        self.plugin.derived_metrics_only = True
+        self.plugin.nginx_agent.get_ssl = MagicMock(return_value={'handshakes' : 9, 'handshakes_failed' : 1,
+                                                                  'session_reuses' : 3})
+
+        self._emit_group('ssl', DEFAULT_SSL_METRICS)
+
+        self._verify_records_captured([MetricRecord('ssl.handshakes.failed.ratio', 'gauge', 0.1,
+                                                    self.plugin.instance_id, {'nginx.version' : '1.21.3'})])
+        self.assertEquals(1, len(self.mock_sink.captured_records))
+
+    def test_derived_metric_definition(self):
+        metric = DerivedMetricDefinition('caches.hit.ratio', 'hit.responses / (hit.responses + miss.responses)')
+
+        self.assertEquals([['hit', 'responses'], ['miss', 'responses']], metric.input_paths)
+        self.assertEquals(0.75, metric.extract({'hit' : {'responses' : 3}, 'miss' : {'responses' : 1}}))
+        self.assertIsNone(metric.extract({'hit' : {'responses' : 3}}))
+        self.assertEquals(200.0, DerivedMetricDefinition('percent', '2 * value').extract({'value' : 100}))
+        self.assertRaises(ValueError, DerivedMetricDefinition, 'invalid', 'value; import os')
+
+    def test_idle_object_demotion(self):
+        self.plugin.idle_threshold = 2
+        self.plugin.idle_interval = 3
+        server_zones_json = {'idle_zone' : {'requests' : 5}, 'busy_zone' : {'requests' : 0}}
+        self.plugin.nginx_agent.get_server_zones = MagicMock(return_value=server_zones_json)
+
+        metrics = [MetricDefinition('server.zone.requests', 'counter', 'requests')]
+        emitted_per_read = []
+        idle_counts = []
+        for _ in range(7):
+            server_zones_json['busy_zone']['requests'] += 1
+            self.mock_sink.captured_records = []
+            self._emit_group('server.zones', metrics)
+            emitted_per_read.append(sorted(record.dimensions['server.zone.name'] for record
+                                           in self.mock_sink.captured_records if record.name == 'server.zone.requests'))
+            idle_counts.append([record.value for record in self.mock_sink.captured_records
+                                if record.name == 'objects.idle'][0])
+
+        # Idle after two unchanged reads, then emitted on every third read
+        self.assertEquals([['busy_zone', 'idle_zone']] * 3 + [['busy_zone']] * 2 + [['busy_zone', 'idle_zone']] +\
+                          [['busy_zone']], emitted_per_read)
+        self.assertEquals([0, 0, 1, 1, 1, 1, 1], idle_counts)
+
+        # Any change restores the object to every read
+        server_zones_json['idle_zone']['requests'] += 1
+        self.mock_sink.captured_records = []
+        self._emit_group('server.zones', metrics)
+        self._verify_records_captured([MetricRecord('server.zone.requests', 'counter', 6, self.plugin.instance_id,
+                                                    {'nginx.version' : '1.21.3', 'server.zone.name' : 'idle_zone'})])
+
+    def test_upstreams_peer_sampling(self):
+        self.plugin.peer_sample_size = 2
+        upstreams_json = {'backend' : {'peers' : [{'name' : 'peer_{}'.format(i), 'state' : 'up', 'requests' : i}
+                                                  for i in range(5)]}}
+        upstreams_json['backend']['peers'].append({'name' : 'failing_peer', 'state' : 'unhealthy', 'requests' : 0})
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=upstreams_json)
+
+        metrics = [MetricDefinition('upstreams.requests', 'counter', 'requests')]
+        emitted_per_read = []
+        for _ in range(3):
+            self.mock_sink.captured_records = []
+            self._emit_group('upstream.peers', metrics)
+            emitted_per_read.append(set(record.dimensions['upstream.peer.name']
+                                        for record in self.mock_sink.captured_records))
+
+        self.assertEquals([set(['failing_peer', 'peer_0', 'peer_1']),
+                           set(['failing_peer', 'peer_2', 'peer_3']),
+                           set(['failing_peer', 'peer_4', 'peer_0'])], emitted_per_read)
+
+    def test_upstreams_peer_sampling_idle_peers(self):
+        self.plugin.peer_sample_size = 2
+        self.plugin.idle_threshold = 1
+        self.plugin.idle_interval = 100
+        upstreams_json = {'backend' : {'peers' : [{'name' : 'peer_{}'.format(i), 'state' : 'up', 'requests' : i}
+                                                  for i in range(4)]}}
+        self.plugin.nginx_agent.get_upstreams = MagicMock(return_value=upstreams_json)
+
+        metrics = [MetricDefinition('upstreams.requests', 'counter', 'requests')]
+        counts_per_read = []
+        for _ in range(4):
+            upstreams_json['backend']['peers'][0]['requests'] += 1
+            self.mock_sink.captured_records = []
+            self._emit_group('upstream.peers', metrics)
+            counts = dict((record.name, record.value) for record in self.mock_sink.captured_records
+                          if record.name in ('objects.idle', 'objects.active'))
+            counts_per_read.append((counts['objects.active'], counts['objects.idle']))
+
+        # Peers sampled out still go idle, and every peer is counted
+        self.assertEquals([(4, 0), (1, 3), (1, 3), (1, 3)], counts_per_read)
+        self.assertTrue(set(record.dimensions['upstream.peer.name'] for record in self.mock_sink.captured_records
+                            if record.name == 'upstreams.requests') <= set(['peer_0']))
+
+    @patch('requests.get')
+    def test_configure_peer_rollup(self, mock_requests_get):
+        mock_requests_get.side_effect = self._mocked_requests_get
+
+        mock_config = Mock()
+        mock_config.children = [self._build_mock_config_child(PEER_ROLLUP, 'true'),
+                                self._build_mock_config_child(PEER_EMISSION, 'Failing')]
+
+        self.plugin.configure(mock_config)
+
+        self.assertTrue(self.plugin.peer_rollup)
+        self.assertEquals('failing', self.plugin.peer_emission)
+
+    @patch('requests.get')
+    def test_configure_invalid_peer_emission(self, mock_requests_get):
+        mock_requests_get.side_effect = self._mocked_requests_get
+
+        mock_config = Mock()
+        mock_config.children = [self._build_mock_config_child(PEER_EMISSION, 'some')]
+
+        with self.assertRaises(ValueError):
+            self.plugin.configure(mock_config)
 
     def test_emit_with_extra_dimensions(self):
         extra_dim_key = self._random_string()
@@ -1396,7 +2251,7 @@ class NginxCollectdTest(TestCase):
         expected_record = MetricRecord('connections.accepted', 'counter', 18717986, self.plugin.instance_id,
                                        {'nginx.version' : '1.21.3', extra_dim_key : extra_dim_value})
 
-        self.plugin._emit_connection_metrics(metrics, self.mock_sink)
+        self._emit_group('connections', metrics)
 
         self.assertEquals(1, len(self.mock_sink.captured_records))
         self._validate_single_record(expected_record, self.mock_sink.captured_records[0])
@@ -1429,6 +2284,27 @@ class NginxCollectdTest(TestCase):
             metric_names.extend(self._extract_metic_names_from_emitter(emitter))
         return metric_names
 
+    def _build_upstreams_json(self):
+        return {'backend' : {'peers' : [
+            {'id' : 0, 'name' : '10.0.0.1:80', 'state' : 'up', 'requests' : 20, 'fails' : 0,
+             'responses' : {'5xx' : 1}, 'response_time' : 10},
+            {'id' : 1, 'name' : '10.0.0.2:80', 'state' : 'unhealthy', 'requests' : 10, 'fails' : 3,
+             'responses' : {'5xx' : 3}, 'response_time' : 50}]}}
+
+    def _emit_group(self, group_name, metrics):
+        group = next(group for group in METRIC_GROUPS if group.name == group_name)
+        self.plugin._emit_metric_group(group, metrics, self.mock_sink)
+
+    def _untimed_records(self):
+        return sorted((record.name, record.type, record.value, sorted(record.dimensions.items()))
+                      for record in self.mock_sink.captured_records)
+
+    def _build_mock_config_child(self, key, *values):
+        mock_config_child = Mock()
+        mock_config_child.key = key
+        mock_config_child.values = list(values)
+        return mock_config_child
+
     def _read_test_resource_json(self, relative_path):
         abs_path = os.path.join(os.path.dirname(__file__), relative_path)
         with open(abs_path) as json_file:
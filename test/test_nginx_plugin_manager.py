@@ -1,12 +1,20 @@
 #!/usr/bin/env python
+import os
 import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
 from unittest import TestCase
 from mock import Mock, patch
 
 # Mock out the collectd module
 sys.modules['collectd'] = Mock()
 
-from plugin.nginx_plus_collectd import NginxPlusPluginManager, STATUS_HOST, STATUS_PORT
+from plugin.nginx_plus_collectd import NginxPlusPluginManager, STATUS_HOST, STATUS_PORT, READ_INTERVAL, TARGET,\
+                                        FLEET_THREADS, UPSTREAM, READ_CONCURRENCY, TARGETS_PATH, TargetDiscovery,\
+                                        ShardRing, SHARD_INDEX, SHARD_COUNT, StaggeredReadRegistrar
 
 class NginxPlusPluginManagerTest(TestCase):
 
@@ -56,9 +64,160 @@ class NginxPlusPluginManagerTest(TestCase):
         self.assertEquals(expected_ip_2, actual_ip_2)
         self.assertEquals(expected_port_2, actual_port_2)
 
+    @patch('plugin.nginx_plus_collectd.collectd')
+    @patch('requests.get')
+    def test_config_callback_registers_read_per_instance(self, mock_requests_get, mock_collectd):
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = [1, 2, 3, 4, 5, 6, 7]
+        mock_requests_get.return_value = mock_response
+
+        mock_config_1 = Mock()
+        mock_config_1.children = [_build_mock_config_child(STATUS_HOST, 'nginx-1'),
+                                  _build_mock_config_child(READ_INTERVAL, '30')]
+        mock_config_2 = Mock()
+        mock_config_2.children = [_build_mock_config_child(STATUS_HOST, 'nginx-1')]
+
+        self.plugin_manager.config_callback(mock_config_1)
+        self.plugin_manager.config_callback(mock_config_2)
+
+        register_calls = mock_collectd.register_read.call_args_list
+        self.assertEquals(2, len(register_calls))
+        self.assertEquals((self.plugin_manager.read_plugin_callback,), register_calls[0][0])
+        self.assertEquals({'data' : self.plugin_manager.plugins[0], 'name' : 'nginx-plus-collectd.nginx-1:8080',
+                           'interval' : 30}, register_calls[0][1])
+        self.assertEquals({'data' : self.plugin_manager.plugins[1], 'name' : 'nginx-plus-collectd.nginx-1:8080.1'},
+                          register_calls[1][1])
+
+    @patch('plugin.nginx_plus_collectd.collectd')
+    @patch('requests.Session')
+    def test_config_callback_fleet(self, mock_session_class, mock_collectd):
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = [1, 2, 3, 4, 5, 6, 7]
+        mock_session_class.return_value.get.return_value = mock_response
+
+        mock_config = Mock()
+        mock_config.children = [_build_mock_config_child(FLEET_THREADS, '2'),
+                                _build_mock_config_child(UPSTREAM, 'true'),
+                                _build_mock_target(_build_mock_config_child(STATUS_HOST, 'nginx-1')),
+                                _build_mock_target(_build_mock_config_child(STATUS_HOST, 'nginx-2'),
+                                                   _build_mock_config_child(STATUS_PORT, '8081')),
+                                # Fails its configuration and is skipped
+                                _build_mock_target(_build_mock_config_child(STATUS_HOST, 'nginx-3'),
+                                                   _build_mock_config_child(READ_CONCURRENCY, '0'))]
+
+        self.plugin_manager.config_callback(mock_config)
+
+        plugin_1, plugin_2 = self.plugin_manager.plugins
+        self.assertEquals(('nginx-1', 8080), (plugin_1.nginx_agent.status_host, plugin_1.nginx_agent.status_port))
+        self.assertEquals(('nginx-2', '8081'), (plugin_2.nginx_agent.status_host, plugin_2.nginx_agent.status_port))
+        self.assertEquals(2, mock_collectd.register_read.call_count)
+
+        # No thread outlives the configuration, a daemonized collectd forks after it
+        fleet_resources = self.plugin_manager.fleets[0]
+        self.assertIsNone(fleet_resources.fetch_pool._pool)
+        self.assertIsNone(fleet_resources.object_fetch_pool._pool)
+        self.assertEquals([2, 4], fleet_resources.fetch_pool.map(lambda value: value * 2, [1, 2]))
+        self.assertIsNotNone(fleet_resources.fetch_pool._pool)
+
+        # Shared options apply to every target, which share their connections and metric definitions
+        self.assertTrue('upstreams' in [emitter.group.name for emitter in plugin_1.emitters])
+        self.assertIs(plugin_1.nginx_agent._get_session(), plugin_2.nginx_agent._get_session())
+        for emitter_1, emitter_2 in zip(plugin_1.emitters, plugin_2.emitters):
+            self.assertIs(emitter_1.metrics, emitter_2.metrics)
+
+        self.plugin_manager.shutdown_callback()
+        mock_session_class.return_value.close.assert_called_once()
+
+    @patch('plugin.nginx_plus_collectd.collectd')
+    @patch('requests.Session')
+    def test_discovered_targets_sync(self, mock_session_class, mock_collectd):
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = [1, 2, 3, 4, 5, 6, 7]
+        mock_session_class.return_value.get.return_value = mock_response
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            targets_path = os.path.join(temp_dir, 'targets.json')
+            _write_targets(targets_path, [{'StatusHost' : 'nginx-1'}, {'StatusHost' : 'nginx-2'}], 1000)
+            mock_config = Mock()
+            mock_config.children = [_build_mock_config_child(TARGETS_PATH, targets_path)]
+
+            self.plugin_manager.config_callback(mock_config)
+            plugin_1 = self.plugin_manager.plugins[0]
+            self.assertEquals(['nginx-1', 'nginx-2'],
+                              [plugin.nginx_agent.status_host for plugin in self.plugin_manager.plugins])
+
+            discovery = self.plugin_manager.discoveries[0]
+            self.plugin_manager.discovery_callback(discovery)
+            self.assertEquals(2, len(self.plugin_manager.plugins))
+
+            _write_targets(targets_path, [{'StatusHost' : 'nginx-1'}, {'StatusHost' : 'nginx-3'}], 2000)
+            self.plugin_manager.discovery_callback(discovery)
+        finally:
+            shutil.rmtree(temp_dir)
+
+        self.assertEquals(['nginx-1', 'nginx-3'],
+                          [plugin.nginx_agent.status_host for plugin in self.plugin_manager.plugins])
+        self.assertIs(plugin_1, self.plugin_manager.plugins[0])
+        # A read callback for each target and one checking the targets file
+        self.assertEquals(4, mock_collectd.register_read.call_count)
+        mock_collectd.unregister_read.assert_called_once()
+
+    @patch('plugin.nginx_plus_collectd.collectd')
+    @patch('requests.Session')
+    def test_config_callback_sharded_fleet(self, mock_session_class, mock_collectd):
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = [1, 2, 3, 4, 5, 6, 7]
+        mock_session_class.return_value.get.return_value = mock_response
+
+        hosts = ['nginx-{}'.format(index) for index in range(20)]
+        owned_hosts = [host for host in hosts if ShardRing(['0', '1'], '1').owns('{}:8080'.format(host))]
+        mock_config = Mock()
+        mock_config.children = [_build_mock_config_child(SHARD_INDEX, '1'), _build_mock_config_child(SHARD_COUNT, '2')]
+        mock_config.children += [_build_mock_target(_build_mock_config_child(STATUS_HOST, host)) for host in hosts]
+
+        self.plugin_manager.config_callback(mock_config)
+
+        self.assertTrue(0 < len(owned_hosts) < len(hosts))
+        self.assertEquals(owned_hosts, [plugin.nginx_agent.status_host for plugin in self.plugin_manager.plugins])
+
+    @patch('requests.get')
+    def test_config_callback_skips_other_shard(self, mock_requests_get):
+        host = next(host for host in ('nginx-{}'.format(index) for index in range(20))
+                    if not ShardRing(['0', '1'], '0').owns('{}:8080'.format(host)))
+        mock_config = Mock()
+        mock_config.children = [_build_mock_config_child(STATUS_HOST, host),
+                                _build_mock_config_child(SHARD_INDEX, '0'), _build_mock_config_child(SHARD_COUNT, '2')]
+
+        self.plugin_manager.config_callback(mock_config)
+
+        self.assertEquals([], self.plugin_manager.plugins)
+        mock_requests_get.assert_not_called()
+
+    def test_config_callback_invalid_shard_index(self):
+        mock_config = Mock()
+        mock_config.children = [_build_mock_config_child(SHARD_INDEX, '2'), _build_mock_config_child(SHARD_COUNT, '2')]
+
+        with self.assertRaises(ValueError):
+            self.plugin_manager.config_callback(mock_config)
+
+    def test_read_plugin_callback(self):
+        mock_plugin = Mock()
+        mock_plugin.read_offset.return_value = 0
+
+        self.plugin_manager.read_plugin_callback(mock_plugin)
+
+        mock_plugin.read.assert_called_once()
+
     def test_read_callback(self):
         mock_plugin_1 = Mock()
+        mock_plugin_1.read_offset.return_value = 0
         mock_plugin_2 = Mock()
+        mock_plugin_2.read_offset.return_value = 0
 
         self.plugin_manager.plugins = [mock_plugin_1, mock_plugin_2]
         self.plugin_manager.read_callback()
@@ -66,9 +225,172 @@ class NginxPlusPluginManagerTest(TestCase):
         mock_plugin_1.read.assert_called()
         mock_plugin_2.read.assert_called()
 
+    @patch('plugin.nginx_plus_collectd.collectd')
+    def test_staggered_read_registered_after_offset(self, mock_collectd):
+        mock_plugin = Mock()
+        mock_plugin.read_offset.return_value = 4.5
+        mock_plugin.read_interval = None
+        mock_plugin.snapshot_listen = None
+        self.plugin_manager.staggered_reads = Mock()
+
+        self.plugin_manager._add_plugin(mock_plugin)
+
+        mock_collectd.register_read.assert_not_called()
+        self.plugin_manager.staggered_reads.add.assert_called_once_with(mock_plugin, 4.5)
+
+        # Removed before its registration is due
+        self.plugin_manager._remove_plugin(mock_plugin)
+        self.plugin_manager.staggered_reads.remove.assert_called_once_with(mock_plugin)
+        mock_collectd.unregister_read.assert_not_called()
+        self.plugin_manager._register_read(mock_plugin)
+        mock_collectd.register_read.assert_not_called()
+
+    @patch('plugin.nginx_plus_collectd.collectd')
+    @patch('plugin.nginx_plus_collectd.SnapshotServer')
+    def test_snapshot_servers_started_by_init(self, mock_server_class, mock_collectd):
+        mock_plugin_1 = _build_mock_plugin(snapshot_listen=8090)
+        mock_plugin_2 = _build_mock_plugin(snapshot_listen='/run/nginx-plus.sock')
+        mock_server_1, mock_server_2 = Mock(), Mock()
+        mock_server_class.side_effect = [mock_server_1, mock_server_2]
+
+        self.plugin_manager._add_plugin(mock_plugin_1)
+        # collectd may fork after its configuration, the server only starts from the init callback
+        mock_server_1.start.assert_not_called()
+        self.plugin_manager.init_callback()
+        mock_server_1.start.assert_called_once()
+
+        # Added after init, e.g. by a target discovery
+        self.plugin_manager._add_plugin(mock_plugin_2)
+        mock_server_2.start.assert_called_once()
+        self.assertIs(mock_server_2.store, mock_plugin_2.snapshot_store)
+
+        self.plugin_manager.shutdown_callback()
+        mock_server_1.close.assert_called_once()
+        mock_server_2.close.assert_called_once()
+
+    @patch('plugin.nginx_plus_collectd.collectd')
+    def test_plugins_added_from_read_threads(self, mock_collectd):
+        self.plugin_manager.init_callback()
+        plugins = self.plugin_manager.plugins
+        added_plugins = [_build_mock_plugin() for _ in range(40)]
+        add_threads = [threading.Thread(target=self.plugin_manager._add_plugin, args=(plugin,))
+                       for plugin in added_plugins]
+
+        for add_thread in add_threads:
+            add_thread.start()
+        for add_thread in add_threads:
+            add_thread.join()
+        self.plugin_manager.shutdown_callback()
+
+        # The list being iterated by a read is never changed
+        self.assertEquals([], plugins)
+        self.assertItemsEqual(added_plugins, self.plugin_manager.plugins)
+        self.assertEquals(40, mock_collectd.register_read.call_count)
+
+class StaggeredReadRegistrarTest(TestCase):
+    def test_register_after_offset(self):
+        registered = []
+        registered_event = threading.Event()
+        def register(plugin):
+            registered.append(plugin)
+            if len(registered) == 2:
+                registered_event.set()
+        registrar = StaggeredReadRegistrar(register)
+        plugin_1, plugin_2, plugin_3 = Mock(), Mock(), Mock()
+        registrar.add(plugin_1, 0.2)
+        registrar.add(plugin_2, 0)
+        registrar.add(plugin_3, 0.1)
+        registrar.remove(plugin_3)
+
+        # Nothing is registered until started from the init callback
+        time.sleep(0.3)
+        self.assertEquals([], registered)
+        registrar.start()
+        registered_event.wait(5)
+        registrar.close()
+
+        self.assertEquals([plugin_2, plugin_1], registered)
+
+class TargetDiscoveryTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_check_directory(self):
+        _write_targets(os.path.join(self.temp_dir, 'a.json'), [{'StatusHost' : 'nginx-1'}], 1000)
+        _write_targets(os.path.join(self.temp_dir, 'b.json'), {'Targets' : [{'StatusHost' : 'nginx-2'}]}, 1000)
+        _write_targets(os.path.join(self.temp_dir, 'README'), 'not targets', 1000)
+        discovery = TargetDiscovery(self.temp_dir, [])
+
+        self.assertTrue(discovery.check())
+        self.assertEquals([{'StatusHost' : 'nginx-1'}, {'StatusHost' : 'nginx-2'}], discovery.targets)
+        self.assertFalse(discovery.check())
+
+        os.remove(os.path.join(self.temp_dir, 'a.json'))
+        self.assertTrue(discovery.check())
+        self.assertEquals([{'StatusHost' : 'nginx-2'}], discovery.targets)
+
+    def test_invalid_file_keeps_targets(self):
+        targets_path = os.path.join(self.temp_dir, 'targets.json')
+        _write_targets(targets_path, [{'StatusHost' : 'nginx-1'}], 1000)
+        discovery = TargetDiscovery(targets_path, [])
+        discovery.check()
+
+        with open(targets_path, 'w') as targets_file:
+            targets_file.write('[{"StatusHost" : ')
+        os.utime(targets_path, (2000, 2000))
+
+        self.assertFalse(discovery.check())
+        self.assertEquals([{'StatusHost' : 'nginx-1'}], discovery.targets)
+
+class ShardRingTest(TestCase):
+    def test_targets_spread_across_members(self):
+        ring = ShardRing(['a', 'b', 'c'], 'a')
+        owners = [ring.owner('10.0.0.{}:8080'.format(index)) for index in range(300)]
+
+        for member in ('a', 'b', 'c'):
+            self.assertTrue(60 < owners.count(member) < 140)
+
+    def test_member_added_moves_few_targets(self):
+        keys = ['10.0.0.{}:8080'.format(index) for index in range(300)]
+        three_members = ShardRing(['a', 'b', 'c'], 'a')
+        four_members = ShardRing(['a', 'b', 'c', 'd'], 'a')
+
+        moved = [key for key in keys if three_members.owner(key) != four_members.owner(key)]
+
+        self.assertTrue(all(four_members.owner(key) == 'd' for key in moved))
+        self.assertTrue(len(moved) < 120)
+
+    def test_unknown_member(self):
+        with self.assertRaises(ValueError):
+            ShardRing(['a', 'b'], 'c')
+
+def _write_targets(path, targets, mtime):
+    with open(path, 'w') as targets_file:
+        json.dump(targets, targets_file)
+    os.utime(path, (mtime, mtime))
+
+def _build_mock_target(*children):
+    mock_target = Mock()
+    mock_target.key = TARGET
+    mock_target.values = []
+    mock_target.children = list(children)
+
+    return mock_target
+
 def _build_mock_config_child(key, value):
     mock_config_child = Mock()
     mock_config_child.key = key
     mock_config_child.values = [value]
 
     return mock_config_child
+
+def _build_mock_plugin(snapshot_listen=None):
+    mock_plugin = Mock()
+    mock_plugin.read_interval = None
+    mock_plugin.snapshot_listen = snapshot_listen
+    mock_plugin.read_offset.return_value = 0
+
+    return mock_plugin
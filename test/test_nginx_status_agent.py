@@ -1,10 +1,16 @@
 #!/usr/bin/env python
+import time
+import json
 import random
 import string
+import shutil
+import tempfile
+import threading
 from unittest import TestCase
 from requests import HTTPError
 from mock import Mock, patch, MagicMock
-from plugin.nginx_plus_collectd import NginxStatusAgent, DEFAULT_API_VERSION
+from plugin.nginx_plus_collectd import NginxStatusAgent, DEFAULT_API_VERSION, _parse_nginx_timestamp, CollectionStats,\
+                                        SharedPollCache, MAX_NAMED_OBJECT_FETCHES
 
 class NginxStatusAgentTest(TestCase):
     @patch('requests.get')
@@ -115,6 +121,128 @@ class NginxStatusAgentTest(TestCase):
         self.agent.get_upstreams()
         mock_requests_get.assert_called_with(expected_url, auth=None)
 
+    def test_get_named_upstreams(self):
+        self.agent._send_get = MagicMock(side_effect=lambda url, *args, **kwargs: None if url.endswith('missing')\
+                                         else {'peers' : []})
+
+        upstreams = self.agent.get_upstreams(['api backend', 'missing'])
+
+        self.assertDictEqual({'api backend' : {'peers' : []}}, upstreams)
+        self.agent._send_get.assert_any_call('{}/http/upstreams/api%20backend'.format(self.base_status_url),
+                                             self.agent._session, missing_ok=True)
+
+    @patch('plugin.nginx_plus_collectd.LOGGER')
+    def test_get_named_upstreams_missing_logged_at_debug(self, mock_logger):
+        self.agent._session = Mock()
+        self.agent._session.get.return_value = Mock(status_code=404)
+
+        upstreams = self.agent.get_upstreams(['missing'])
+
+        self.assertDictEqual({}, upstreams)
+        mock_logger.debug.assert_called_once()
+        self.assertFalse(mock_logger.error.called)
+
+    def test_get_many_named_upstreams_whole_collection(self):
+        upstreams_url = '{}/http/upstreams'.format(self.base_status_url)
+        names = ['upstream_{}'.format(i) for i in range(MAX_NAMED_OBJECT_FETCHES + 1)]
+        self.agent._session = Mock()
+        self.agent._session.get.return_value = _build_sized_response(dict((name, {}) for name in names))
+
+        self.agent.get_upstreams(names)
+
+        self.agent._session.get.assert_called_once_with(upstreams_url, auth=None)
+
+    def test_get_filtered_upstreams_full_fetch_first(self):
+        self.agent._session = Mock()
+        self.agent._session.get.return_value = _build_sized_response({'api' : {}, 'web' : {}})
+
+        upstreams = self.agent.get_upstreams(name_filter=lambda name: name == 'api')
+
+        self.assertDictEqual({'api' : {}, 'web' : {}}, upstreams)
+        self.agent._session.get.assert_called_once_with('{}/http/upstreams'.format(self.base_status_url), auth=None)
+        self.assertEquals(2, len(self.agent._collection_stats['{}/http/upstreams'.format(self.base_status_url)].names))
+
+    def test_get_filtered_upstreams_per_object_when_cheaper(self):
+        upstreams_url = '{}/http/upstreams'.format(self.base_status_url)
+        names = ['upstream_{}'.format(i) for i in range(100)]
+        self.agent._collection_stats[upstreams_url] = CollectionStats(500000, names)
+        self.agent._session = Mock()
+        self.agent._session.get.side_effect = lambda url, auth: _build_sized_response(
+            dict((name, {}) for name in names) if url.endswith('?fields=') else {'peers' : []})
+
+        upstreams = self.agent.get_upstreams(name_filter=lambda name: name in ('upstream_1', 'upstream_2'))
+
+        self.assertItemsEqual(['upstream_1', 'upstream_2'], upstreams.keys())
+        self.agent._session.get.assert_any_call('{}?fields='.format(upstreams_url), auth=None)
+        self.agent._session.get.assert_any_call('{}/upstream_1'.format(upstreams_url), auth=None)
+        self.assertEquals(3, self.agent._session.get.call_count)
+
+    def test_get_named_upstreams_whole_collection_when_cheaper(self):
+        upstreams_url = '{}/http/upstreams'.format(self.base_status_url)
+        self.agent._collection_stats[upstreams_url] = CollectionStats(1000, ['api', 'web'])
+        self.agent._session = Mock()
+        self.agent._session.get.return_value = _build_sized_response({'api' : {}, 'web' : {}})
+
+        self.agent.get_upstreams(['api', 'web'])
+
+        self.agent._session.get.assert_called_once_with(upstreams_url, auth=None)
+
+    def test_shared_session_and_object_fetch_pool(self):
+        mock_session = Mock()
+        mock_session.get.side_effect = _mocked_requests_get
+        mock_object_fetch_pool = Mock()
+        mock_object_fetch_pool.map.side_effect = map
+
+        agent = NginxStatusAgent(self.status_host, self.status_port, session=mock_session,
+                                 object_fetch_pool=mock_object_fetch_pool)
+        upstreams = agent.get_upstreams(['api', 'web'])
+        agent.close()
+
+        self.assertEquals(DEFAULT_API_VERSION, agent.api_version)
+        self.assertItemsEqual(['api', 'web'], upstreams.keys())
+        mock_object_fetch_pool.map.assert_called_once()
+        self.assertFalse(mock_object_fetch_pool.terminate.called)
+        self.assertFalse(mock_session.close.called)
+
+    def test_shared_poll_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            slabs_url = '{}/slabs'.format(self.base_status_url)
+            self.agent.shared_poll_cache = SharedPollCache(temp_dir, 60)
+            other_agent = NginxStatusAgent(self.status_host, self.status_port, api_version=4,
+                                           session=Mock(), object_fetch_pool=Mock())
+            other_agent.shared_poll_cache = SharedPollCache(temp_dir, 60)
+            other_agent._shared_session.reset_mock()
+            self.agent._session = Mock()
+            self.agent._session.get.return_value = _build_sized_response({'zone' : {'pages' : {'used' : 1}}})
+
+            slabs = self.agent._send_get(slabs_url, self.agent._session)
+            other_slabs = other_agent._send_get(slabs_url)
+        finally:
+            shutil.rmtree(temp_dir)
+
+        self.assertDictEqual({'zone' : {'pages' : {'used' : 1}}}, slabs)
+        self.assertDictEqual(slabs, other_slabs)
+        self.assertFalse(other_agent._shared_session.get.called)
+
+    def test_skip_unchanged_response_decoding(self):
+        slabs_url = '{}/slabs'.format(self.base_status_url)
+        self.agent.skip_unchanged_responses = True
+        self.agent._session = Mock()
+        first_response = _build_sized_response({'zone' : {'pages' : {'used' : 1}}})
+        self.agent._session.get.return_value = first_response
+
+        slabs = self.agent._send_get(slabs_url, self.agent._session)
+
+        unchanged_response = _build_sized_response({'zone' : {'pages' : {'used' : 1}}})
+        self.agent._session.get.return_value = unchanged_response
+        self.assertIs(slabs, self.agent._send_get(slabs_url, self.agent._session))
+        self.assertFalse(unchanged_response.json.called)
+
+        changed_response = _build_sized_response({'zone' : {'pages' : {'used' : 2}}})
+        self.agent._session.get.return_value = changed_response
+        self.assertDictEqual({'zone' : {'pages' : {'used' : 2}}}, self.agent._send_get(slabs_url, self.agent._session))
+
     @patch('requests.get')
     def test_get_stream_server_zones(self, mock_requests_get):
         expected_url = '{}/stream/server_zones'.format(self.base_status_url)
@@ -172,6 +300,28 @@ class NginxStatusAgentTest(TestCase):
         self.assertEquals(agent.api_version, 6)
         self.assertEquals(agent.api_base_path, '/api')
 
+    def test_get_nginx_timestamps(self):
+        self.agent._send_get = MagicMock(return_value={'timestamp' : '2021-10-11T05:55:23.459Z',
+                                                       'load_timestamp' : '2021-10-11T00:00:00Z'})
+
+        timestamp, load_timestamp = self.agent.get_nginx_timestamps()
+        self.assertAlmostEqual(1633931723.459, timestamp)
+        self.assertEquals(1633910400.0, load_timestamp)
+
+    def test_nginx_metadata_shared(self):
+        self.agent._send_get = MagicMock(return_value={'version' : '1.21.3', 'timestamp' : 1633931723459,
+                                                       'load_timestamp' : 1633910400000})
+
+        nginx_metadata = self.agent.get_nginx_metadata()
+        self.assertEquals('1.21.3', self.agent.get_nginx_version(nginx_metadata))
+        self.assertEquals((1633931723.459, 1633910400.0), self.agent.get_nginx_timestamps(nginx_metadata))
+        self.agent._send_get.assert_called_once_with(self.agent.nginx_metadata_url)
+
+    def test_parse_nginx_timestamp(self):
+        self.assertEquals(1633931723.459, _parse_nginx_timestamp(1633931723459))
+        self.assertIsNone(_parse_nginx_timestamp(None))
+        self.assertIsNone(_parse_nginx_timestamp('not a timestamp'))
+
     def test_validate_nginx_version_none(self):
         self.agent.get_nginx_version = MagicMock(return_value=None)
 
@@ -246,6 +396,71 @@ def _random_string(length=8):
 def _random_int(start=0, stop=100000):
     return random.randint(start, stop)
 
+def _build_sized_response(json_data):
+    response = Mock()
+    response.status_code = 200
+    response.json.return_value = json_data
+    response.content = json.dumps(json_data)
+    return response
+
+class SharedPollCacheTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = SharedPollCache(self.temp_dir, 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_fresh_response_reused(self):
+        fetch = Mock(return_value=_build_sized_response({'foo' : 'bar'}))
+
+        self.cache.get('http://nginx/api/4/slabs', fetch)
+        response = SharedPollCache(self.temp_dir, 10).get('http://nginx/api/4/slabs', fetch)
+
+        self.assertEquals(1, fetch.call_count)
+        self.assertEquals(200, response.status_code)
+        self.assertDictEqual({'foo' : 'bar'}, response.json())
+
+    def test_stale_response_fetched(self):
+        fetch = Mock(return_value=_build_sized_response({'foo' : 'a much longer bar'}))
+        self.cache.get('http://nginx/api/4/slabs', fetch)
+
+        fetch.return_value = _build_sized_response({'foo' : 'bat'})
+        with patch('time.time', return_value=time.time() + 10):
+            response = self.cache.get('http://nginx/api/4/slabs', fetch)
+            cached_response = self.cache.get('http://nginx/api/4/slabs', Mock())
+
+        self.assertEquals(2, fetch.call_count)
+        self.assertDictEqual({'foo' : 'bat'}, response.json())
+        self.assertDictEqual({'foo' : 'bat'}, cached_response.json())
+
+    def test_failed_response_not_cached(self):
+        failed_response = Mock()
+        failed_response.status_code = 500
+        fetch = Mock(return_value=failed_response)
+
+        self.assertIs(failed_response, self.cache.get('http://nginx/api/4/slabs', fetch))
+        self.cache.get('http://nginx/api/4/slabs', fetch)
+
+        self.assertEquals(2, fetch.call_count)
+
+    def test_concurrent_pollers_fetch_once(self):
+        fetch_count = []
+        def fetch():
+            fetch_count.append(1)
+            time.sleep(0.1)
+            return _build_sized_response({'foo' : 'bar'})
+
+        # Each cache opens its own file description, locked as another process would
+        pollers = [threading.Thread(target=SharedPollCache(self.temp_dir, 10).get,
+                                    args=('http://nginx/api/4/slabs', fetch)) for _ in range(8)]
+        for poller in pollers:
+            poller.start()
+        for poller in pollers:
+            poller.join()
+
+        self.assertEquals(1, len(fetch_count))
+
 def _mocked_requests_get(*args, **kwargs):
     class MockResponse:
         def __init__(self, json_data, status_code):
@@ -88,6 +88,14 @@ class NginxStatusAgentTest(TestCase):
         self.agent.get_nginx_version()
         mock_requests_get.assert_called_with(expected_url, auth=None)
 
+    @patch('requests.get')
+    def test_get_nginx_timestamps(self, mock_requests_get):
+        expected_url = '{}/nginx_version'.format(self.base_status_url)
+
+        # Only the version is fetched, the legacy metadata has no timestamps
+        self.assertEquals((None, None), self.agent.get_nginx_timestamps())
+        mock_requests_get.assert_called_once_with(expected_url, auth=None)
+
     @patch('requests.get')
     def test_get_nginx_address(self, mock_requests_get):
         expected_url = '{}/address'.format(self.base_status_url)
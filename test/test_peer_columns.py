@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+import sys
+from unittest import TestCase, skipIf
+from mock import Mock
+
+# Mock out the collectd module
+sys.modules['collectd'] = Mock()
+
+from plugin.nginx_plus_collectd import PeerColumns, numpy
+
+class PeerColumnsTest(TestCase):
+    use_numpy = False
+
+    def setUp(self):
+        self.containers_obj = {
+            'backend' : {'peers' : [
+                {'name' : '10.0.0.1:80', 'state' : 'up', 'requests' : 20, 'responses' : {'5xx' : 1}},
+                {'name' : '10.0.0.2:80', 'state' : 'unhealthy', 'requests' : 10}]},
+            'empty' : {'peers' : []}
+        }
+
+    def test_sums(self):
+        columns = self._build_columns(self.containers_obj)
+
+        self.assertEquals(self._by_container(columns, {'backend' : 30, 'empty' : None}), columns.sums('requests'))
+        self.assertEquals(self._by_container(columns, {'backend' : 1, 'empty' : None}), columns.sums('responses.5xx'))
+
+    def test_counts(self):
+        columns = self._build_columns(self.containers_obj)
+
+        self.assertEquals(self._by_container(columns, {'backend' : 2, 'empty' : 0}), columns.counts())
+        self.assertEquals(self._by_container(columns, {'backend' : 1, 'empty' : 0}), columns.counts('unhealthy'))
+        self.assertEquals(self._by_container(columns, {'backend' : 0, 'empty' : 0}), columns.counts('draining'))
+
+    def test_changed_keys(self):
+        previous = self._build_columns(self.containers_obj)
+        self.assertEquals(set(previous.keys), previous.changed_keys(None, ['requests']))
+
+        self.containers_obj['backend']['peers'][0]['requests'] += 1
+        self.containers_obj['backend']['peers'].append({'name' : '10.0.0.3:80', 'state' : 'up', 'requests' : 0})
+        columns = self._build_columns(self.containers_obj)
+
+        self.assertEquals(set([('backend', '10.0.0.1:80'), ('backend', '10.0.0.3:80')]),
+                          columns.changed_keys(previous, ['requests', 'responses.5xx']))
+        self.assertEquals(set(), columns.changed_keys(columns, ['requests', 'responses.5xx']))
+
+    def test_large_counters(self):
+        self.containers_obj['backend']['peers'][0]['requests'] = 2 ** 53 + 1
+        self.containers_obj['backend']['peers'][1]['requests'] = 2 ** 64
+        previous = self._build_columns(self.containers_obj)
+        self.containers_obj['backend']['peers'][1]['requests'] += 1
+        columns = self._build_columns(self.containers_obj)
+
+        self.assertEquals(self._by_container(columns, {'backend' : 2 ** 64 + 2 ** 53 + 2, 'empty' : None}),
+                          columns.sums('requests'))
+        self.assertEquals(set([('backend', '10.0.0.2:80')]), columns.changed_keys(previous, ['requests']))
+
+        del self.containers_obj['backend']['peers'][1]
+        columns = self._build_columns(self.containers_obj)
+        self.assertEquals(self._by_container(columns, {'backend' : 2 ** 53 + 1, 'empty' : None}),
+                          columns.sums('requests'))
+
+    def _build_columns(self, containers_obj):
+        return PeerColumns(containers_obj, ['requests', 'responses.5xx'], self.use_numpy)
+
+    def _by_container(self, columns, values):
+        return [values[container_name] for container_name in columns.container_names]
+
+@skipIf(numpy is None, 'NumPy is not installed')
+class NumpyPeerColumnsTest(PeerColumnsTest):
+    use_numpy = True
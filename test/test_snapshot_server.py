@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import socket
+import shutil
+import tempfile
+from unittest import TestCase
+import requests
+from mock import Mock
+
+# Mock out the collectd module
+sys.modules['collectd'] = Mock()
+
+from plugin.nginx_plus_collectd import SnapshotStore, SnapshotServer, _str_to_snapshot_address
+
+class SnapshotStoreTest(TestCase):
+    def setUp(self):
+        self.store = SnapshotStore()
+
+    def test_snapshot_json(self):
+        self.store.put('nginx-1:8080', 'connections', {'active' : 1})
+
+        snapshot = json.loads(self.store.snapshot_json('nginx-1:8080', 'connections'))
+
+        self.assertEquals('nginx-1:8080', snapshot['target'])
+        self.assertEquals('connections', snapshot['section'])
+        self.assertDictEqual({'active' : 1}, snapshot['data'])
+        self.assertTrue(0 <= snapshot['age'] < 60)
+        self.assertIsNone(self.store.snapshot_json('nginx-1:8080', 'caches'))
+
+    def test_serialized_when_first_served(self):
+        self.store.put('nginx-1:8080', 'connections', {'active' : 1})
+        self.assertIsNone(self.store._snapshots[('nginx-1:8080', 'connections')].json_bytes)
+
+        self.store.snapshot_json('nginx-1:8080', 'connections')
+
+        self.assertEquals('{"active":1}', self.store._snapshots[('nginx-1:8080', 'connections')].json_bytes)
+
+    def test_unchanged_response_not_serialized_again(self):
+        status_json = {'active' : 1}
+        self.store.put('nginx-1:8080', 'connections', status_json)
+        self.store.snapshot_json('nginx-1:8080', 'connections')
+        json_bytes = self.store._snapshots[('nginx-1:8080', 'connections')].json_bytes
+
+        self.store.put('nginx-1:8080', 'connections', status_json)
+
+        self.assertIsNotNone(json_bytes)
+
+        self.assertIs(json_bytes, self.store._snapshots[('nginx-1:8080', 'connections')].json_bytes)
+
+    def test_index_and_remove_target(self):
+        self.store.put('nginx-1:8080', 'connections', {'active' : 1})
+        self.store.put('nginx-1:8080', 'caches', {})
+        self.store.put('nginx-2:8080', 'connections', {'active' : 2})
+
+        self.store.remove_target('nginx-2:8080')
+
+        index = json.loads(self.store.index_json())['targets']
+        self.assertEquals(['nginx-1:8080'], index.keys())
+        self.assertItemsEqual(['connections', 'caches'], index['nginx-1:8080'].keys())
+
+    def test_snapshot_address(self):
+        self.assertEquals(8090, _str_to_snapshot_address('8090'))
+        self.assertEquals('/run/nginx-plus.sock', _str_to_snapshot_address('/run/nginx-plus.sock'))
+        with self.assertRaises(ValueError):
+            _str_to_snapshot_address('run/nginx-plus.sock')
+
+        # An existing file is only replaced if it is a unix socket
+        temp_dir = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(temp_dir, 'nginx-plus.conf')
+            open(file_path, 'w').close()
+            with self.assertRaises(ValueError):
+                _str_to_snapshot_address(file_path)
+        finally:
+            shutil.rmtree(temp_dir)
+
+class SnapshotServerTest(TestCase):
+    def setUp(self):
+        self.store = SnapshotStore()
+        self.store.put('nginx-1:8080', 'upstreams', {'backend' : {'peers' : []}})
+
+    def test_http(self):
+        server = SnapshotServer(0, self.store)
+        server.start()
+        try:
+            base_url = 'http://127.0.0.1:{}'.format(server._server.server_address[1])
+
+            snapshot_response = requests.get('{}/targets/nginx-1%3A8080/upstreams'.format(base_url))
+            index_response = requests.get(base_url)
+            missing_response = requests.get('{}/targets/nginx-1%3A8080/caches'.format(base_url))
+        finally:
+            server.close()
+
+        self.assertEquals(200, snapshot_response.status_code)
+        self.assertEquals('application/json', snapshot_response.headers['Content-Type'])
+        self.assertDictEqual({'backend' : {'peers' : []}}, snapshot_response.json()['data'])
+        self.assertEquals(['upstreams'], index_response.json()['targets']['nginx-1:8080'].keys())
+        self.assertEquals(404, missing_response.status_code)
+
+    def test_unix_socket(self):
+        temp_dir = tempfile.mkdtemp()
+        socket_path = os.path.join(temp_dir, 'snapshots.sock')
+        server = SnapshotServer(socket_path, self.store)
+        server.start()
+        try:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(socket_path)
+            client.sendall('GET /targets/nginx-1:8080/upstreams HTTP/1.0\r\n\r\n')
+            response = ''
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                response += data
+            client.close()
+        finally:
+            server.close()
+            shutil.rmtree(temp_dir)
+
+        status_line, _, body = response.partition('\r\n\r\n')
+        self.assertTrue(status_line.startswith('HTTP/1.0 200'))
+        self.assertDictEqual({'backend' : {'peers' : []}}, json.loads(body)['data'])
+        self.assertFalse(os.path.exists(socket_path))
+
+    def test_unix_socket_path_not_a_socket(self):
+        temp_dir = tempfile.mkdtemp()
+        file_path = os.path.join(temp_dir, 'snapshots.sock')
+        with open(file_path, 'w') as regular_file:
+            regular_file.write('keep me')
+        server = SnapshotServer(file_path, self.store)
+        try:
+            with self.assertRaises(ValueError):
+                server.start()
+            server.close()
+            with open(file_path) as regular_file:
+                self.assertEquals('keep me', regular_file.read())
+        finally:
+            shutil.rmtree(temp_dir)
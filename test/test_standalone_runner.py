@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+from mock import Mock, MagicMock, patch
+
+# Mock out the collectd module
+sys.modules['collectd'] = Mock()
+
+from plugin.nginx_plus_collectd import StandaloneRunner, ReadScheduler, PutvalOutput, JsonLinesOutput, HttpOutput,\
+                                        CollectdMock, RUNNER_WAKEUP_INTERVAL, _target_to_config
+
+class StandaloneRunnerTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.temp_dir, 'runner.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_target_to_config(self):
+        config = _target_to_config({'StatusHost' : 'localhost', 'StatusPort' : 8080, 'Upstream' : True,
+                                    'Dimension' : [['foo', 'bar'], ['bat', 'baz']],
+                                    'MetricGroupInterval' : ['caches', 6]})
+
+        children = sorted((child.key, child.values) for child in config.children)
+        self.assertEquals([('Dimension', ['bat', 'baz']), ('Dimension', ['foo', 'bar']),
+                           ('MetricGroupInterval', ['caches', '6']), ('StatusHost', ['localhost']),
+                           ('StatusPort', ['8080']), ('Upstream', ['true'])], children)
+
+    @patch('plugin.nginx_plus_collectd.NginxPlusPlugin')
+    def test_load(self, mock_plugin_class):
+        mock_plugin_class.return_value.snapshot_listen = None
+        self._write_config({'Interval' : 30, 'ReadThreads' : 1, 'Output' : {'Type' : 'json'},
+                            'Targets' : [{'StatusHost' : 'nginx-1'}, {'StatusHost' : 'nginx-2', 'Interval' : 5}]})
+        runner = StandaloneRunner(self.config_path)
+
+        runner.load()
+
+        self.assertEquals([30, 5], [scheduled_read.interval for scheduled_read in runner.scheduler.reads])
+        self.assertIsInstance(runner.output, JsonLinesOutput)
+        configure_calls = mock_plugin_class.return_value.configure.call_args_list
+        configured_hosts = [call[0][0].children[0].values[0] for call in configure_calls]
+        self.assertEquals(['nginx-1', 'nginx-2'], configured_hosts)
+
+    @patch('plugin.nginx_plus_collectd.NginxPlusPlugin')
+    def test_reload_keeps_configuration_on_error(self, mock_plugin_class):
+        mock_plugin_class.return_value.snapshot_listen = None
+        self._write_config({'Targets' : [{'StatusHost' : 'nginx-1'}], 'Output' : {'Type' : 'json'}})
+        runner = StandaloneRunner(self.config_path)
+        runner.load()
+        scheduler = runner.scheduler
+
+        self._write_config({'Targets' : [{'StatusHost' : 'nginx-1'}], 'Output' : {'Type' : 'carrier pigeon'}})
+        self.assertRaises(ValueError, runner.load)
+
+        self.assertIs(scheduler, runner.scheduler)
+        self.assertFalse(mock_plugin_class.return_value.close.called)
+
+    @patch('plugin.nginx_plus_collectd.NginxPlusPlugin')
+    def test_load_closes_configured_plugins_on_error(self, mock_plugin_class):
+        plugins = [Mock(snapshot_listen=None, read_offset=Mock(return_value=0)) for _ in range(2)]
+        plugins[1].configure.side_effect = ValueError('Invalid configuration')
+        mock_plugin_class.side_effect = plugins
+        self._write_config({'Targets' : [{'StatusHost' : 'nginx-1'}, {'StatusHost' : 'nginx-2'}],
+                            'Output' : {'Type' : 'json'}})
+        runner = StandaloneRunner(self.config_path)
+
+        self.assertRaises(ValueError, runner.load)
+
+        self.assertIsNone(runner.scheduler)
+        self.assertTrue(all(plugin.close.called for plugin in plugins))
+
+    @patch('plugin.nginx_plus_collectd.SnapshotServer')
+    @patch('plugin.nginx_plus_collectd.NginxPlusPlugin')
+    def test_reload_closes_previous_snapshot_servers(self, mock_plugin_class, mock_server_class):
+        mock_plugin_class.return_value.snapshot_listen = 9100
+        mock_plugin_class.return_value.read_offset.return_value = 0
+        calls = Mock()
+        servers = [getattr(calls, 'server_{}'.format(index)) for index in range(2)]
+        mock_server_class.side_effect = servers
+        self._write_config({'Targets' : [{'StatusHost' : 'nginx-1'}], 'Output' : {'Type' : 'json'}})
+        runner = StandaloneRunner(self.config_path)
+
+        runner.load()
+        runner.load()
+
+        self.assertEquals(['server_0.start', 'server_0.close', 'server_1.start'],
+                          [call[0] for call in calls.method_calls])
+        self.assertEquals({9100 : servers[1]}, runner.snapshot_servers)
+
+    @patch('signal.signal')
+    @patch('time.sleep')
+    def test_run_until_stop_requested(self, mock_sleep, _):
+        runner = StandaloneRunner(self.config_path)
+        runner.load = Mock()
+        runner.scheduler = Mock()
+        runner.scheduler.run_pending.side_effect = lambda now: now + 60
+        runner.output = Mock()
+        # A reload then a stop, requested by signals landing during the sleeps
+        mock_sleep.side_effect = lambda seconds: runner.request_stop() if runner.load.call_count > 1\
+            else runner.request_reload()
+
+        runner.run()
+
+        self.assertEquals(2, runner.load.call_count)
+        self.assertTrue(all(call[0][0] <= RUNNER_WAKEUP_INTERVAL for call in mock_sleep.call_args_list))
+        self.assertTrue(runner.scheduler.close.called)
+        self.assertTrue(runner.output.close.called)
+
+    def _write_config(self, config):
+        with open(self.config_path, 'w') as config_file:
+            json.dump(config, config_file)
+
+class ReadSchedulerTest(TestCase):
+    def setUp(self):
+        self.after_read = Mock()
+        self.scheduler = ReadScheduler(1, self.after_read)
+
+    def test_run_pending(self):
+        fast_plugin = Mock()
+        slow_plugin = Mock()
+        self.scheduler.add(fast_plugin, 10, now=0)
+        self.scheduler.add(slow_plugin, 30, now=0)
+
+        for now in range(0, 60, 5):
+            next_time = self.scheduler.run_pending(now)
+
+        self.assertEquals(6, fast_plugin.read.call_count)
+        self.assertEquals(2, slow_plugin.read.call_count)
+        self.assertEquals(8, self.after_read.call_count)
+        self.assertEquals(60, next_time)
+
+    def test_missed_intervals_skipped(self):
+        plugin = Mock()
+        self.scheduler.add(plugin, 10, now=0)
+
+        self.scheduler.run_pending(0)
+        next_time = self.scheduler.run_pending(35)
+
+        self.assertEquals(2, plugin.read.call_count)
+        self.assertEquals(40, next_time)
+
+    def test_read_offset(self):
+        plugin = Mock()
+        self.scheduler.add(plugin, 10, now=0, offset=23)
+
+        self.assertEquals(3, self.scheduler.run_pending(0))
+        self.scheduler.run_pending(3)
+        next_time = self.scheduler.run_pending(13)
+
+        self.assertEquals(2, plugin.read.call_count)
+        self.assertEquals(23, next_time)
+
+    def test_failed_read_rescheduled(self):
+        plugin = Mock()
+        plugin.read.side_effect = RuntimeError('Thrown from test_failed_read_rescheduled')
+        self.scheduler.add(plugin, 10, now=0)
+
+        self.scheduler.run_pending(0)
+        self.scheduler.run_pending(10)
+
+        self.assertEquals(2, plugin.read.call_count)
+        self.assertFalse(self.scheduler.reads[0].running)
+
+class OutputTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.temp_dir, 'output')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_putval_output(self):
+        output = PutvalOutput(self.output_path)
+        self._dispatch_values(output)
+        output.close()
+
+        with open(self.output_path) as output_file:
+            self.assertEquals('PUTVAL "my_host/nginx-plus-my_plugin[]/counter-connections.accepted" 1500000000:42\n',
+                              output_file.read())
+
+    def test_json_lines_output(self):
+        output = JsonLinesOutput(self.output_path)
+        self._dispatch_values(output)
+        output.close()
+
+        with open(self.output_path) as output_file:
+            written = json.loads(output_file.readline())
+        self.assertEquals([42], written['values'])
+        self.assertEquals(['counter'], written['dstypes'])
+        self.assertEquals('connections.accepted', written['type_instance'])
+
+    def test_http_output(self):
+        output = HttpOutput('http://localhost:9080/v1/collectd')
+        output._session = Mock()
+        output._session.post.return_value.status_code = 200
+
+        output.flush()
+        self.assertFalse(output._session.post.called)
+
+        self._dispatch_values(output)
+        self._dispatch_values(output)
+        output.flush()
+
+        self.assertEquals(1, output._session.post.call_count)
+        self.assertEquals(2, len(json.loads(output._session.post.call_args[1]['data'])))
+
+    def _dispatch_values(self, output):
+        values = CollectdMock(output).Values()
+        values.host = 'my_host'
+        values.time = 1500000000
+        values.plugin = 'nginx-plus'
+        values.plugin_instance = 'my_plugin[]'
+        values.type = 'counter'
+        values.type_instance = 'connections.accepted'
+        values.values = [42]
+        values.dispatch()